@@ -0,0 +1,452 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import sqlite3
+import string
+import subprocess
+import sys
+import tempfile
+from datetime import datetime, timezone
+from time import perf_counter, sleep
+from urllib.parse import urlencode
+
+# Load test for both apps at different database sizes, saved as JSON so runs from
+# different commits can be compared.
+#
+# For each app and size it:
+# 1. Makes a database with that many words (dictionary) or products (cafe), plus
+#    categories, users and a test user to log in as. These are random but the same
+#    every time (for the same --seed), and they're kept in benchmarks/data/ so the big
+#    ones only have to be made once. Each run uses a copy, so they don't change.
+# 2. Starts the app with gunicorn on the copy, like in production.
+# 3. Sends requests to each route for a while, keeping --concurrency of them going at
+#    once, and measures how long they take. The Server-Timing header from
+#    shared/instrumentation.py is read as well, to show how much of that was SQL, templates
+#    and bcrypt.
+#
+# The results (latency percentiles, requests per second, errors) are printed and saved
+# to benchmarks/results/<date>-<commit>.json. Give an older results file to --compare
+# to see what's got faster or slower since then.
+#
+# Some routes show every row at once (e.g. the cafe's /menu lists every product), so
+# at a million rows they can take longer than --timeout and use a lot of memory.
+# Those requests count as errors. Use --routes to leave them out.
+#
+# Needs gunicorn as well as the things in requirements.txt (`pip install gunicorn`).
+#
+# Usage (from the root of the repo):
+# ```
+# python benchmarks/load_test.py                                  # everything (slow)
+# python benchmarks/load_test.py --apps cafe --rows 1000 --seconds 5
+# python benchmarks/load_test.py --rows 1000 --compare benchmarks/results/20260101-120000-abc1234.json
+# ```
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_FOLDER = os.path.join(ROOT, "benchmarks", "data")
+RESULTS_FOLDER = os.path.join(ROOT, "benchmarks", "results")
+
+# Change this when the made up data changes, so old databases in DATA_FOLDER aren't used
+DATA_VERSION = 1
+
+USERNAME = "load-test-user"
+PASSWORD = "correct horse battery staple"
+# Random users as well as the test user
+USERS = 1000
+
+# The cafe's product photos, so the menu has real images to link to
+CAFE_IMAGES = ["flatwhite.jpg", "latte.jpg", "espresso.jpg", "longblack.jpg", "chemex.jpg", "v60.jpg", "moka.jpg"]
+CAFE_SIZES = ["60mL", "90mL", "180mL", "240mL", "400mL", "600mL"]
+
+
+def category_count(rows: int) -> int:
+    # About 100 rows in each category, but with no more than 100 categories
+    # (both apps show every category on every page)
+    return max(5, min(100, rows // 100))
+
+
+def random_word(rng: random.Random, length: int) -> str:
+    return "".join(rng.choices(string.ascii_lowercase, k=length))
+
+
+def fill_dictionary(connection: sqlite3.Connection, rows: int, rng: random.Random, password_hash: str):
+    connection.execute(
+        "INSERT INTO Users (Username, Teacher, PasswordHash) VALUES (?, 0, ?)", [USERNAME, password_hash]
+    )
+    connection.executemany(
+        "INSERT INTO Users (Username, Teacher, PasswordHash) VALUES (?, ?, 'not a real hash')",
+        ((f"user{i}", i % 10 == 0) for i in range(USERS)),
+    )
+    connection.executemany(
+        "INSERT INTO Categories (EnglishName) VALUES (?)",
+        ((random_word(rng, 8),) for _ in range(category_count(rows))),
+    )
+    connection.executemany(
+        """INSERT INTO Words (MaoriSpelling, EnglishSpelling, EnglishDefinition,
+            YearLevelFirstEncountered, CreatedBy, CreatedAt, CategoryID)
+            VALUES (?, ?, ?, ?, ?, ?, ?)""",
+        (
+            (
+                random_word(rng, rng.randint(3, 12)),
+                random_word(rng, rng.randint(3, 12)),
+                " ".join(random_word(rng, rng.randint(2, 9)) for _ in range(8)),
+                rng.randint(0, 13),
+                rng.randint(1, USERS + 1),
+                0,
+                rng.randint(1, category_count(rows)),
+            )
+            for _ in range(rows)
+        ),
+    )
+
+
+def fill_cafe(connection: sqlite3.Connection, rows: int, rng: random.Random, password_hash: str):
+    # Start from nothing, since the migrations add the real menu
+    connection.execute("DELETE FROM Products")
+    connection.execute("DELETE FROM Categories")
+    connection.execute("DELETE FROM sqlite_sequence WHERE name IN ('Products', 'Categories')")
+    connection.execute(
+        "INSERT INTO Users (admin, display_name, username, password) VALUES (0, 'Load test', ?, ?)",
+        [USERNAME, password_hash],
+    )
+    connection.executemany(
+        "INSERT INTO Users (admin, display_name, username, password) VALUES (?, ?, ?, 'not a real hash')",
+        ((i % 50 == 0, random_word(rng, 6), f"user{i}") for i in range(USERS)),
+    )
+    connection.executemany(
+        "INSERT INTO Categories (name) VALUES (?)",
+        ((random_word(rng, 8),) for _ in range(category_count(rows))),
+    )
+    connection.executemany(
+        "INSERT INTO Products (name, description, size, image_path, price, category_id) VALUES (?, ?, ?, ?, ?, ?)",
+        (
+            (
+                random_word(rng, rng.randint(4, 12)),
+                " ".join(random_word(rng, rng.randint(2, 9)) for _ in range(10)),
+                rng.choice(CAFE_SIZES),
+                rng.choice(CAFE_IMAGES),
+                rng.randint(30, 90) / 10,
+                rng.randint(1, category_count(rows)),
+            )
+            for _ in range(rows)
+        ),
+    )
+
+
+# Routes for each app: name -> function(rng, rows) returning (method, path, form)
+APPS = {
+    "dictionary": {
+        "folder": "internal-1-dictionary",
+        "database": "dictionary.db",
+        "module": "app:server",
+        "env_prefix": "DICTIONARY_",
+        "version_file": "CACHE_VERSION_FILE",
+        "fill": fill_dictionary,
+        "routes": {
+            "/": lambda rng, rows: ("GET", "/", None),
+            "/words/<id>": lambda rng, rows: ("GET", f"/words/{rng.randint(1, rows)}", None),
+            "/categories/<id>": lambda rng, rows: ("GET", f"/categories/{rng.randint(1, category_count(rows))}", None),
+            "login": lambda rng, rows: (
+                "POST", "/login", {"log-in-username": USERNAME, "log-in-password": PASSWORD}
+            ),
+        },
+    },
+    "cafe": {
+        "folder": "cafe-thingy",
+        "database": "smile.sqlite",
+        "module": "server:server",
+        "env_prefix": "SMILE_",
+        "version_file": "MENU_CACHE_VERSION_FILE",
+        "fill": fill_cafe,
+        "routes": {
+            "/": lambda rng, rows: ("GET", "/", None),
+            "/menu": lambda rng, rows: ("GET", "/menu", None),
+            "/menu/<id>": lambda rng, rows: ("GET", f"/menu/{rng.randint(1, category_count(rows))}", None),
+            "login": lambda rng, rows: ("POST", "/auth/login", {"username": USERNAME, "password": PASSWORD}),
+        },
+    },
+}
+
+
+def make_database(app: str, rows: int, seed: int, rounds: int) -> str:
+    # Get the made up database for an app and size, making it if it's not there yet
+    config = APPS[app]
+    name, extension = os.path.splitext(config["database"])
+    path = os.path.join(DATA_FOLDER, f"{name}-{rows}-seed{seed}-rounds{rounds}-v{DATA_VERSION}{extension}")
+    if os.path.exists(path):
+        return path
+
+    os.makedirs(DATA_FOLDER, exist_ok=True)
+    print(f"Making a {app} database with {rows} rows (only needed the first time)...", flush=True)
+    partial = path + ".partial"
+    if os.path.exists(partial):
+        os.remove(partial)
+
+    # Create the tables with the app's own migrations
+    folder = os.path.join(ROOT, config["folder"])
+    subprocess.run([sys.executable, "migrate.py", "--database", partial], cwd=folder, check=True,
+                   stdout=subprocess.DEVNULL)
+
+    sys.path.insert(0, ROOT)
+    from shared.passwords import hash_password
+
+    connection = sqlite3.connect(partial)
+    # Nothing's lost if this crashes part way, so don't bother waiting for the disk
+    connection.execute("PRAGMA synchronous = OFF")
+    with connection:
+        config["fill"](connection, rows, random.Random(seed), hash_password(PASSWORD, rounds))
+    connection.execute("PRAGMA journal_mode = DELETE")
+    connection.close()
+    os.rename(partial, path)
+    return path
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(app: str, port: int, database: str, args) -> subprocess.Popen:
+    config = APPS[app]
+    prefix = config["env_prefix"]
+    env = dict(os.environ)
+    env[prefix + "DB_PATH"] = database
+    # Keep the cache version file with the copied database
+    env[prefix + config["version_file"]] = database + ".version"
+    env[prefix + "BCRYPT_ROUNDS"] = str(args.rounds)
+    # Everyone logs in as the same user from the same address, which would be rate limited
+    env[prefix + "RATE_LIMITS"] = "0"
+    process = subprocess.Popen(
+        [
+            sys.executable, "-m", "gunicorn", config["module"],
+            "--bind", f"127.0.0.1:{port}", "--workers", str(args.workers),
+            "--worker-class", "gthread", "--threads", str(args.threads),
+            "--timeout", str(int(args.timeout) + 30),
+        ],
+        cwd=os.path.join(ROOT, config["folder"]), env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+
+    # Wait for it to start listening
+    for _ in range(300):
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.1).close()
+            return process
+        except OSError:
+            sleep(0.1)
+    process.kill()
+    raise RuntimeError(f"The {app} server didn't start")
+
+
+def parse_server_timing(header: str) -> dict:
+    # `total;dur=12.5, sql;dur=3.1;desc="4 queries"` -> {"total": 12.5, "sql": 3.1}
+    timings = {}
+    for part in header.split(","):
+        name, *params = part.strip().split(";")
+        for param in params:
+            if param.startswith("dur="):
+                timings[name] = float(param[4:])
+    return timings
+
+
+async def request(port: int, method: str, path: str, form: dict = None) -> tuple:
+    # Do one HTTP request and return (status code, Server-Timing values).
+    # (A tiny HTTP client, so the test doesn't need anything else installed.)
+    body = urlencode(form or {}).encode()
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    try:
+        writer.write(
+            f"{method} {path} HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n"
+            f"Content-Type: application/x-www-form-urlencoded\r\nContent-Length: {len(body)}\r\n\r\n".encode()
+            + body
+        )
+        await writer.drain()
+        response = await reader.read()
+    finally:
+        writer.close()
+    head = response.split(b"\r\n\r\n", 1)[0].decode("latin-1")
+    status = int(head[9:12]) if head.startswith("HTTP/") else 0
+    timings = {}
+    for line in head.split("\r\n")[1:]:
+        name, _, value = line.partition(":")
+        if name.lower() == "server-timing":
+            timings = parse_server_timing(value)
+    return status, timings
+
+
+def percentile(values: list, p: float) -> float:
+    # values must be sorted
+    return values[min(len(values) - 1, int(len(values) * p))] * 1000
+
+
+async def load(port: int, route, rows: int, rng: random.Random, concurrency: int, seconds: float, timeout: float):
+    # Keep `concurrency` requests going for `seconds`, and return the results for them
+    latencies = []
+    errors = {}
+    server_timings = {}
+    finish_at = perf_counter() + seconds
+
+    async def client():
+        while perf_counter() < finish_at:
+            method, path, form = route(rng, rows)
+            started = perf_counter()
+            try:
+                status, timings = await asyncio.wait_for(request(port, method, path, form), timeout)
+            except asyncio.TimeoutError:
+                errors["timeout"] = errors.get("timeout", 0) + 1
+                continue
+            except OSError as e:
+                errors[type(e).__name__] = errors.get(type(e).__name__, 0) + 1
+                continue
+            if not 200 <= status < 400:
+                errors[str(status)] = errors.get(str(status), 0) + 1
+                continue
+            latencies.append(perf_counter() - started)
+            for name, value in timings.items():
+                server_timings[name] = server_timings.get(name, 0.0) + value
+
+    started = perf_counter()
+    await asyncio.gather(*[client() for _ in range(concurrency)])
+    elapsed = perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "requests_per_second": len(latencies) / elapsed,
+        "p50": percentile(latencies, 0.50) if latencies else None,
+        "p95": percentile(latencies, 0.95) if latencies else None,
+        "p99": percentile(latencies, 0.99) if latencies else None,
+        "max": latencies[-1] * 1000 if latencies else None,
+        # Average milliseconds per request, from the Server-Timing header
+        "server_timing": {name: total / len(latencies) for name, total in server_timings.items()} if latencies else {},
+    }
+
+
+def git_commit() -> dict:
+    def git(*command):
+        result = subprocess.run(["git", *command], cwd=ROOT, capture_output=True, text=True)
+        return result.stdout.strip() if result.returncode == 0 else None
+
+    return {
+        "commit": git("rev-parse", "--short", "HEAD"),
+        # Whether there were changes that weren't committed yet
+        "dirty": bool(git("status", "--porcelain", "--untracked-files=no")),
+    }
+
+
+def ms(value) -> str:
+    return f"{value:>8.1f}" if value is not None else f"{'-':>8}"
+
+
+def show(result: dict):
+    timing = result["server_timing"]
+    errors = sum(result["errors"].values())
+    print(
+        f"{result['app']:<11} {result['rows']:>8} {result['route']:<17} {result['requests_per_second']:>7.1f}"
+        f" {ms(result['p50'])} {ms(result['p95'])} {ms(result['p99'])} {errors:>6}"
+        f" {ms(timing.get('sql'))} {ms(timing.get('template'))} {ms(timing.get('bcrypt'))}",
+        flush=True,
+    )
+
+
+def compare(results: list, old_file: str):
+    # Show how the results changed since an older run
+    with open(old_file) as f:
+        old = json.load(f)
+    old_results = {(r["app"], r["rows"], r["route"]): r for r in old["results"]}
+
+    def change(new, before) -> str:
+        if new is None or not before:
+            return f"{'-':>8}"
+        return f"{(new - before) / before * 100:>+7.0f}%"
+
+    print()
+    print(f"Compared with {old['git']['commit']} ({old['date']}). Lower p50/p95/p99 and higher req/s are better.")
+    print(f"{'app':<11} {'rows':>8} {'route':<17} {'req/s':>8} {'p50':>8} {'p95':>8} {'p99':>8}")
+    for result in results:
+        before = old_results.get((result["app"], result["rows"], result["route"]))
+        if before is None:
+            continue
+        print(
+            f"{result['app']:<11} {result['rows']:>8} {result['route']:<17}"
+            f" {change(result['requests_per_second'], before['requests_per_second'])}"
+            f" {change(result['p50'], before['p50'])} {change(result['p95'], before['p95'])}"
+            f" {change(result['p99'], before['p99'])}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test both apps with different amounts of data")
+    parser.add_argument("--apps", nargs="+", choices=APPS, default=list(APPS))
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 100000, 1000000],
+                        help="Words (dictionary) or products (cafe) in the database")
+    parser.add_argument("--routes", nargs="+", help="Only test these routes, e.g. / /words/<id> login")
+    parser.add_argument("--seconds", type=float, default=10, help="How long to test each route for")
+    parser.add_argument("--concurrency", type=int, default=10, help="Requests in flight at once")
+    parser.add_argument("--login-concurrency", type=int, default=2,
+                        help="Log in requests in flight at once (bcrypt is slow on purpose, so keep this low)")
+    parser.add_argument("--timeout", type=float, default=30, help="Seconds before a request counts as failed")
+    parser.add_argument("--workers", type=int, default=2, help="gunicorn worker processes")
+    parser.add_argument("--threads", type=int, default=8, help="gunicorn threads per worker")
+    parser.add_argument("--rounds", type=int, default=12, help="bcrypt cost factor for the test user")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed for the data and requests")
+    parser.add_argument("--output", help="Where to save the results (default: benchmarks/results/<date>-<commit>.json)")
+    parser.add_argument("--compare", help="An older results file to compare with")
+    args = parser.parse_args()
+
+    run = {
+        "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "git": git_commit(),
+        "machine": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+        "settings": {
+            name: getattr(args, name)
+            for name in ["seconds", "concurrency", "login_concurrency", "timeout", "workers", "threads", "rounds", "seed"]
+        },
+        "results": [],
+    }
+
+    print(f"{'app':<11} {'rows':>8} {'route':<17} {'req/s':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}"
+          f" {'errors':>6} {'sql ms':>8} {'jinja ms':>8} {'bcrypt':>8}")
+
+    for app in args.apps:
+        routes = {name: route for name, route in APPS[app]["routes"].items() if not args.routes or name in args.routes}
+        if not routes:
+            continue
+        for rows in args.rows:
+            seeded = make_database(app, rows, args.seed, args.rounds)
+            with tempfile.TemporaryDirectory() as folder:
+                database = os.path.join(folder, APPS[app]["database"])
+                shutil.copy(seeded, database)
+                port = free_port()
+                process = start_server(app, port, database, args)
+                try:
+                    rng = random.Random(args.seed)
+                    for name, route in routes.items():
+                        concurrency = args.login_concurrency if name == "login" else args.concurrency
+                        # Warm up (opens connections, compiles templates, fills caches)
+                        asyncio.run(load(port, route, rows, rng, 1, min(1, args.seconds), args.timeout))
+                        result = asyncio.run(load(port, route, rows, rng, concurrency, args.seconds, args.timeout))
+                        result = {"app": app, "rows": rows, "route": name, "concurrency": concurrency, **result}
+                        run["results"].append(result)
+                        show(result)
+                finally:
+                    process.terminate()
+                    process.wait()
+
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_FOLDER, exist_ok=True)
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        output = os.path.join(RESULTS_FOLDER, f"{stamp}-{run['git']['commit'] or 'unknown'}.json")
+    with open(output, "w") as f:
+        json.dump(run, f, indent=2)
+    print(f"Saved to {os.path.relpath(output)}")
+
+    if args.compare:
+        compare(run["results"], args.compare)
@@ -0,0 +1,226 @@
+import argparse
+import asyncio
+import os
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+from time import perf_counter, sleep
+from urllib.parse import unquote_plus, urlencode
+
+# Checks what a flood of log in attempts does to everyone else.
+#
+# It starts one of the apps with gunicorn (one worker process with lots of threads)
+# on a copy of its database, adds a test user, and then has some "attackers"
+# guessing the test user's password as fast as they can, while a normal visitor
+# keeps loading a page. It shows how long the page took to load and what
+# happened to the log in attempts. This is done with a few different settings:
+#
+# - inline: bcrypt runs on the request threads with no limits (how it used to work)
+# - pool: bcrypt runs in the helper processes from shared/passwords.py, and attempts past the
+#   queue limit are turned away, but there are no rate limits
+# - pool+limits: the default settings, with rate limits as well (see shared/rate_limit.py)
+#
+# Needs gunicorn as well as the things in requirements.txt (`pip install gunicorn`).
+#
+# Usage (from the root of the repo):
+# ```
+# python benchmarks/login_storm.py --app dictionary
+# python benchmarks/login_storm.py --app cafe --attackers 32 --seconds 15
+# ```
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+USERNAME = "storm-test-user"
+PASSWORD = "correct horse battery staple"
+
+APPS = {
+    "dictionary": {
+        "folder": "internal-1-dictionary",
+        "database": "dictionary.db",
+        "module": "app:server",
+        "env_prefix": "DICTIONARY_",
+        "page": "/words/1",
+        "login": "/login",
+        "form": {"log-in-username": USERNAME, "log-in-password": "wrong password"},
+        "add_user": "INSERT INTO Users (Teacher, Username, PasswordHash) VALUES (0, ?, ?)",
+    },
+    "cafe": {
+        "folder": "cafe-thingy",
+        "database": "smile.sqlite",
+        "module": "server:server",
+        "env_prefix": "SMILE_",
+        "page": "/menu",
+        "login": "/auth/login",
+        "form": {"username": USERNAME, "password": "wrong password"},
+        "add_user": "INSERT INTO Users (admin, display_name, username, password) VALUES (0, 'Storm', ?, ?)",
+    },
+}
+
+# Settings for each run, as environment variables (without the app's prefix)
+MODES = {
+    "inline": {"PASSWORD_WORKERS": "0", "PASSWORD_QUEUE_LIMIT": "1000", "RATE_LIMITS": "0"},
+    "pool": {"RATE_LIMITS": "0"},
+    "pool+limits": {},
+}
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def make_database(app: str, folder: str, rounds: int) -> str:
+    # Copy the app's database and add the test user
+    config = APPS[app]
+    database = os.path.join(folder, config["database"])
+    shutil.copy(os.path.join(ROOT, config["folder"], config["database"]), database)
+
+    sys.path.insert(0, ROOT)
+    from shared.passwords import hash_password
+
+    connection = sqlite3.connect(database)
+    connection.execute(config["add_user"], [USERNAME, hash_password(PASSWORD, rounds)])
+    connection.commit()
+    connection.close()
+    return database
+
+
+def start_server(app: str, mode: str, port: int, threads: int, database: str, rounds: int) -> subprocess.Popen:
+    config = APPS[app]
+    prefix = config["env_prefix"]
+    env = dict(os.environ)
+    env[prefix + "DB_PATH"] = database
+    env[prefix + "BCRYPT_ROUNDS"] = str(rounds)
+    # Keep the cache version files with the copied database
+    env[prefix + "CACHE_VERSION_FILE"] = database + ".categories-version"
+    for name, value in MODES[mode].items():
+        env[prefix + name] = value
+
+    process = subprocess.Popen(
+        [
+            sys.executable, "-m", "gunicorn", config["module"],
+            "--bind", f"127.0.0.1:{port}", "--workers", "1",
+            "--worker-class", "gthread", "--threads", str(threads),
+        ],
+        cwd=os.path.join(ROOT, config["folder"]), env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+
+    # Wait for it to start listening
+    for _ in range(100):
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.1).close()
+            return process
+        except OSError:
+            sleep(0.1)
+    process.kill()
+    raise RuntimeError(f"The {app} server didn't start")
+
+
+async def request(port: int, method: str, path: str, form: dict = None) -> bytes:
+    # Do one HTTP request and return the response.
+    # (A tiny HTTP client, so the test doesn't need anything else installed.)
+    body = urlencode(form or {}).encode()
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(
+        f"{method} {path} HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n"
+        f"Content-Type: application/x-www-form-urlencoded\r\nContent-Length: {len(body)}\r\n\r\n".encode()
+        + body
+    )
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    await writer.wait_closed()
+    return response
+
+
+def login_outcome(response: bytes) -> str:
+    # Sort a log in response into what happened. The dictionary redirects with a
+    # message, and the cafe uses status codes.
+    text = unquote_plus(response[:2000].decode("utf8", "replace"))
+    status = text[9:12]
+    if status == "429" or "Too many log in attempts" in text:
+        return "rate limited"
+    if status == "503" or "Too many people are logging in" in text:
+        return "busy"
+    if "wrong" in text:
+        return "wrong password"
+    return f"other ({status})"
+
+
+def percentile(values: list, p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] * 1000
+
+
+async def storm(app: str, port: int, attackers: int, seconds: float) -> dict:
+    config = APPS[app]
+    page_times = []
+    outcomes = {}
+    login_times = []
+    finish_at = perf_counter() + seconds
+
+    async def visitor():
+        while perf_counter() < finish_at:
+            started = perf_counter()
+            response = await request(port, "GET", config["page"])
+            if not response.startswith(b"HTTP/1.1 200"):
+                raise RuntimeError(f"{config['page']} failed: {response[:100]!r}")
+            page_times.append(perf_counter() - started)
+            await asyncio.sleep(0.05)
+
+    async def attacker():
+        while perf_counter() < finish_at:
+            started = perf_counter()
+            outcome = login_outcome(await request(port, "POST", config["login"], config["form"]))
+            login_times.append(perf_counter() - started)
+            outcomes[outcome] = outcomes.get(outcome, 0) + 1
+
+    await asyncio.gather(visitor(), *[attacker() for _ in range(attackers)])
+    return {
+        "page_p50": percentile(page_times, 0.50),
+        "page_p95": percentile(page_times, 0.95),
+        "page_max": max(page_times) * 1000,
+        "pages": len(page_times),
+        "login_p50": percentile(login_times, 0.50) if login_times else 0,
+        "outcomes": outcomes,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="See how a flood of log in attempts affects page loads")
+    parser.add_argument("--app", choices=APPS, default="dictionary")
+    parser.add_argument("--attackers", type=int, default=16, help="Log in attempts in flight at once")
+    parser.add_argument("--seconds", type=float, default=10, help="How long each run lasts")
+    parser.add_argument("--threads", type=int, default=16, help="gunicorn threads")
+    parser.add_argument("--rounds", type=int, default=12, help="bcrypt cost factor")
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    args = parser.parse_args()
+
+    print(f"{args.app}: {args.attackers} attackers for {args.seconds:.0f}s, bcrypt cost {args.rounds}")
+    print(f"{'mode':<12} {'page p50':>9} {'p95':>8} {'max':>8} {'login p50':>10}  log in attempts")
+
+    with tempfile.TemporaryDirectory() as folder:
+        database = make_database(args.app, folder, args.rounds)
+        for mode in ["quiet"] + args.modes:
+            port = free_port()
+            # "quiet" is the page on its own, with nobody logging in
+            process = start_server(
+                args.app, "pool" if mode == "quiet" else mode, port, args.threads, database, args.rounds
+            )
+            try:
+                # Warm up (opens connections, compiles templates, fills caches)
+                asyncio.run(storm(args.app, port, 0, 1))
+                result = asyncio.run(storm(args.app, port, 0 if mode == "quiet" else args.attackers, args.seconds))
+            finally:
+                process.terminate()
+                process.wait()
+            outcomes = ", ".join(f"{count} {outcome}" for outcome, count in sorted(result["outcomes"].items()))
+            print(
+                f"{mode:<12} {result['page_p50']:>7.1f}ms {result['page_p95']:>6.1f}ms {result['page_max']:>6.1f}ms"
+                f" {result['login_p50']:>8.1f}ms  {outcomes or '-'}"
+            )
@@ -0,0 +1,177 @@
+import argparse
+import multiprocessing
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+from time import perf_counter, sleep
+
+# Stress test for reading while something else is writing.
+#
+# It copies one of the app databases somewhere temporary, then runs some reader
+# processes (doing the app's most common queries) alongside a writer process that
+# commits updates as fast as it can (updates rather than inserts, so the
+# amount of data the readers read stays the same). It does this once with
+# SQLite's old default journal mode (DELETE) and once with the settings from
+# shared/db_config.py (WAL), and shows how many reads per second got done and how many
+# failed with "database is locked".
+#
+# Usage (from the root of the repo):
+# ```
+# python benchmarks/write_concurrency.py --app dictionary
+# python benchmarks/write_concurrency.py --app cafe --readers 8 --seconds 10
+# ```
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+APPS = {
+    "dictionary": {
+        "folder": "internal-1-dictionary",
+        "database": "dictionary.db",
+        "reads": [
+            "SELECT * FROM Words ORDER BY MaoriSpelling, ID LIMIT 100",
+            "SELECT * FROM Words WHERE ID = 10",
+            "SELECT ID, EnglishName from Categories ORDER BY EnglishName",
+        ],
+        "write": "UPDATE Words SET LastModifiedAt = ? WHERE ID = (SELECT MIN(ID) FROM Words)",
+    },
+    "cafe": {
+        "folder": "cafe-thingy",
+        "database": "smile.sqlite",
+        "reads": [
+            "SELECT * FROM Products",
+            "SELECT * FROM Products WHERE category_id=1",
+            "SELECT name, id FROM Categories",
+        ],
+        "write": "UPDATE Products SET price = ? WHERE id = (SELECT MIN(id) FROM Products)",
+    },
+}
+
+
+def load_db_config(app: str):
+    # Both apps use shared/db_config.py
+    sys.path.insert(0, ROOT)
+    from shared import db_config
+
+    return db_config
+
+
+def connect(app: str, database: str, settings: dict) -> sqlite3.Connection:
+    connection = sqlite3.connect(database)
+    load_db_config(app).configure_connection(connection, settings)
+    return connection
+
+
+def reader(app: str, database: str, settings: dict, seconds: float, results):
+    connection = connect(app, database, settings)
+    reads = 0
+    locked = 0
+    queries = APPS[app]["reads"]
+    deadline = perf_counter() + seconds
+    while perf_counter() < deadline:
+        try:
+            connection.execute(queries[reads % len(queries)]).fetchall()
+            reads += 1
+        except sqlite3.OperationalError as e:
+            if "locked" not in str(e):
+                raise
+            locked += 1
+    connection.close()
+    results.put(("read", reads, locked))
+
+
+def writer(app: str, database: str, settings: dict, seconds: float, results):
+    connection = connect(app, database, settings)
+    writes = 0
+    locked = 0
+    deadline = perf_counter() + seconds
+    while perf_counter() < deadline:
+        try:
+            connection.execute(APPS[app]["write"], [writes])
+            connection.commit()
+            writes += 1
+        except sqlite3.OperationalError as e:
+            if "locked" not in str(e):
+                raise
+            connection.rollback()
+            locked += 1
+    connection.close()
+    results.put(("write", writes, locked))
+
+
+def run(app: str, database: str, settings: dict, readers: int, seconds: float, with_writer: bool):
+    # Run the readers (and maybe the writer) at the same time, and add up the results
+    results = multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(target=reader, args=(app, database, settings, seconds, results))
+        for _ in range(readers)
+    ]
+    if with_writer:
+        processes.append(
+            multiprocessing.Process(target=writer, args=(app, database, settings, seconds, results))
+        )
+
+    for process in processes:
+        process.start()
+    totals = {"read": [0, 0], "write": [0, 0]}
+    for _ in processes:
+        kind, done, locked = results.get()
+        totals[kind][0] += done
+        totals[kind][1] += locked
+    for process in processes:
+        process.join()
+
+    return totals
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Read throughput while writing, DELETE vs WAL")
+    parser.add_argument("--app", choices=APPS.keys(), default="dictionary")
+    parser.add_argument("--readers", type=int, default=4, help="Number of reader processes")
+    parser.add_argument("--seconds", type=float, default=5, help="How long each run lasts")
+    parser.add_argument(
+        "--busy-timeout",
+        type=int,
+        default=None,
+        help="Override the busy timeout (ms) for both runs. 0 shows the lock errors most clearly.",
+    )
+    args = parser.parse_args()
+
+    db_config = load_db_config(args.app)
+    source = os.path.join(ROOT, APPS[args.app]["folder"], APPS[args.app]["database"])
+
+    configurations = {
+        # What the apps used before: no WAL, and sqlite3.connect()'s default 5 second timeout
+        "DELETE (old default)": {"journal_mode": "DELETE", "busy_timeout": 5000},
+        "WAL (shared/db_config.py)": dict(db_config.DEFAULT_SETTINGS),
+    }
+
+    print(f"{args.app}: {args.readers} readers, {args.seconds}s per run")
+    with tempfile.TemporaryDirectory() as folder:
+        for name, settings in configurations.items():
+            if args.busy_timeout is not None:
+                settings["busy_timeout"] = args.busy_timeout
+
+            # A fresh copy each time, so both runs start from the same data
+            database = os.path.join(folder, f"{len(os.listdir(folder))}.db")
+            shutil.copy(source, database)
+            # Set the journal mode up front, since changing it needs nobody else connected
+            connect(args.app, database, settings).close()
+
+            alone = run(args.app, database, settings, args.readers, args.seconds, with_writer=False)
+            sleep(0.5)
+            busy = run(args.app, database, settings, args.readers, args.seconds, with_writer=True)
+
+            alone_rate = alone["read"][0] / args.seconds
+            busy_rate = busy["read"][0] / args.seconds
+            print()
+            print(f"{name}:")
+            print(f"  Reads/s with no writes:     {alone_rate:,.0f}")
+            print(
+                f"  Reads/s while writing:      {busy_rate:,.0f}"
+                f" ({busy_rate / alone_rate:.0%} of no writes)"
+            )
+            print(f"  Reads that hit a lock:      {busy['read'][1]:,}")
+            print(f"  Writes/s:                   {busy['write'][0] / args.seconds:,.0f}")
+            print(f"  Writes that hit a lock:     {busy['write'][1]:,}")
@@ -0,0 +1,124 @@
+from shared.rows import as_dicts
+
+# The SQL and helpers for users' carts, used by server.py.
+#
+# A cart is the user's rows in Cart_Items, at most one per product (there's a unique
+# index on (user_id, product_id), see migrations/0002_cart_items_index.sql).
+# Every change is an "upsert" - insert the row, or update it if it's already there -
+# so it's one statement no matter what's in the cart already.
+#
+# Clicking "Add to cart" lots of times quickly doesn't send a request per click:
+# static/cart.js collects the clicks for a moment and sends them all at once to
+# /cart/batch. The changes are merged (coalesce_changes()) and run with executemany()
+# in a single transaction.
+
+# Most of one product that can be in a cart
+MAX_QUANTITY = 99
+
+# Add to a product's quantity (or take away, with a negative number).
+# The INSERT ... SELECT skips products that don't exist.
+ADD_QUERY = """
+INSERT INTO Cart_Items (user_id, product_id, product_quantity)
+SELECT :user_id, id, MIN(:quantity, :max_quantity) FROM Products WHERE id = :product_id
+ON CONFLICT (user_id, product_id) DO UPDATE
+SET product_quantity = MIN(product_quantity + excluded.product_quantity, :max_quantity)
+"""
+
+# Set a product's quantity
+SET_QUERY = """
+INSERT INTO Cart_Items (user_id, product_id, product_quantity)
+SELECT :user_id, id, MIN(:quantity, :max_quantity) FROM Products WHERE id = :product_id
+ON CONFLICT (user_id, product_id) DO UPDATE
+SET product_quantity = excluded.product_quantity
+"""
+
+# Setting a quantity to 0 (or taking away more than there is) removes the product
+REMOVE_EMPTY_QUERY = "DELETE FROM Cart_Items WHERE user_id = ? AND product_quantity <= 0"
+
+# Everything in a user's cart, with the totals worked out by SQLite.
+# The totals use window functions (`OVER ()`), which add them to every row,
+# so it's all one query. Prices are summed in cents so they add up exactly.
+CART_QUERY = """
+SELECT
+    Products.id,
+    Products.name,
+    Products.size,
+    Products.image_path,
+    Products.price,
+    Cart_Items.product_quantity AS quantity,
+    ROUND(Products.price * Cart_Items.product_quantity, 2) AS line_total,
+    SUM(Cart_Items.product_quantity) OVER () AS total_quantity,
+    SUM(CAST(ROUND(Products.price * 100) AS INTEGER) * Cart_Items.product_quantity) OVER () / 100.0 AS total_price
+FROM Cart_Items
+JOIN Products ON Products.id = Cart_Items.product_id
+WHERE Cart_Items.user_id = ?
+ORDER BY Products.name, Products.id
+"""
+# The columns of CART_QUERY that are the same on every row
+TOTAL_COLUMNS = ("total_quantity", "total_price")
+
+
+class InvalidCartChange(Exception):
+    pass
+
+
+def parse_change(change: dict) -> tuple:
+    # Check one change from a form or JSON and return it as (product_id, action, quantity).
+    # action is "add" or "set".
+    try:
+        product_id = int(change["product_id"])
+        if "set" in change:
+            action, quantity = "set", int(change["set"])
+        else:
+            action, quantity = "add", int(change.get("add", 1))
+    except (KeyError, TypeError, ValueError):
+        raise InvalidCartChange(f"Invalid cart change: {change!r}")
+
+    if action == "set" and not 0 <= quantity <= MAX_QUANTITY:
+        raise InvalidCartChange(f"Quantity must be between 0 and {MAX_QUANTITY}")
+    if action == "add" and not -MAX_QUANTITY <= quantity <= MAX_QUANTITY:
+        raise InvalidCartChange(f"Can't add more than {MAX_QUANTITY} at once")
+    return (product_id, action, quantity)
+
+
+def coalesce_changes(changes: list) -> dict:
+    # Merge a list of (product_id, action, quantity) changes into one per product,
+    # e.g. add 1, add 1, add 1 -> add 3, and add 2, set 5, add 1 -> set 6.
+    # Returns {product_id: (action, quantity)}.
+    merged = {}
+    for product_id, action, quantity in changes:
+        if action == "set" or product_id not in merged:
+            merged[product_id] = (action, quantity)
+        else:
+            previous_action, previous_quantity = merged[product_id]
+            merged[product_id] = (previous_action, previous_quantity + quantity)
+    return merged
+
+
+def change_parameters(user_id: int, changes: list) -> tuple:
+    # Turn changes into parameters for executemany(), as (add parameters, set parameters)
+    adds = []
+    sets = []
+    for product_id, (action, quantity) in coalesce_changes(changes).items():
+        parameters = {
+            "user_id": user_id,
+            "product_id": product_id,
+            "quantity": quantity,
+            "max_quantity": MAX_QUANTITY,
+        }
+        (sets if action == "set" else adds).append(parameters)
+    return (adds, sets)
+
+
+def summarise(rows: list) -> dict:
+    # Put the rows from CART_QUERY into the shape the template and JSON responses use.
+    # The totals are on every row (see CART_QUERY), but they only belong at the top.
+    items = [
+        {key: value for key, value in item.items() if key not in TOTAL_COLUMNS}
+        for item in as_dicts(rows)
+    ]
+    return {
+        "items": items,
+        "total_quantity": rows[0]["total_quantity"] if rows else 0,
+        "total_price": rows[0]["total_price"] if rows else 0,
+    }
@@ -0,0 +1,15 @@
+import os
+import sys
+
+# The modules shared with the other app (see shared/__init__.py)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from shared.migrate import main
+
+
+# This app's database migrations. shared/migrate.py runs them, this just says where
+# they are so the app (and `python migrate.py`) can pass them to run_migrations().
+MIGRATIONS_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+
+
+if __name__ == "__main__":
+    main(MIGRATIONS_FOLDER, "smile.sqlite", "Upgrade the cafe database schema")
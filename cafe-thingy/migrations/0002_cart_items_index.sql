@@ -0,0 +1,40 @@
+-- Each user has at most one row per product in their cart, which lets adding to the cart
+-- be a single upsert (INSERT ... ON CONFLICT DO UPDATE) and makes looking up
+-- a user's cart an index search instead of a scan of every cart.
+
+-- Merge any duplicate rows first, adding up their quantities
+UPDATE "Cart_Items"
+SET
+	"product_quantity" = (
+		SELECT
+			SUM("other"."product_quantity")
+		FROM
+			"Cart_Items" AS "other"
+		WHERE
+			"other"."user_id" = "Cart_Items"."user_id"
+			AND "other"."product_id" = "Cart_Items"."product_id"
+	)
+WHERE
+	rowid IN (
+		SELECT
+			MIN(rowid)
+		FROM
+			"Cart_Items"
+		GROUP BY
+			"user_id",
+			"product_id"
+	);
+
+DELETE FROM "Cart_Items"
+WHERE
+	rowid NOT IN (
+		SELECT
+			MIN(rowid)
+		FROM
+			"Cart_Items"
+		GROUP BY
+			"user_id",
+			"product_id"
+	);
+
+CREATE UNIQUE INDEX "CartItemsByUserProduct" ON "Cart_Items" ("user_id", "product_id");
@@ -1,26 +1,105 @@
 from functools import wraps
-from flask import Flask, render_template, redirect, request, session, g
-from flask_bcrypt import Bcrypt
+from flask import Flask, abort, jsonify, render_template, redirect, request, session, g
 import sqlite3
 from contextlib import contextmanager
+from datetime import datetime, timezone
+import hashlib
+import math
 import os
+import sys
+from urllib.parse import urlencode
+# The modules shared with the dictionary app (see shared/__init__.py)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import cart
+from shared import images, instrumentation, static_assets
+from shared.caching import LRUCache, VersionedCache
+from shared.db_config import configure_connection, settings_from_env
+from migrate import MIGRATIONS_FOLDER
+from shared.migrate import run_migrations
+from shared.passwords import PasswordHasher, PasswordHasherBusy
+from shared.rate_limit import RateLimiter
+from shared.rows import Row
 
 server = Flask(__name__)
-bcrypt = Bcrypt(server)
 
 server.secret_key = os.urandom(69)
 
 ADMIN_CODE = "password123"
 
-
-def db_dict_factory(cursor, row):
-    # Used to return database query results as dictionaries.
-    # From the docs: https://docs.python.org/3/library/sqlite3.html#sqlite3.Connection.row_factory
-
-    d = {}
-    for idx, col in enumerate(cursor.description):
-        d[col[0]] = row[idx]
-    return d
+# Database settings. These can be overridden with environment variables,
+# e.g. `SMILE_DB_PATH=test.sqlite flask --app server run`
+server.config["DB_PATH"] = os.environ.get("SMILE_DB_PATH", "smile.sqlite")
+# SQLite settings (WAL, busy timeout, cache sizes, etc.) - see shared/db_config.py.
+# Override them with SMILE_DB_JOURNAL_MODE, SMILE_DB_BUSY_TIMEOUT, etc.
+server.config["DB_SETTINGS"] = settings_from_env("SMILE_DB_")
+# Rendered menu pages are cached in memory (see find_menu_page()).
+# Every worker process checks this file to find out when an admin has changed the menu.
+server.config["MENU_CACHE_VERSION_FILE"] = os.environ.get(
+    "SMILE_MENU_CACHE_VERSION_FILE", server.config["DB_PATH"] + ".menu-version")
+# Most rendered menu pages to keep (there's one per category per logged in user)
+server.config["MENU_CACHE_SIZE"] = int(os.environ.get("SMILE_MENU_CACHE_SIZE", 1000))
+
+# bcrypt cost factor for password hashes. Changing it upgrades users' hashes when they next log in.
+server.config["BCRYPT_ROUNDS"] = int(os.environ.get("SMILE_BCRYPT_ROUNDS", 12))
+# Number of helper processes that hash passwords (0 hashes on the request thread instead),
+# and the most logins that can be waiting for one before they get turned away
+# (keep it below the number of threads, so there are always some free for the menu)
+server.config["PASSWORD_WORKERS"] = int(os.environ.get("SMILE_PASSWORD_WORKERS", 2))
+server.config["PASSWORD_QUEUE_LIMIT"] = int(os.environ.get("SMILE_PASSWORD_QUEUE_LIMIT", 8))
+# Limits on log in attempts (per minute) and new accounts (per hour). SMILE_RATE_LIMITS=0 turns them off,
+# or set one of them to 0 to turn off just that one.
+server.config["RATE_LIMITS"] = os.environ.get("SMILE_RATE_LIMITS", "1") != "0"
+server.config["LOGIN_IP_LIMIT"] = int(os.environ.get("SMILE_LOGIN_IP_LIMIT", 30))
+server.config["LOGIN_USERNAME_LIMIT"] = int(os.environ.get("SMILE_LOGIN_USERNAME_LIMIT", 5))
+server.config["REGISTER_IP_LIMIT"] = int(os.environ.get("SMILE_REGISTER_IP_LIMIT", 20))
+# Request timings (see shared/instrumentation.py). SMILE_SERVER_TIMING=0 stops sending the Server-Timing header,
+# and the Prometheus page is only there if SMILE_METRICS_TOKEN is set (needs `Authorization: Bearer <token>`,
+# at /metrics or SMILE_METRICS_PATH). Setting only the path makes it public, so block it in the proxy then.
+server.config["SERVER_TIMING"] = os.environ.get("SMILE_SERVER_TIMING", "1") != "0"
+server.config["METRICS_PATH"] = os.environ.get("SMILE_METRICS_PATH", "")
+server.config["METRICS_TOKEN"] = os.environ.get("SMILE_METRICS_TOKEN", "")
+# Log SQL statements slower than this many milliseconds, with their query plans. 0 turns it off.
+server.config["SLOW_QUERY_MS"] = float(os.environ.get("SMILE_SLOW_QUERY_MS", 0))
+
+# Create or upgrade the database tables (see shared/migrate.py)
+run_migrations(server.config["DB_PATH"], MIGRATIONS_FOLDER)
+
+
+# Hashing passwords happens in other processes so logins don't slow down the menu (see shared/passwords.py)
+password_hasher = PasswordHasher(
+    rounds=server.config["BCRYPT_ROUNDS"],
+    workers=server.config["PASSWORD_WORKERS"],
+    max_queue=server.config["PASSWORD_QUEUE_LIMIT"],
+)
+
+# Stop people guessing passwords too quickly (see shared/rate_limit.py)
+login_ip_limiter = RateLimiter(server.config["LOGIN_IP_LIMIT"], server.config["LOGIN_IP_LIMIT"] / 60)
+login_username_limiter = RateLimiter(
+    server.config["LOGIN_USERNAME_LIMIT"], server.config["LOGIN_USERNAME_LIMIT"] / 60)
+register_ip_limiter = RateLimiter(server.config["REGISTER_IP_LIMIT"], server.config["REGISTER_IP_LIMIT"] / 3600)
+
+# Time every request (this has to come before the other before_request functions)
+request_metrics = instrumentation.init_app(
+    server,
+    namespace="smile",
+    metrics_path=server.config["METRICS_PATH"],
+    metrics_token=server.config["METRICS_TOKEN"],
+    server_timing=server.config["SERVER_TIMING"],
+    slow_query_ms=server.config["SLOW_QUERY_MS"],
+)
+request_metrics.add_collector("password_hasher", password_hasher.stats)
+
+
+def rate_limit_wait(*limits) -> float:
+    # Check some (limiter, key) pairs and return how long to wait
+    # if any are over their limit, or 0 if they're all fine
+    if not server.config["RATE_LIMITS"]:
+        return 0
+    return max(limiter.hit(key) for limiter, key in limits)
+
+
+def too_many_attempts(wait: float) -> str:
+    return f"Too many attempts. Try again in {math.ceil(wait)} seconds"
 
 
 @contextmanager
@@ -35,8 +114,9 @@ def get_db(*args, **kwds):
     # ```
 
     # Code to acquire resource.
-    db_connection = sqlite3.connect("smile.sqlite")
-    db_connection.row_factory = db_dict_factory
+    db_connection = sqlite3.connect(server.config["DB_PATH"], factory=instrumentation.InstrumentedConnection)
+    configure_connection(db_connection, server.config["DB_SETTINGS"])
+    db_connection.row_factory = Row
     db_cursor = db_connection.cursor()
     try:
         yield (db_connection, db_cursor)
@@ -45,10 +125,81 @@ def get_db(*args, **kwds):
         db_connection.close()
 
 
-def get_first_dict_item(thing: dict):
+def get_first_dict_item(thing: Row):
     # A helper function for getting out some
     # values returned in a weird way by SQLite
-    return list(thing.values())[0]
+    return thing[0]
+
+
+def new_menu_cache() -> dict:
+    # Start an empty cache of rendered menu pages.
+    # This runs again every time the menu changes, which throws the old pages away.
+    return {
+        "pages": LRUCache(server.config["MENU_CACHE_SIZE"]),
+        "last_modified": menu_last_modified(),
+    }
+
+
+def menu_last_modified() -> datetime:
+    # When the menu was last changed. This comes from the version file so that every
+    # worker process agrees, otherwise it's just when this process started.
+    # HTTP dates only go down to seconds, so drop the microseconds.
+    try:
+        timestamp = os.stat(server.config["MENU_CACHE_VERSION_FILE"]).st_mtime
+    except FileNotFoundError:
+        timestamp = started_at
+    return datetime.fromtimestamp(int(timestamp), timezone.utc)
+
+
+started_at = datetime.now(timezone.utc).timestamp()
+menu_cache = VersionedCache(new_menu_cache, version_file=server.config["MENU_CACHE_VERSION_FILE"])
+
+# Smaller copies of the product images, and image_sources() for the responsiveImage macro
+# (see shared/images.py)
+product_images = images.init_app(server)
+
+# Link to (and serve) the hashed, precompressed static files from shared/static_assets.py,
+# if they've been built
+static_assets.init_app(server)
+
+
+def find_menu_page(category_id, user) -> tuple:
+    # Look up a rendered menu page in the cache.
+    # Returns (page, save_page). page is (html bytes, etag, last modified), or None if it
+    # isn't cached, in which case render it and call save_page(html) to cache it.
+    # The page shows who's logged in, so each user gets their own copy.
+    menu = menu_cache.get()
+    key = (category_id, (user["username"], user["display_name"], user["admin"]) if user else None)
+
+    def save_page(html: str) -> tuple:
+        # Saved into the same `menu` the lookup used, so if the menu changed while
+        # the page was being rendered, it goes into the old cache and gets thrown away
+        html = html.encode("utf8")
+        # A hash of the page itself, so every worker gives the same page the same ETag
+        etag = hashlib.sha1(html).hexdigest()
+        page = (html, etag, menu["last_modified"])
+        menu["pages"].set(key, page)
+        return page
+
+    return menu["pages"].get(key), save_page
+
+
+def menu_response(response_class, page: tuple, user):
+    # Make the response for a cached menu page, with the headers browsers need to
+    # ask "has this changed?" (and get a 304 Not Modified back if it hasn't).
+    html, etag, last_modified = page
+    response = response_class(html, mimetype="text/html")
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    # no-cache means "check with the server before using it", not "don't cache".
+    # Pages for logged in users shouldn't be kept by shared caches (like proxies).
+    response.cache_control.no_cache = True
+    if user:
+        response.cache_control.private = True
+    else:
+        response.cache_control.public = True
+    response.vary.add("Cookie")
+    return response
 
 
 def get_user():
@@ -65,6 +216,8 @@ def get_user():
             return False
 
         return {
+            # Sessions from before user IDs were saved don't have one
+            "id": session.get("user_id"),
             "username": username,
             "display_name": display_name,
             "admin": admin
@@ -73,6 +226,20 @@ def get_user():
     return False
 
 
+def user_only(func):
+    # A custom decorator to make pages require the user to be logged in
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if not g.user:
+            return redirect(f"/auth?m=You+are+not+logged+in")
+        if g.user["id"] is None:
+            # Log them out so they can log in again and get an ID
+            session.clear()
+            return redirect(f"/auth?m=Please+log+in+again")
+        return func(*args, **kwargs)
+    return wrapper
+
+
 def admin_only(func):
     # A custom decorator to make pages require the user to be logged in as an admin
     @wraps(func)
@@ -107,21 +274,31 @@ def handle_contact():
 
 
 @server.route("/menu", methods=["GET"])
-@server.route("/menu/<category_id>", methods=["GET"])
+@server.route("/menu/<int:category_id>", methods=["GET"])
 def handle_menu(category_id=None):
-    with get_db() as (connection, cursor):
-        if category_id is not None:
-            query = "SELECT * FROM Products WHERE category_id=?"
-            cursor.execute(query, [category_id])
-        else:
-            query = "SELECT * FROM Products"
-            cursor.execute(query)
-        products = cursor.fetchall()
+    # The menu only changes when an admin edits it, so the rendered page is cached.
+    # Only categories that exist get cached, otherwise any number in the URL would
+    # make a new cache entry.
+    page, save_page = find_menu_page(category_id, g.user)
 
-        cursor.execute("SELECT name, id FROM Categories")
-        categories = cursor.fetchall()
+    if page is None:
+        with get_db() as (connection, cursor):
+            cursor.execute("SELECT name, id FROM Categories")
+            categories = cursor.fetchall()
+            if category_id is not None and category_id not in [category["id"] for category in categories]:
+                abort(404)
+
+            if category_id is not None:
+                query = "SELECT * FROM Products WHERE category_id=?"
+                cursor.execute(query, [category_id])
+            else:
+                query = "SELECT * FROM Products"
+                cursor.execute(query)
+            products = cursor.fetchall()
 
-        return render_template("pages/menu.jinja", user=g.user, products=products, current_category_id=category_id, categories=categories)
+        page = save_page(render_template("pages/menu.jinja", user=g.user, products=products, current_category_id=category_id, categories=categories))
+
+    return menu_response(server.response_class, page, g.user).make_conditional(request)
 
 
 @server.route("/auth", methods=["GET"])
@@ -142,10 +319,14 @@ def handle_auth_log_in():
     username = request.form["username"]
     password = request.form["password"]
 
+    wait = rate_limit_wait((login_ip_limiter, request.remote_addr), (login_username_limiter, username.lower()))
+    if wait:
+        return render_template("pages/auth.jinja", failed=too_many_attempts(wait)), 429
+
     with get_db() as (connection, cursor):
         try:
             cursor.execute(
-                "SELECT username, display_name, admin, password FROM Users WHERE username=?", [username])
+                "SELECT id, username, display_name, admin, password FROM Users WHERE username=?", [username])
             res = cursor.fetchall()
 
             if len(res) == 0:
@@ -153,15 +334,30 @@ def handle_auth_log_in():
 
             user = res[0]
 
-            matches = bcrypt.check_password_hash(user["password"], password)
+            with instrumentation.timed("bcrypt"):
+                matches = password_hasher.check(password, user["password"])
 
             if not matches:
                 return render_template("pages/auth.jinja", failed="Password is wrong")
 
-            session['username'] = user["display_name"]
-            session['display_name'] = user["username"]
+            # Upgrade old hashes (or ones made with a different cost) now that we know the password
+            if password_hasher.needs_rehash(user["password"]):
+                try:
+                    with instrumentation.timed("bcrypt"):
+                        new_hash = password_hasher.hash(password)
+                    cursor.execute("UPDATE Users SET password=? WHERE id=?", [new_hash, user["id"]])
+                    connection.commit()
+                except PasswordHasherBusy:
+                    # It'll be done next time
+                    pass
+
+            session['user_id'] = user["id"]
+            session['username'] = user["username"]
+            session['display_name'] = user["display_name"]
             session['admin'] = user["admin"]
             return redirect("/")
+        except PasswordHasherBusy as e:
+            return render_template("pages/auth.jinja", failed=str(e)), 503
         except Exception as e:
             print(f"Failed to create account: {e}")
             return render_template("pages/auth.jinja", failed=str(e))
@@ -183,7 +379,9 @@ def handle_auth_register():
 
     admin = req_admin_code == ADMIN_CODE
 
-    encrypted_password = bcrypt.generate_password_hash(password)
+    wait = rate_limit_wait((register_ip_limiter, request.remote_addr))
+    if wait:
+        return render_template("pages/auth.jinja", failed=too_many_attempts(wait)), 429
 
     with get_db() as (connection, cursor):
         try:
@@ -194,15 +392,21 @@ def handle_auth_register():
             if len(res) > 0:
                 return render_template("pages/auth.jinja", failed="Username already taken")
 
+            with instrumentation.timed("bcrypt"):
+                encrypted_password = password_hasher.hash(password)
+
             cursor.execute(
                 "INSERT INTO Users (admin, display_name, username, password) VALUES (?,?,?,?)",
                 [1 if admin else 0, display_name, username, encrypted_password])
             connection.commit()
+            session['user_id'] = cursor.lastrowid
             session['username'] = username
             session['display_name'] = display_name
             session['admin'] = admin
 
             return redirect("/?m=Successfully+registered")
+        except PasswordHasherBusy as e:
+            return render_template("pages/auth.jinja", failed=str(e)), 503
         except Exception as e:
             print(f"Failed to create account: {e}")
             return render_template("pages/auth.jinja", failed=str(e))
@@ -214,6 +418,7 @@ def handle_auth_log_out():
         return render_template("pages/auth.jinja", logged_out=False)
 
     # Remove all keys from the user session thingy
+    session.pop('user_id', None)
     session.pop('username', None)
     session.pop('display_name', None)
     session.pop('admin', None)
@@ -221,6 +426,83 @@ def handle_auth_log_out():
     return render_template("pages/auth.jinja", logged_out=True)
 
 
+def apply_cart_changes(changes: list) -> dict:
+    # Make a list of changes to the user's cart in one go, and return the updated cart.
+    # Each kind of change is a single executemany() and it's all one transaction.
+    adds, sets = cart.change_parameters(g.user["id"], changes)
+    with get_db() as (connection, cursor):
+        cursor.executemany(cart.ADD_QUERY, adds)
+        cursor.executemany(cart.SET_QUERY, sets)
+        cursor.execute(cart.REMOVE_EMPTY_QUERY, [g.user["id"]])
+        connection.commit()
+
+        cursor.execute(cart.CART_QUERY, [g.user["id"]])
+        return cart.summarise(cursor.fetchall())
+
+
+def with_message(url: str, message: str) -> str:
+    # Add a message (shown by the page) to a URL, after any query string it already has
+    return url + ("&" if "?" in url else "?") + urlencode({"m": message})
+
+
+def handle_cart_form(change: dict, message: str):
+    # Shared by the cart forms, for when JavaScript isn't running (see static/cart.js)
+    try:
+        apply_cart_changes([cart.parse_change(change)])
+    except cart.InvalidCartChange as e:
+        return redirect(with_message("/cart", str(e)))
+    # Go back to the page the form was on (only pages on this site)
+    next_page = request.form.get("next", "")
+    if not next_page.startswith("/") or next_page.startswith("//"):
+        next_page = "/cart"
+    return redirect(with_message(next_page, message))
+
+
+@server.route("/cart", methods=["GET"])
+@user_only
+def handle_cart():
+    with get_db() as (connection, cursor):
+        cursor.execute(cart.CART_QUERY, [g.user["id"]])
+        summary = cart.summarise(cursor.fetchall())
+
+    return render_template("pages/cart.jinja", user=g.user, cart=summary)
+
+
+@server.route("/cart/add", methods=["POST"])
+@user_only
+def handle_cart_add():
+    return handle_cart_form({"product_id": request.form.get("product_id"), "add": request.form.get("add", 1)}, "Added to cart")
+
+
+@server.route("/cart/update", methods=["POST"])
+@user_only
+def handle_cart_update():
+    return handle_cart_form({"product_id": request.form.get("product_id"), "set": request.form.get("set")}, "Updated cart")
+
+
+@server.route("/cart/remove", methods=["POST"])
+@user_only
+def handle_cart_remove():
+    return handle_cart_form({"product_id": request.form.get("product_id"), "set": 0}, "Removed from cart")
+
+
+@server.route("/cart/batch", methods=["POST"])
+@user_only
+def handle_cart_batch():
+    # Lots of changes at once, sent by static/cart.js as JSON:
+    # {"changes": [{"product_id": 1, "add": 2}, {"product_id": 3, "set": 0}, ...]}
+    # Anything that isn't JSON (or isn't sent as JSON) comes back as None, and gets a 400
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict) or not isinstance(body.get("changes", []), list):
+        return jsonify({"error": 'Expected {"changes": [...]}'}), 400
+    try:
+        changes = [cart.parse_change(change) for change in body.get("changes", [])]
+    except cart.InvalidCartChange as e:
+        return jsonify({"error": str(e)}), 400
+
+    return jsonify(apply_cart_changes(changes))
+
+
 @server.route("/admin", methods=["GET"])
 @admin_only
 def handle_admin():
@@ -250,6 +532,7 @@ def handle_admin_create_category():
             id_query = "SELECT last_insert_rowid()"
             cursor.execute(id_query)
             connection.commit()
+            menu_cache.invalidate()
             # Get the returned category ID out
             category_id = get_first_dict_item(cursor.fetchone())
             return redirect(f"/admin/categories/{category_id}?m=Created+category+{name}")
@@ -292,6 +575,7 @@ def handle_admin_delete_category(category_id=None):
             delete_query = "DELETE FROM Categories WHERE id=?"
             cursor.execute(delete_query, [category_id])
             connection.commit()
+            menu_cache.invalidate()
             return redirect(f"/admin/categories?m=Successfully+deleted+category+{category_id}")
         except Exception as e:
             print(e)
@@ -310,6 +594,7 @@ def handle_admin_update_category(category_id=None):
             cursor.execute(category_query, [
                            request.form["name"], category_id])
             connection.commit()
+            menu_cache.invalidate()
             return redirect(f"/admin/categories/{category_id}?m=Successfully+updated+category+{category_id}")
         except Exception as e:
             print(e)
@@ -353,6 +638,9 @@ def handle_admin_create_product():
             id_query = "SELECT last_insert_rowid()"
             cursor.execute(id_query)
             connection.commit()
+            menu_cache.invalidate()
+            # Make smaller copies of the image, if it's a new one
+            product_images.build_in_background(image_path, on_done=menu_cache.invalidate)
             # Get the returned category ID out
             category_id = get_first_dict_item(cursor.fetchone())
             return redirect(f"/admin/products/{category_id}?m=Created+product+{name}")
@@ -370,6 +658,7 @@ def handle_admin_delete_random_product():
             delete_query = "DELETE FROM Products WHERE id=?"
             cursor.execute(delete_query, [product_id])
             connection.commit()
+            menu_cache.invalidate()
             return redirect(f"/admin/products?m=Successfully+deleted+product+{product_id}")
         except Exception as e:
             print(e)
@@ -409,6 +698,7 @@ def handle_admin_delete_product(product_id=None):
             delete_query = "DELETE FROM Products WHERE id=?"
             cursor.execute(delete_query, [product_id])
             connection.commit()
+            menu_cache.invalidate()
             return redirect(f"/admin/products?m=Successfully+deleted+product+{product_id}")
         except Exception as e:
             print(e)
@@ -434,6 +724,9 @@ def handle_admin_update_product(product_id=None):
             cursor.execute(product_query, [
                            name, description, price, size, category, image_path, product_id])
             connection.commit()
+            menu_cache.invalidate()
+            # Make smaller copies of the image, if it's a new one
+            product_images.build_in_background(image_path, on_done=menu_cache.invalidate)
             return redirect(f"/admin/products/{product_id}?m=Successfully+updated+product+{product_id}")
         except Exception as e:
             print(e)
@@ -1,3 +1,7 @@
+-- The database is created and upgraded by `python migrate.py`, using the files
+-- in the migrations folder. This file shows what the schema looks like after
+-- all of them have run, and can also be used to make a new empty database:
+-- `sqlite3 smile.sqlite < setup_database.sql`
 CREATE TABLE "Categories" (
 	"id"	INTEGER NOT NULL UNIQUE,
 	"name"	TEXT NOT NULL,
@@ -30,4 +34,10 @@ CREATE TABLE "Cart_Items" (
 	"product_quantity"	INTEGER NOT NULL,
 	FOREIGN KEY("product_id") REFERENCES "Products"("id"),
 	FOREIGN KEY("user_id") REFERENCES "Users"("id")
-);
\ No newline at end of file
+);
+
+CREATE UNIQUE INDEX "CartItemsByUserProduct" ON "Cart_Items" ("user_id", "product_id");
+
+-- The migration this schema matches, so migrate.py doesn't run them all again on a
+-- database made with this file. Keep it the same as the newest migration's number.
+PRAGMA user_version = 2;
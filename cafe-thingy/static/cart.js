@@ -0,0 +1,93 @@
+// Sends changes to the cart in batches.
+// Every cart button is a normal form (so it still works without JavaScript), but
+// sending a request for every click is slow when someone clicks "+" five times.
+// Instead, clicks are collected for a moment and then sent all at once to /cart/batch,
+// which merges them and saves them in one go.
+
+// How long to wait (milliseconds) after the last click before sending
+const CART_BATCH_DELAY = 400
+
+let pendingChanges = []
+let batchTimer = null
+// Buttons to update once the batch has been saved
+let pendingButtons = new Set()
+
+document.addEventListener("submit", (ev) => {
+    const form = ev.target
+    if (!form.matches("[data-cart-change]")) {
+        return
+    }
+    // Don't submit the form normally
+    ev.preventDefault()
+
+    const data = new FormData(form)
+    const change = { product_id: data.get("product_id") }
+    if (data.has("set")) {
+        change.set = data.get("set")
+    } else {
+        change.add = data.get("add") || 1
+    }
+    pendingChanges.push(change)
+    pendingButtons.add(form.querySelector("button"))
+
+    // Start the wait again from this click
+    clearTimeout(batchTimer)
+    batchTimer = setTimeout(sendCartChanges, CART_BATCH_DELAY)
+})
+
+async function sendCartChanges() {
+    const changes = pendingChanges
+    const buttons = pendingButtons
+    pendingChanges = []
+    pendingButtons = new Set()
+
+    try {
+        const response = await fetch("/cart/batch", {
+            method: "POST",
+            headers: { "Content-Type": "application/json" },
+            body: JSON.stringify({ changes }),
+        })
+        const cart = await response.json()
+        if (!response.ok) {
+            throw new Error(cart.error || "Failed to update your cart")
+        }
+        showCart(cart, buttons)
+    } catch (error) {
+        window.alert(error.message)
+    }
+}
+
+function showCart(cart, buttons) {
+    // Update the page to match the cart that the server sent back
+    const quantities = new Map(cart.items.map((item) => [String(item.id), item]))
+
+    // On the menu, show how many of the product are in the cart now
+    for (const button of buttons) {
+        const form = button.closest("form")
+        const item = quantities.get(form.querySelector("[name=product_id]").value)
+        if (button.textContent.startsWith("Add to cart") || button.textContent.startsWith("In cart")) {
+            button.textContent = item ? `In cart (${item.quantity}) - add another` : "Add to cart"
+        }
+    }
+
+    // On the cart page, update the numbers and take away removed products
+    for (const row of document.querySelectorAll("[data-cart-item]")) {
+        const item = quantities.get(row.dataset.cartItem)
+        if (!item) {
+            row.remove()
+            continue
+        }
+        row.querySelector("[data-cart-quantity]").textContent = item.quantity
+        row.querySelector("[data-cart-line-total]").textContent = item.line_total.toFixed(2)
+    }
+    for (const el of document.querySelectorAll("[data-cart-total-quantity]")) {
+        el.textContent = cart.total_quantity
+    }
+    for (const el of document.querySelectorAll("[data-cart-total-price]")) {
+        el.textContent = cart.total_price.toFixed(2)
+    }
+    if (cart.items.length == 0) {
+        document.querySelector(".cart-table")?.remove()
+        document.querySelector(".cart-empty")?.removeAttribute("hidden")
+    }
+}
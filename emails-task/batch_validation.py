@@ -0,0 +1,357 @@
+import mmap
+import os
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+
+from email_validation import (
+    CHUNKS_PER_WORKER,
+    DOMAIN_CHARS,
+    LOCAL_CHARS,
+    MAX_ADDRESS_LENGTH,
+    MAX_DOMAIN_LENGTH,
+    MAX_LABEL_LENGTH,
+    MAX_LOCAL_LENGTH,
+    REASON_BYTES,
+    REASONS,
+    ChunkResult,
+    EmailChecker,
+)
+
+# numpy isn't needed, but batch mode is a lot faster with it
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Batch mode for check-emails.py (--batch): checking a whole file at once, for big lists.
+#
+# The file is memory-mapped instead of read, so the OS pages it in as it's needed and
+# nothing gets copied into Python. Then it's checked BATCH_SIZE bytes at a time with
+# numpy: instead of looking at each address, it finds where all the newlines, @s,
+# dots and hyphens are in the batch, works out which line each one is in, and
+# compares positions (is this dot right after the @? before the end of the line?) to
+# get a reason code for every line at once. So there are no Python objects per
+# address, just arrays of offsets. The valid lines are then copied out of the map
+# in one go.
+#
+# A few rare things (problems with the labels in a domain, and TLDs longer than 8
+# characters) are worked out for those lines one at a time with EmailChecker, so the
+# reasons are always the same as the normal mode.
+#
+# Without numpy it still memory-maps the file, and checks each batch with
+# EmailChecker.check_chunk().
+#
+# Example usage:
+# ```
+# for result in check_file("emails.txt", workers=2):
+#   out.write(result.valid)
+# ```
+
+# Bytes checked at a time. numpy makes a few arrays as big as this (and some with an
+# 8 byte number per address), so bigger batches use a lot more memory.
+BATCH_SIZE = 8 * 1024 * 1024
+
+NEWLINE = ord("\n")
+CARRIAGE_RETURN = ord("\r")
+AT = ord("@")
+DOT = ord(".")
+HYPHEN = ord("-")
+
+# Bytes that can't be anywhere in an address are 2, and ones that can only be in
+# the local part are 1
+LOCAL_ONLY_BYTE = 1
+INVALID_BYTE = 2
+ODD_BYTES = bytes(
+    0 if byte in DOMAIN_CHARS + b".@\n" else LOCAL_ONLY_BYTE if byte in LOCAL_CHARS else INVALID_BYTE
+    for byte in range(256)
+)
+
+# Reason codes: 0 is valid, and the rest are REASONS[code - 1]
+CODES = {reason: code for code, reason in enumerate(REASONS, 1)}
+
+# TLDs up to this long are looked up as one number, the rest one at a time
+PACKED_TLD_LENGTH = 8
+# For lowercasing letters (and leaving digits and - alone), and keeping the first
+# few bytes of a number
+LOWERCASE = 0x2020202020202020
+if numpy is not None:
+    BYTE_MASKS = numpy.array([(1 << (8 * i)) - 1 for i in range(PACKED_TLD_LENGTH + 1)], dtype=numpy.uint64)
+
+
+def map_file(path: str):
+    # A read only memory map of a file (mmap can't map empty files)
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return b""
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def batch_ranges(data, size: int = BATCH_SIZE):
+    # Split the file into (start, end) ranges of about `size` bytes, each one ending
+    # just after a newline. The last one might not end in a newline.
+    start = 0
+    while start < len(data):
+        end = data.rfind(b"\n", start, start + size) + 1
+        if end <= start:
+            # A line longer than the batch, so look further for its end
+            end = data.find(b"\n", start + size) + 1 or len(data)
+        if start + size >= len(data):
+            end = len(data)
+        yield start, end
+        start = end
+
+
+def pack_tlds(tlds: frozenset):
+    # TLDs up to PACKED_TLD_LENGTH long, as numbers like the ones check_batch() makes
+    packed = [
+        sum((byte | 0x20) << (8 * i) for i, byte in enumerate(tld))
+        for tld in tlds
+        if len(tld) <= PACKED_TLD_LENGTH
+    ]
+    return numpy.array(sorted(packed), dtype=numpy.uint64)
+
+
+class BatchResult:
+    def __init__(self, starts, ends, codes):
+        # Where each line starts and ends (not counting the line ending) in the batch,
+        # and its reason code (0 if it's valid). Blank lines aren't included.
+        self.starts = starts
+        self.ends = ends
+        self.codes = codes
+
+    def reasons(self) -> Counter:
+        counts = numpy.bincount(self.codes, minlength=len(REASONS) + 1)
+        return Counter({reason: int(counts[code]) for reason, code in CODES.items() if counts[code]})
+
+    def valid(self, data):
+        # The valid lines, each ending in a newline, as one numpy array (which can be
+        # written to a file like bytes)
+        buffer = numpy.frombuffer(data, dtype=numpy.uint8)
+        count = len(self.codes)
+        if not count:
+            return buffer[:0]
+        valid = self.codes == 0
+        # The batch is split into each line (with the byte after it, which is its \n,
+        # or the \r of \r\n) and the gap before it (blank lines, or the \n of \r\n)
+        line_ends = self.ends + 1
+        lengths = numpy.empty(count * 2 + 1, dtype=numpy.int64)
+        lengths[0] = self.starts[0]
+        lengths[2:-1:2] = self.starts[1:] - line_ends[:-1]
+        lengths[-1] = len(buffer) - line_ends[-1]
+        lengths[1::2] = line_ends - self.starts
+        if valid.all() and not lengths[0::2].any():
+            # All of it, so nothing needs copying
+            return buffer
+        keep = numpy.zeros(count * 2 + 1, dtype=numpy.bool_)
+        keep[1::2] = valid
+        lines = buffer[numpy.repeat(keep, lengths)]
+        # Turn the \r of any \r\n line endings into \n
+        lines[numpy.cumsum(lengths[1::2][valid]) - 1] = NEWLINE
+        return lines
+
+    def invalid(self, data) -> bytes:
+        # The invalid lines, as "address<tab>reason" lines. This one does make bytes for
+        # each address, but only the invalid ones.
+        invalid = numpy.flatnonzero(self.codes)
+        return b"".join([
+            bytes(data[start:end]) + b"\t" + REASON_BYTES[REASONS[code - 1]] + b"\n"
+            for start, end, code in zip(
+                self.starts[invalid].tolist(), self.ends[invalid].tolist(), self.codes[invalid].tolist()
+            )
+        ])
+
+
+def check_batch(data, checker: EmailChecker, packed_tlds) -> BatchResult:
+    # Check a batch of lines that ends in a newline, all at once. See the top of the file.
+    buffer = numpy.frombuffer(data, dtype=numpy.uint8)
+
+    # Lines. The line something is in is how many newlines are before it, which
+    # searchsorted() finds quickly since everything's in order.
+    newlines = numpy.flatnonzero(buffer == NEWLINE)
+    starts = numpy.empty_like(newlines)
+    starts[0] = 0
+    starts[1:] = newlines[:-1] + 1
+    # \r\n line endings. Lines made of just \r count as blank too, like the normal mode.
+    crlf = (newlines > starts) & (buffer[newlines - 1] == CARRIAGE_RETURN)
+    ends = newlines - crlf
+    count = len(starts)
+
+    # The @ in each line. For lines without exactly one, the codes get overwritten later.
+    ats = numpy.flatnonzero(buffer == AT)
+    at_lines = numpy.searchsorted(newlines, ats)
+    at_counts = numpy.bincount(at_lines, minlength=count)
+    at = starts.copy()
+    at[at_lines] = ats
+
+    local_lengths = at - starts
+    domain_lengths = ends - at - 1
+    codes = numpy.zeros(count, dtype=numpy.uint8)
+    # Lines that get checked one at a time
+    unsure = numpy.zeros(count, dtype=numpy.bool_)
+
+    # Characters that aren't allowed where they are. The ones only allowed in local
+    # parts are wrong after the @. bytes.translate() is a lot quicker than numpy at
+    # looking up every byte in a table.
+    text = bytes(data)
+    odd_kinds = numpy.frombuffer(text.translate(ODD_BYTES), dtype=numpy.uint8)
+    odd = numpy.flatnonzero(odd_kinds)
+    odd_lines = numpy.searchsorted(newlines, odd)
+    odd_kinds = odd_kinds[odd]
+    inside = odd < ends[odd_lines]
+    odd, odd_lines, odd_kinds = odd[inside], odd_lines[inside], odd_kinds[inside]
+    in_local = odd < at[odd_lines]
+    bad_local_chars = odd_lines[in_local & (odd_kinds == INVALID_BYTE)]
+    bad_domain_chars = odd_lines[~in_local]
+
+    # Dots: not at the start or end of either part, and not two in a row
+    dots = numpy.flatnonzero(buffer == DOT)
+    dot_lines = numpy.searchsorted(newlines, dots)
+    dot_ats = at[dot_lines]
+    in_local = dots < dot_ats
+    double = numpy.zeros(len(dots), dtype=numpy.bool_)
+    double[:-1] = dots[1:] == dots[:-1] + 1
+    local_dots = dot_lines[in_local & ((dots == starts[dot_lines]) | (dots + 1 == dot_ats) | double)]
+    in_domain = ~in_local
+    unsure[dot_lines[in_domain & ((dots - 1 == dot_ats) | (dots + 1 == ends[dot_lines]) | double)]] = True
+
+    # The last dot in each line is where the TLD starts, if it's after the @
+    last = numpy.ones(len(dots), dtype=numpy.bool_)
+    last[:-1] = dot_lines[1:] != dot_lines[:-1]
+    last_dot = at.copy()
+    last_dot[dot_lines[last]] = dots[last]
+    has_dot = last_dot > at
+
+    # Hyphens can't be at the start or end of a label
+    hyphens = numpy.flatnonzero(buffer == HYPHEN)
+    hyphen_lines = numpy.searchsorted(newlines, hyphens)
+    hyphen_ats = at[hyphen_lines]
+    in_domain = hyphens > hyphen_ats
+    hyphens, hyphen_lines, hyphen_ats = hyphens[in_domain], hyphen_lines[in_domain], hyphen_ats[in_domain]
+    unsure[hyphen_lines[
+        (hyphens - 1 == hyphen_ats) | (buffer[hyphens - 1] == DOT)
+        | (hyphens + 1 == ends[hyphen_lines]) | (buffer[hyphens + 1] == DOT)
+    ]] = True
+    # Only a domain longer than a label can have a label that's too long
+    unsure |= domain_lengths > MAX_LABEL_LENGTH
+
+    # The TLD, as a number made from its first 8 (lowercase) bytes. Reading 8 bytes
+    # from anywhere as one number is done with a view of the batch that moves 1 byte
+    # per number, with some spare bytes on the end for TLDs right at the end.
+    tld_starts = last_dot + 1
+    tld_lengths = ends - tld_starts
+    padded = text + bytes(PACKED_TLD_LENGTH)
+    numbers = numpy.ndarray((len(text) + 1,), dtype="<u8", buffer=padded, strides=(1,))
+    packed = (numbers[tld_starts] | LOWERCASE) & BYTE_MASKS[numpy.clip(tld_lengths, 0, PACKED_TLD_LENGTH)]
+    short_tld = tld_lengths <= PACKED_TLD_LENGTH
+    unsure |= has_dot & ~short_tld
+    found = numpy.minimum(numpy.searchsorted(packed_tlds, packed), len(packed_tlds) - 1)
+    known = packed_tlds[found] == packed
+
+    # The reasons, least important first so the most important one is left
+    codes[has_dot & short_tld & ~known] = CODES["unknown_tld"]
+    codes[~has_dot] = CODES["domain_no_dot"]
+    codes[bad_domain_chars] = CODES["domain_invalid_char"]
+    codes[domain_lengths > MAX_DOMAIN_LENGTH] = CODES["domain_too_long"]
+    codes[domain_lengths == 0] = CODES["domain_empty"]
+    codes[local_dots] = CODES["local_dots"]
+    codes[bad_local_chars] = CODES["local_invalid_char"]
+    codes[local_lengths > MAX_LOCAL_LENGTH] = CODES["local_too_long"]
+    codes[local_lengths == 0] = CODES["local_empty"]
+    codes[ends - starts > MAX_ADDRESS_LENGTH] = CODES["too_long"]
+    codes[at_counts > 1] = CODES["multiple_at"]
+    codes[at_counts == 0] = CODES["no_at"]
+
+    # Label problems only matter if nothing before them was wrong
+    unsure &= (codes == 0) | (codes == CODES["unknown_tld"])
+    for i in numpy.flatnonzero(unsure).tolist():
+        local, _, domain = bytes(data[starts[i]:ends[i]]).partition(b"@")
+        if domain not in checker.domains:
+            checker.learn_domains({domain})
+        reason = checker.address_reason(local, domain)
+        codes[i] = CODES[reason] if reason else 0
+
+    blank = ends > starts
+    return BatchResult(starts[blank], ends[blank], codes[blank])
+
+
+def check_range(data, start: int, end: int, checker: EmailChecker, packed_tlds, keep_invalid: bool) -> ChunkResult:
+    # Check part of the file, which ends in a newline unless it's the end of the file
+    if numpy is None:
+        return checker.check_chunk(data[start:end], keep_invalid)
+
+    # A last line without a newline is checked on its own, since there's nowhere in
+    # the map to put a newline after it
+    leftover = None
+    if data[end - 1:end] != b"\n":
+        last = max(data.rfind(b"\n", start, end) + 1, start)
+        leftover = checker.check_chunk(data[last:end], keep_invalid)
+        end = last
+
+    with memoryview(data)[start:end] as batch:
+        if end > start:
+            result = check_batch(batch, checker, packed_tlds)
+            checked = len(result.codes)
+            chunk = ChunkResult(
+                result.valid(batch).tobytes(),
+                result.invalid(batch) if keep_invalid else b"",
+                checked,
+                checked - int(numpy.count_nonzero(result.codes)),
+                result.reasons(),
+            )
+        else:
+            chunk = ChunkResult(b"", b"", 0, 0, Counter())
+
+    if leftover is not None:
+        chunk.valid += leftover.valid
+        chunk.invalid += leftover.invalid
+        chunk.checked += leftover.checked
+        chunk.valid_count += leftover.valid_count
+        chunk.reasons += leftover.reasons
+    return chunk
+
+
+def check_file(path: str, workers: int = 1, keep_invalid: bool = False, tlds: frozenset = None,
+               batch_size: int = BATCH_SIZE):
+    # Check a file in batches, and yield a ChunkResult for each one, in order. With more
+    # than one worker, batches are checked in that many other processes, which each
+    # map the file themselves, so only where each batch is gets sent to them.
+    data = map_file(path)
+    try:
+        ranges = batch_ranges(data, batch_size)
+        if workers <= 1:
+            checker = EmailChecker(tlds)
+            packed_tlds = pack_tlds(checker.tlds) if numpy is not None else None
+            for start, end in ranges:
+                yield check_range(data, start, end, checker, packed_tlds, keep_invalid)
+            return
+
+        with ProcessPoolExecutor(workers, initializer=start_worker, initargs=(tlds,)) as pool:
+            # Only a few batches ahead, so a slow output doesn't fill up memory
+            pending = deque()
+            for start, end in ranges:
+                pending.append(pool.submit(check_range_in_worker, path, start, end, keep_invalid))
+                if len(pending) >= workers * CHUNKS_PER_WORKER:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+    finally:
+        if isinstance(data, mmap.mmap):
+            data.close()
+
+
+# Each worker process keeps its own checker and map of the file
+worker_checker = None
+worker_packed_tlds = None
+worker_maps = {}
+
+
+def start_worker(tlds: frozenset):
+    global worker_checker, worker_packed_tlds
+    worker_checker = EmailChecker(tlds)
+    worker_packed_tlds = pack_tlds(worker_checker.tlds) if numpy is not None else None
+
+
+def check_range_in_worker(path: str, start: int, end: int, keep_invalid: bool) -> ChunkResult:
+    if path not in worker_maps:
+        worker_maps[path] = map_file(path)
+    return check_range(worker_maps[path], start, end, worker_checker, worker_packed_tlds, keep_invalid)
@@ -0,0 +1,122 @@
+import argparse
+import random
+from time import perf_counter
+
+from email_validation import CHUNK_SIZE, EmailChecker, load_tlds, read_chunks, rejection_reason
+
+# How many addresses a second EmailChecker gets through on one core, for a few kinds
+# of list. The lists are made up in memory first so reading the file isn't counted.
+#
+#  - clean: every address is fine (what most real lists are like)
+#  - dirty: 1 in 20 addresses has something wrong with it
+#  - generated: like generate-emails.py makes, where half of them have no @
+#
+# "one at a time" is calling rejection_reason() on each line, for comparison.
+#
+# Usage:
+# ```
+# python benchmark.py --count 2000000
+# ```
+
+LETTERS = "abcdefghijklmnopqrstuvwxyz"
+TLDS = ["com", "net", "org", "nz", "co.nz", "school.nz", "com.au", "co.uk", "io", "de"]
+MISTAKES = [
+    lambda e: e.replace("@", ""),
+    lambda e: e.replace("@", "@@"),
+    lambda e: "." + e,
+    lambda e: e.replace("@", ".@"),
+    lambda e: e.replace(".", "..", 1),
+    lambda e: e.replace("@", " @"),
+    lambda e: e + ".invalid",
+    lambda e: e.replace("@", "@-"),
+    lambda e: e.split(".")[0],
+    lambda e: "x" * 65 + e,
+]
+
+
+def make_domains(rnd: random.Random, count: int) -> list:
+    return [
+        "".join(rnd.choices(LETTERS, k=rnd.randint(3, 12))) + "." + rnd.choice(TLDS)
+        for _ in range(count)
+    ]
+
+
+def make_address(kind: str, rnd: random.Random, domains: list, weights: list) -> str:
+    name = "".join(rnd.choices(LETTERS, k=rnd.randint(3, 20)))
+    if kind == "generated":
+        return name + rnd.choice("-@") + rnd.choice(domains)
+    if rnd.random() < 0.3:
+        name += "." + "".join(rnd.choices(LETTERS, k=rnd.randint(2, 10)))
+    email = name + "@" + rnd.choices(domains, weights)[0]
+    if kind == "dirty" and rnd.random() < 0.05:
+        email = rnd.choice(MISTAKES)(email)
+    return email
+
+
+def make_list(kind: str, count: int, seed: int) -> bytes:
+    rnd = random.Random(seed)
+    domains = make_domains(rnd, 2000)
+    # A few big providers have most of the addresses
+    weights = [1000 if i < 5 else 1 for i in range(len(domains))]
+    # Making each address is slow, so make some and then pick from them
+    addresses = [make_address(kind, rnd, domains, weights) for _ in range(min(count, 50_000))]
+    return ("\n".join(rnd.choices(addresses, k=count)) + "\n").encode()
+
+
+def chunks_of(data: bytes, size: int) -> list:
+    return list(read_chunks(FakeFile(data), size))
+
+
+class FakeFile:
+    def __init__(self, data: bytes):
+        self.data = data
+        self.position = 0
+
+    def read(self, size: int) -> bytes:
+        block = self.data[self.position:self.position + size]
+        self.position += size
+        return block
+
+
+def addresses_per_second(chunks: list, count: int, keep_invalid: bool, rounds: int) -> float:
+    best = None
+    for _ in range(rounds):
+        # A new checker each time so the domains it remembers are counted too
+        checker = EmailChecker(tlds)
+        started = perf_counter()
+        for chunk in chunks:
+            checker.check_chunk(chunk, keep_invalid)
+        taken = perf_counter() - started
+        best = taken if best is None else min(best, taken)
+    return count / best
+
+
+def one_at_a_time(data: bytes, count: int) -> float:
+    started = perf_counter()
+    for line in data.splitlines():
+        rejection_reason(line, tlds)
+    return count / (perf_counter() - started)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure how fast email addresses are checked")
+    parser.add_argument("--count", type=int, default=1_000_000, help="Addresses in each list")
+    parser.add_argument("--kinds", nargs="+", default=["clean", "dirty", "generated"], help="Lists to check")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="Bytes checked at a time")
+    parser.add_argument("--rounds", type=int, default=3, help="Times to check each list (the best is shown)")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed")
+    args = parser.parse_args()
+
+    tlds = load_tlds()
+    print(f"{'list':<10} {'valid':>6} {'valid only':>14} {'with invalid':>14} {'one at a time':>14}")
+    for kind in args.kinds:
+        data = make_list(kind, args.count, args.seed)
+        chunks = chunks_of(data, args.chunk_size)
+        result = EmailChecker(tlds).check_chunk(data)
+        fast = addresses_per_second(chunks, args.count, False, args.rounds)
+        with_invalid = addresses_per_second(chunks, args.count, True, args.rounds)
+        slow = one_at_a_time(data, args.count)
+        print(
+            f"{kind:<10} {result.valid_count / args.count:>6.0%} {fast / 1e6:>12.2f}M/s"
+            f" {with_invalid / 1e6:>12.2f}M/s {slow / 1e6:>12.2f}M/s"
+        )
@@ -1,32 +1,147 @@
 # Run generate-emails.py first!!
+#
+# Checks a list of email addresses (one per line) and writes out the valid ones.
+# The list is read and written a chunk at a time, so it can be as big as you like.
+# See email_validation.py for how it works and what counts as valid.
+#
+# Usage:
+# ```
+# python check-emails.py                                   # emails.txt -> validated-emails.txt
+# python check-emails.py big-list.txt.gz valid.txt.gz --workers 4
+# zcat big-list.txt.gz | python check-emails.py - - > valid.txt
+# python check-emails.py --invalid invalid.txt --summary summary.json
+# python check-emails.py huge-list.txt valid.txt --batch   # needs numpy to be fast
+# ```
+# "-" means stdin/stdout. Gzipped input is noticed automatically, and outputs ending
+# in .gz are gzipped.
+#
+# --batch memory-maps the input and checks it in big batches with numpy, which is
+# quicker for big files (see batch_validation.py). The input has to be an actual
+# file that isn't gzipped.
+#
+# --invalid writes the rejected addresses with why, like `bob@@gmail.com<tab>multiple_at`.
+# --summary writes the counts as JSON, e.g.
+# {"checked": 69420, "valid": 34611, "invalid": 34809, "duplicates": 0, "reasons": {"no_at": 34809}, ...}
+#
+# Then the valid ones can have repeats left out, be counted by domain, and have their
+# domains checked for mail servers (see domain_stage.py):
+# ```
+# python check-emails.py --dedupe ignore-case --domain-counts domains.csv
+# python check-emails.py --dedupe exact --bloom 100000000   # less memory for huge lists
+# python check-emails.py --check-mx                         # DNS (better with dnspython)
+# python check-emails.py --mx-stub known-domains.txt        # a list instead of DNS
+# ```
 
+import argparse
+import csv
 import json
+import os
+import sys
+from collections import Counter
+from contextlib import nullcontext
+from time import perf_counter
 
-raw_emails = []
+from batch_validation import BATCH_SIZE, check_file
+from domain_stage import DnsResolver, DomainStage, StubResolver
+from email_validation import (
+    CHUNK_SIZE,
+    GZIP_MAGIC,
+    TLDS_PATH,
+    check_chunks,
+    load_tlds,
+    open_input,
+    open_output,
+    read_chunks,
+)
 
-with open("emails.txt", "r") as f:
-    raw_emails = f.read().split("\n")
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check a list of email addresses")
+    parser.add_argument("input", nargs="?", default="emails.txt", help="List of emails, or - for stdin")
+    parser.add_argument("output", nargs="?", default="validated-emails.txt", help="Where to write the valid ones")
+    parser.add_argument("--workers", type=int, default=1,
+                        help=f"Processes to check emails in at once (this computer has {os.cpu_count()})")
+    parser.add_argument("--chunk-size", type=int,
+                        help=f"Bytes to check at a time (default {CHUNK_SIZE}, or {BATCH_SIZE} with --batch)")
+    parser.add_argument("--batch", action="store_true", help="Memory-map the input and check it in big batches")
+    parser.add_argument("--invalid", help="Where to write the invalid ones, with why they're invalid")
+    parser.add_argument("--summary", help="Where to write how many were valid and invalid, as JSON")
+    parser.add_argument("--tlds", default=TLDS_PATH, help="File of allowed top level domains, one per line")
+    parser.add_argument("--dedupe", choices=["exact", "ignore-case"], help="Leave out repeated addresses")
+    parser.add_argument("--bloom", type=int, metavar="ADDRESSES",
+                        help="Remember addresses for --dedupe in a Bloom filter sized for this many")
+    parser.add_argument("--domain-counts", help="Where to write how many valid addresses each domain has, as CSV")
+    parser.add_argument("--check-mx", action="store_true", help="Reject addresses at domains without mail servers")
+    parser.add_argument("--mx-stub", help="Check mail servers against this list of domains instead of DNS")
+    args = parser.parse_args()
+    if args.batch:
+        if args.input == "-":
+            parser.error("--batch needs an input file, not stdin")
+        with open(args.input, "rb") as f:
+            if f.read(2) == GZIP_MAGIC:
+                parser.error("--batch can't read gzipped files")
 
+    started = perf_counter()
+    checked = 0
+    valid = 0
+    reasons = Counter()
 
-validated_emails = []
+    tlds = load_tlds(args.tlds)
+    keep_invalid = args.invalid is not None
+    resolver = None
+    if args.mx_stub:
+        resolver = StubResolver.from_file(args.mx_stub)
+    elif args.check_mx:
+        resolver = DnsResolver()
+    stage = None
+    if args.dedupe or args.domain_counts or resolver:
+        stage = DomainStage(args.dedupe, args.bloom, resolver, count_domains=args.domain_counts is not None)
 
-for email in raw_emails:
-    valid = True
+    with (
+        nullcontext() if args.batch else open_input(args.input) as f,
+        open_output(args.output) as out,
+        open_output(args.invalid) if keep_invalid else nullcontext() as invalid,
+    ):
+        if args.batch:
+            results = check_file(args.input, args.workers, keep_invalid, tlds, args.chunk_size or BATCH_SIZE)
+        else:
+            results = check_chunks(read_chunks(f, args.chunk_size or CHUNK_SIZE), args.workers, keep_invalid, tlds)
+        for result in results:
+            if stage:
+                stage.process(result, keep_invalid)
+            out.write(result.valid)
+            if keep_invalid:
+                invalid.write(result.invalid)
+            checked += result.checked
+            valid += result.valid_count
+            reasons.update(result.reasons)
+    taken = perf_counter() - started
+    duplicates = stage.duplicates if stage else 0
 
-    parts = email.split("@")
+    if args.domain_counts:
+        with open(args.domain_counts, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["domain", "addresses"])
+            for domain, count in stage.domain_counts.most_common():
+                writer.writerow([domain.decode(), count])
 
-    if len(parts) != 2:
-        valid = False
-    else:
-        domain = parts[1].split(".")
+    if args.summary:
+        summary = {
+            "checked": checked,
+            "valid": valid,
+            "invalid": checked - valid - duplicates,
+            "duplicates": duplicates,
+            "reasons": dict(reasons.most_common()),
+            "seconds": round(taken, 3),
+        }
+        if args.domain_counts:
+            summary["domains"] = len(stage.domain_counts)
+        with open(args.summary, "w") as f:
+            json.dump(summary, f, indent=2)
+            f.write("\n")
 
-        if len(domain) < 2:
-            valid = False
-
-        # TODO: Add more checks in here
-
-    if valid:
-        validated_emails.append(email)
-
-with open("validated-emails.txt", "w") as f:
-    f.write("\n".join(validated_emails))
+    # stdout might be the output, so this goes to stderr
+    print(f"Checked {checked} emails in {taken:.2f}s, {valid} valid", file=sys.stderr)
+    if duplicates:
+        print(f"  {duplicates:>10} repeats left out", file=sys.stderr)
+    for reason, count in reasons.most_common():
+        print(f"  {count:>10} {reason}", file=sys.stderr)
@@ -0,0 +1,250 @@
+import operator
+import socket
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from itertools import compress, filterfalse
+from math import ceil, log
+
+from email_validation import MAX_CACHED_DOMAINS, NEWLINE_TO_AT, NO_MAIL_SERVER, REASON_BYTES, ChunkResult
+
+# numpy and dnspython aren't needed, but make the Bloom filter faster and let mail
+# servers be looked up properly
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import dns.exception
+    import dns.resolver
+except ImportError:
+    dns = None
+
+# What check-emails.py does with the valid addresses after they've been checked, if
+# asked to:
+#
+#  - Leaving out repeats (--dedupe), either exactly the same or ignoring case. Seen
+#    addresses are remembered as their hash (HashSet), or with --bloom in a Bloom filter
+#    (BloomFilter), which uses a lot less memory but very occasionally thinks an
+#    address is a repeat when it isn't.
+#  - Counting the addresses at each domain (--domain-counts)
+#  - Checking each domain can receive email (--check-mx), by asking a resolver: DNS,
+#    or a StubResolver that just has a list of domains, for testing without a network
+#
+# Lists have millions of addresses at a few thousand domains, so anything about a
+# domain is only worked out once per domain. Like email_validation.py, each chunk is
+# split up and looked at with things that run in C (split, map, dict and set
+# operations), so Python only loops over the repeats and the domains.
+#
+# Example usage:
+# ```
+# stage = DomainStage(dedupe="ignore-case", resolver=StubResolver(["gmail.com"]))
+# for result in check_chunks(read_chunks(f)):
+#   stage.process(result)
+# print(stage.duplicates, stage.domain_counts.most_common(10))
+# ```
+
+# Domain lookups at once when checking mail servers
+RESOLVER_THREADS = 16
+# How often a Bloom filter says an address is a repeat when it isn't
+BLOOM_ERROR_RATE = 0.001
+
+
+class HashSet:
+    # Remembers addresses as their 64 bit hash, which is a lot smaller than the address
+    # itself. Two different addresses with the same hash is so unlikely it's ignored (for
+    # 100 million addresses, there's about a 1 in 4000 chance of it happening at all).
+    def __init__(self):
+        self.seen = set()
+
+    def new_keys(self, keys) -> list:
+        # Which of the keys (different hashes) haven't been seen before, in the same
+        # order, and remember them
+        new = list(filterfalse(self.seen.__contains__, keys))
+        self.seen.update(new)
+        return new
+
+
+class BloomFilter:
+    # Remembers addresses as a few bits each in a big array. Addresses set bits at
+    # positions that come from their hash, and an address has been seen before if all
+    # its bits are set. That can happen by chance, about error_rate of the time.
+    def __init__(self, expected: int, error_rate: float = BLOOM_ERROR_RATE):
+        # The usual sizes for this many addresses at this error rate
+        self.size = max(64, ceil(-expected * log(error_rate) / log(2) ** 2))
+        self.probes = max(1, round(self.size / expected * log(2)))
+        if numpy is not None:
+            self.bits = numpy.zeros((self.size + 7) // 8, dtype=numpy.uint8)
+        else:
+            self.bits = bytearray((self.size + 7) // 8)
+
+    def positions(self, key: int):
+        # Where the bits for a hash are, made from its two halves
+        first, second = key & 0xFFFFFFFF, (key >> 32) | 1
+        return [(first + i * second) % self.size for i in range(self.probes)]
+
+    def new_keys(self, keys) -> list:
+        if numpy is None:
+            new = []
+            for key in keys:
+                positions = self.positions(key)
+                if not all(self.bits[p >> 3] & (1 << (p & 7)) for p in positions):
+                    new.append(key)
+                    for p in positions:
+                        self.bits[p >> 3] |= 1 << (p & 7)
+            return new
+
+        # The same thing for all the keys at once. Keys in the same chunk are already
+        # different, so it's fine to check them all before setting any bits.
+        hashes = numpy.fromiter(keys, dtype=numpy.int64, count=len(keys)).view(numpy.uint64)
+        first = hashes & numpy.uint64(0xFFFFFFFF)
+        second = (hashes >> numpy.uint64(32)) | numpy.uint64(1)
+        steps = numpy.arange(self.probes, dtype=numpy.uint64)[:, None]
+        positions = (first + steps * second) % numpy.uint64(self.size)
+        masks = numpy.left_shift(1, positions & numpy.uint64(7)).astype(numpy.uint8)
+        places = positions >> numpy.uint64(3)
+        new = ~((self.bits[places] & masks) != 0).all(axis=0)
+        numpy.bitwise_or.at(self.bits, places[:, new].ravel(), masks[:, new].ravel())
+        return list(compress(keys, new.tolist()))
+
+
+class StubResolver:
+    # Says a domain has a mail server if it's in a list, without using the network.
+    # For testing, and for lists of domains that are already known to be fine.
+    def __init__(self, domains):
+        self.domains = frozenset(domain.strip().lower() for domain in domains if domain.strip())
+        self.lookups = 0
+
+    @classmethod
+    def from_file(cls, path: str):
+        # One domain per line, # for comments
+        with open(path) as f:
+            return cls(line for line in f if not line.startswith("#"))
+
+    def has_mail_server(self, domain: str) -> bool:
+        self.lookups += 1
+        return domain in self.domains
+
+
+class DnsResolver:
+    # Asks DNS for the domain's MX records, or if it doesn't have any, an address
+    # (a domain with just an A record gets email sent to it, RFC 5321 section 5.1).
+    # Uses dnspython if it's installed. Without it, only the address can be looked up.
+    #
+    # If the lookup fails for some other reason (like a timeout), the domain counts as
+    # having a mail server, so a slow network doesn't throw away good addresses.
+    def __init__(self, timeout: float = 5.0):
+        self.timeout = timeout
+        self.lookups = 0
+
+    def has_address(self, domain: str) -> bool:
+        try:
+            socket.getaddrinfo(domain, 25, proto=socket.IPPROTO_TCP)
+            return True
+        except socket.gaierror as e:
+            return e.errno not in (socket.EAI_NONAME, getattr(socket, "EAI_NODATA", socket.EAI_NONAME))
+
+    def has_mail_server(self, domain: str) -> bool:
+        self.lookups += 1
+        if dns is None:
+            return self.has_address(domain)
+        try:
+            answers = dns.resolver.resolve(domain, "MX", lifetime=self.timeout)
+        except dns.resolver.NXDOMAIN:
+            return False
+        except dns.resolver.NoAnswer:
+            return self.has_address(domain)
+        except dns.exception.DNSException:
+            return True
+        # A "null MX" (RFC 7505) means the domain doesn't take email
+        return any(answer.exchange.to_text() != "." for answer in answers)
+
+
+class MailServers:
+    # Whether domains have mail servers, asking the resolver about each one only once.
+    # The answers for the most recently seen MAX_CACHED_DOMAINS domains are remembered.
+    def __init__(self, resolver, threads: int = RESOLVER_THREADS):
+        self.resolver = resolver
+        self.pool = ThreadPoolExecutor(threads)
+        # domain -> whether it has one, least recently seen first
+        self.answers = OrderedDict()
+
+    def lookup(self, domain: bytes) -> bool:
+        return self.resolver.has_mail_server(domain.decode())
+
+    def without_mail_servers(self, domains: set) -> set:
+        for domain in domains.intersection(self.answers):
+            self.answers.move_to_end(domain)
+        new = list(domains.difference(self.answers))
+        # DNS lookups are mostly waiting, so do lots at once
+        for domain, answer in zip(new, self.pool.map(self.lookup, new)):
+            self.answers[domain] = answer
+        while len(self.answers) > max(MAX_CACHED_DOMAINS, len(domains)):
+            self.answers.popitem(last=False)
+        return {domain for domain in domains if not self.answers[domain]}
+
+
+class DomainStage:
+    # dedupe: None, "exact" or "ignore-case"
+    # bloom: use a Bloom filter sized for this many addresses instead of a HashSet
+    # resolver: check mail servers with this (like StubResolver or DnsResolver)
+    # count_domains: count the valid addresses at each domain, in domain_counts
+    def __init__(self, dedupe: str = None, bloom: int = None, resolver=None, count_domains: bool = False):
+        self.dedupe = dedupe
+        self.seen = (BloomFilter(bloom) if bloom else HashSet()) if dedupe else None
+        self.mail_servers = MailServers(resolver) if resolver is not None else None
+        self.count_domains = count_domains
+        self.duplicates = 0
+        # Lowercase domain -> valid addresses there
+        self.domain_counts = Counter()
+
+    def process(self, result: ChunkResult, keep_invalid: bool = False) -> ChunkResult:
+        # Change a checked chunk's valid addresses (and the counts) to leave out the
+        # repeats and ones without mail servers
+        valid = result.valid
+        lines = None
+
+        if self.dedupe and valid:
+            # The first of each address in the chunk, by hash, then the ones not seen before
+            lines = valid.split(b"\n")
+            lines.pop()
+            keys = lines
+            if self.dedupe == "ignore-case":
+                keys = valid.lower().split(b"\n")
+                keys.pop()
+            first = {}
+            # (list() just makes map() run)
+            list(map(first.setdefault, map(hash, keys), lines))
+            new = self.seen.new_keys(first)
+            self.duplicates += len(lines) - len(new)
+            if len(new) < len(lines):
+                lines = list(map(first.__getitem__, new))
+                valid = b"\n".join(lines) + b"\n" if lines else b""
+
+        if valid and (self.mail_servers is not None or self.count_domains):
+            # Every line has one @, so splitting at both gives local, domain, local, domain...
+            domains = valid.lower().translate(NEWLINE_TO_AT).split(b"@")[1::2]
+
+            if self.mail_servers is not None:
+                missing = self.mail_servers.without_mail_servers(set(domains))
+                if missing:
+                    if lines is None:
+                        lines = valid.split(b"\n")
+                        lines.pop()
+                    rejected = list(map(missing.__contains__, domains))
+                    bad = list(compress(lines, rejected))
+                    result.reasons[NO_MAIL_SERVER] += len(bad)
+                    if keep_invalid:
+                        result.invalid += b"".join([line + b"\t" + REASON_BYTES[NO_MAIL_SERVER] + b"\n" for line in bad])
+                    kept = list(map(operator.not_, rejected))
+                    lines = list(compress(lines, kept))
+                    domains = list(compress(domains, kept))
+                    valid = b"\n".join(lines) + b"\n" if lines else b""
+
+            if self.count_domains:
+                self.domain_counts.update(domains)
+
+        if valid is not result.valid:
+            result.valid = valid
+            result.valid_count = len(lines)
+        return result
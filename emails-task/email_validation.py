@@ -0,0 +1,394 @@
+import gzip
+import operator
+import os
+import sys
+from collections import Counter, OrderedDict, deque
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor
+from itertools import compress, count, repeat
+
+# Checking big lists of email addresses without loading them all into memory.
+# check-emails.py is the command line for this.
+#
+# The input is read in chunks of about CHUNK_SIZE bytes (always ending at the end of
+# a line), each chunk is checked, and the valid addresses are written out straight away,
+# so memory use stays the same however big the list is. The chunks can be checked
+# in other processes at the same time (workers), and the results are still written
+# in the same order as the input.
+#
+# Everything works on bytes rather than strings, since decoding every line to a
+# string and back would take longer than checking it.
+#
+# Each address gets either accepted or a reason it was rejected (see REASONS), e.g.
+# `a..b@gmail.com` is "local_dots" and `bob@example.invalid` is "unknown_tld".
+# See EmailChecker for how this is done fast enough for lists with millions of
+# addresses, and benchmark.py for how fast it is.
+#
+# Example usage:
+# ```
+# with open_input("emails.txt.gz") as f, open_output("-") as out:
+#   for result in check_chunks(read_chunks(f), workers=4, keep_invalid=True):
+#     out.write(result.valid)
+#     print(result.invalid.decode(), result.reasons)
+# ```
+
+# Bytes read (and given to a worker) at a time
+CHUNK_SIZE = 1024 * 1024
+# Chunks waiting for or being checked by each worker. More keeps the workers busier,
+# but uses more memory.
+CHUNKS_PER_WORKER = 2
+
+GZIP_MAGIC = b"\x1f\x8b"
+
+
+# What's allowed, from RFC 5321 and 5322. Only the parts people actually use though:
+# quoted local parts ("john smith"@example.com), IP address domains (a@[127.0.0.1])
+# and non-ASCII addresses are all rejected.
+LETTERS_AND_DIGITS = b"ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789"
+# The bit before the @ ("atext" in the RFC), plus dots but not at the start or end or two in a row
+LOCAL_CHARS = LETTERS_AND_DIGITS + b"!#$%&'*+/=?^_`{|}~-"
+# The bit after the @ is labels of these, split by dots, and can't start or end with a -
+DOMAIN_CHARS = LETTERS_AND_DIGITS + b"-"
+
+MAX_ADDRESS_LENGTH = 254
+MAX_LOCAL_LENGTH = 64
+MAX_DOMAIN_LENGTH = 253
+MAX_LABEL_LENGTH = 63
+
+# The domain has to end in one of these
+TLDS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tlds.txt")
+
+# Why an address was rejected. These go in the invalid output and the summary, so
+# don't rename them. An address only gets the first one that applies, in this order.
+NO_AT = "no_at"
+MULTIPLE_AT = "multiple_at"
+TOO_LONG = "too_long"
+LOCAL_EMPTY = "local_empty"
+LOCAL_TOO_LONG = "local_too_long"
+LOCAL_INVALID_CHAR = "local_invalid_char"
+LOCAL_DOTS = "local_dots"
+DOMAIN_EMPTY = "domain_empty"
+DOMAIN_TOO_LONG = "domain_too_long"
+DOMAIN_INVALID_CHAR = "domain_invalid_char"
+DOMAIN_NO_DOT = "domain_no_dot"
+DOMAIN_EMPTY_LABEL = "domain_empty_label"
+DOMAIN_LABEL_TOO_LONG = "domain_label_too_long"
+DOMAIN_HYPHEN = "domain_hyphen"
+UNKNOWN_TLD = "unknown_tld"
+# Only when checking mail servers (see domain_stage.py), after everything else
+NO_MAIL_SERVER = "no_mail_server"
+REASONS = [
+    NO_AT, MULTIPLE_AT, TOO_LONG, LOCAL_EMPTY, LOCAL_TOO_LONG, LOCAL_INVALID_CHAR, LOCAL_DOTS,
+    DOMAIN_EMPTY, DOMAIN_TOO_LONG, DOMAIN_INVALID_CHAR, DOMAIN_NO_DOT, DOMAIN_EMPTY_LABEL,
+    DOMAIN_LABEL_TOO_LONG, DOMAIN_HYPHEN, UNKNOWN_TLD, NO_MAIL_SERVER,
+]
+REASON_BYTES = {reason: reason.encode() for reason in REASONS}
+
+# Domains remembered by each EmailChecker (the most recently seen ones)
+MAX_CACHED_DOMAINS = 100_000
+
+# Tables for bytes.translate(), which goes through the whole chunk in C
+ALL_BYTES = bytes(range(256))
+NOT_AT_OR_NEWLINE = ALL_BYTES.translate(None, b"@\n")
+NEWLINE_TO_AT = bytes.maketrans(b"\n", b"@")
+# Newlines and @s turn into dots, and anything else that can't be in a local part into \0
+MARK_NOT_LOCAL = bytes(
+    ord(".") if byte in b"\n@" else byte if byte in LOCAL_CHARS + b"." else 0 for byte in ALL_BYTES
+)
+# Reasons for lines that don't have exactly one @, from what's left of them in the skeleton
+SHAPE_REASONS = {b"": NO_AT, b"@": None}
+DOMAIN_CHARS_DOT = DOMAIN_CHARS + b"."
+
+
+def load_tlds(path: str = TLDS_PATH) -> frozenset:
+    # One TLD per line, like https://data.iana.org/TLD/tlds-alpha-by-domain.txt
+    with open(path, "rb") as f:
+        return frozenset(line.strip().lower() for line in f if line.strip() and not line.startswith(b"#"))
+
+
+def local_reason(local: bytes):
+    # Why the bit before the @ isn't allowed, or None if it's fine
+    if not local:
+        return LOCAL_EMPTY
+    if len(local) > MAX_LOCAL_LENGTH:
+        return LOCAL_TOO_LONG
+    if local.translate(None, LOCAL_CHARS + b"."):
+        return LOCAL_INVALID_CHAR
+    if local[:1] == b"." or local[-1:] == b"." or b".." in local:
+        return LOCAL_DOTS
+    return None
+
+
+def domain_reason(domain: bytes, tlds: frozenset):
+    # Why the bit after the @ isn't allowed, or None if it's fine
+    if not domain:
+        return DOMAIN_EMPTY
+    if len(domain) > MAX_DOMAIN_LENGTH:
+        return DOMAIN_TOO_LONG
+    if domain.translate(None, DOMAIN_CHARS_DOT):
+        return DOMAIN_INVALID_CHAR
+    labels = domain.split(b".")
+    if len(labels) < 2:
+        return DOMAIN_NO_DOT
+    for label in labels:
+        if not label:
+            return DOMAIN_EMPTY_LABEL
+        if len(label) > MAX_LABEL_LENGTH:
+            return DOMAIN_LABEL_TOO_LONG
+        if label[:1] == b"-" or label[-1:] == b"-":
+            return DOMAIN_HYPHEN
+    if labels[-1].lower() not in tlds:
+        return UNKNOWN_TLD
+    return None
+
+
+def rejection_reason(email: bytes, tlds: frozenset = None):
+    # Why an address isn't valid (one of REASONS), or None if it is. This checks one
+    # address at a time, EmailChecker.check_chunk() gives the same answers a lot faster.
+    at_count = email.count(b"@")
+    if at_count == 0:
+        return NO_AT
+    if at_count > 1:
+        return MULTIPLE_AT
+    if len(email) > MAX_ADDRESS_LENGTH:
+        return TOO_LONG
+    local, _, domain = email.partition(b"@")
+    return local_reason(local) or domain_reason(domain, load_tlds() if tlds is None else tlds)
+
+
+class ChunkResult:
+    def __init__(self, valid: bytes, invalid: bytes, checked: int, valid_count: int, reasons: Counter):
+        # valid: the valid addresses, one per line
+        # invalid: "address<tab>reason" lines, if they were asked for
+        # reasons: how many addresses were rejected for each reason
+        self.valid = valid
+        self.invalid = invalid
+        self.checked = checked
+        self.valid_count = valid_count
+        self.reasons = reasons
+
+
+class EmailChecker:
+    # Checks chunks of addresses a lot faster than calling rejection_reason() on each one.
+    #
+    # Lists have thousands of addresses at a few hundred domains, so each domain is only
+    # checked once (and remembered). Then the local parts in a chunk are all checked
+    # together: they're joined into one bytes and looked over with translate() and `in`,
+    # which run in C. That means when a whole chunk is fine (the usual case) Python
+    # doesn't have to look at each address at all, and the valid output is just the
+    # chunk. Only chunks with something wrong in them go back and find out which
+    # addresses are bad and why.
+    def __init__(self, tlds: frozenset = None):
+        self.tlds = load_tlds() if tlds is None else tlds
+        # domain -> reason it's rejected (None if it's fine), least recently seen first
+        self.domains = OrderedDict()
+
+    def address_reason(self, local: bytes, domain: bytes):
+        # rejection_reason() for an address with one @, using the remembered domains
+        if len(local) + len(domain) >= MAX_ADDRESS_LENGTH:
+            return TOO_LONG
+        return local_reason(local) or self.domains[domain]
+
+    def learn_domains(self, domains: set):
+        # Check the ones that aren't remembered yet, and forget the ones not seen for
+        # longest if there are too many (but never ones in `domains`)
+        for domain in domains.intersection(self.domains):
+            self.domains.move_to_end(domain)
+        for domain in domains.difference(self.domains):
+            self.domains[domain] = domain_reason(domain, self.tlds)
+        while len(self.domains) > max(MAX_CACHED_DOMAINS, len(domains)):
+            self.domains.popitem(last=False)
+
+    def suspect_lines(self, text: bytes, locals_: list, longest_domain: int) -> set:
+        # Which lines of `text` (addresses with one @ each) might have something wrong
+        # with the local part, so only those get checked one at a time. It's all found
+        # with searches that run in C: newlines and @s become dots, so a ".." is a dot at
+        # the start or end of a local part, two dots in a row or an empty local part,
+        # and anything that can't be in a local part becomes \0. Bad domains turn up
+        # here too sometimes, which doesn't matter since they're checked properly after.
+        marked = text.translate(MARK_NOT_LOCAL)
+        found = [0] if marked[:1] == b"." else []
+        for needle in [b"\0", b".."]:
+            position = marked.find(needle)
+            while position != -1:
+                found.append(position)
+                position = marked.find(needle, position + 1)
+
+        # Turn where they are into line numbers. The +1 is because for a newline
+        # followed by a dot, it's the line after the newline.
+        suspects = set()
+        number = 0
+        previous = 0
+        for position in sorted(found):
+            number += text.count(b"\n", previous, position + 1)
+            previous = position + 1
+            suspects.add(number)
+
+        # Too long, either on its own or with the longest domain
+        most = min(MAX_LOCAL_LENGTH, MAX_ADDRESS_LENGTH - 1 - longest_domain)
+        if max(map(len, locals_)) > most:
+            suspects.update(compress(count(), map(most.__lt__, map(len, locals_))))
+        return suspects
+
+    def check_chunk(self, chunk: bytes, keep_invalid: bool = False) -> ChunkResult:
+        # Check a chunk of whole lines. Blank lines are skipped. Windows line endings
+        # are turned into normal ones first, like open() in text mode does.
+        if b"\r" in chunk:
+            chunk = chunk.replace(b"\r\n", b"\n")
+        if chunk[-1:] != b"\n":
+            chunk += b"\n"
+        if chunk[:1] == b"\n" or b"\n\n" in chunk:
+            lines = list(filter(None, chunk.split(b"\n")))
+            if not lines:
+                return ChunkResult(b"", b"", 0, 0, Counter())
+            chunk = b"\n".join(lines) + b"\n"
+
+        # Just the @s and newlines, e.g. b"@\n@\n\n@@\n" for 2 fine lines, one with no @
+        # and one with two
+        skeleton = chunk.translate(None, NOT_AT_OR_NEWLINE)
+        checked = skeleton.count(b"\n")
+        if skeleton == b"@\n" * checked:
+            lines = None
+            shapes = None
+            text = chunk
+        else:
+            # Put the ones that don't have one @ to the side
+            lines = chunk.split(b"\n")
+            lines.pop()
+            shapes = skeleton.split(b"\n")
+            shapes.pop()
+            one_at = list(map(b"@".__eq__, shapes))
+            lines = list(compress(lines, one_at))
+            text = b"\n".join(lines) + b"\n" if lines else b""
+        # Every line has one @ now, so splitting at both gives local, domain, local, domain...
+        parts = text.translate(NEWLINE_TO_AT).split(b"@")
+        locals_, domains = parts[0:-1:2], parts[1::2]
+
+        # Why each of the one-@ addresses is rejected, only worked out if some of them are
+        reasons = None
+        if locals_:
+            distinct = set(domains)
+            self.learn_domains(distinct)
+            suspects = self.suspect_lines(text, locals_, max(map(len, distinct)))
+            bad_domains = any(map(self.domains.__getitem__, distinct))
+            if bad_domains or suspects:
+                reasons = list(map(self.domains.__getitem__, domains)) if bad_domains else [None] * len(domains)
+                for i in suspects:
+                    reasons[i] = self.address_reason(locals_[i], domains[i])
+
+        if shapes is None and reasons is None:
+            return ChunkResult(chunk, b"", checked, checked, Counter())
+
+        if lines is None:
+            lines = chunk.split(b"\n")
+            lines.pop()
+        if reasons is None:
+            valid_lines = lines
+            counts = Counter()
+        else:
+            valid_lines = list(compress(lines, map(operator.not_, reasons)))
+            counts = Counter(filter(None, reasons))
+        if shapes is not None:
+            counts[NO_AT] += shapes.count(b"")
+            counts[MULTIPLE_AT] += checked - len(lines) - counts[NO_AT]
+            counts = +counts
+
+        invalid = b""
+        if keep_invalid:
+            # Back in the same order as the input
+            if shapes is None:
+                all_reasons = reasons
+            else:
+                all_reasons = list(map(SHAPE_REASONS.get, shapes, repeat(MULTIPLE_AT)))
+                if reasons is not None:
+                    line_numbers = list(compress(count(), one_at))
+                    for i in compress(count(), reasons):
+                        all_reasons[line_numbers[i]] = reasons[i]
+            invalid = b"".join(map(b"%s\t%s\n".__mod__, zip(
+                compress(chunk.split(b"\n"), all_reasons),
+                map(REASON_BYTES.__getitem__, filter(None, all_reasons)),
+            )))
+
+        valid = b"\n".join(valid_lines) + b"\n" if valid_lines else b""
+        return ChunkResult(valid, invalid, checked, len(valid_lines), counts)
+
+
+def read_chunks(f, size: int = CHUNK_SIZE):
+    # Yield the contents of a binary file about `size` bytes at a time,
+    # split at the end of a line so no address is cut in half
+    leftover = b""
+    while True:
+        block = f.read(size)
+        if not block:
+            if leftover:
+                yield leftover
+            return
+        if leftover:
+            block = leftover + block
+        end = block.rfind(b"\n") + 1
+        if end == 0:
+            # No newline yet (a very long line), so keep reading
+            leftover = block
+            continue
+        leftover = block[end:]
+        yield block[:end]
+
+
+def check_chunks(chunks, workers: int = 1, keep_invalid: bool = False, tlds: frozenset = None):
+    # Check chunks of lines, and yield a ChunkResult for each one, in order.
+    # With more than one worker, chunks are checked in that many other processes.
+    if workers <= 1:
+        checker = EmailChecker(tlds)
+        for chunk in chunks:
+            yield checker.check_chunk(chunk, keep_invalid)
+        return
+
+    with ProcessPoolExecutor(workers, initializer=start_worker, initargs=(tlds,)) as pool:
+        # Only read ahead a few chunks, so a slow output doesn't fill up memory
+        pending = deque()
+        for chunk in chunks:
+            pending.append(pool.submit(check_in_worker, chunk, keep_invalid))
+            if len(pending) >= workers * CHUNKS_PER_WORKER:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+# Each worker process keeps its own checker, so it remembers the domains it's seen
+worker_checker = None
+
+
+def start_worker(tlds: frozenset):
+    global worker_checker
+    worker_checker = EmailChecker(tlds)
+
+
+def check_in_worker(chunk: bytes, keep_invalid: bool) -> ChunkResult:
+    return worker_checker.check_chunk(chunk, keep_invalid)
+
+
+def open_input(path: str):
+    # Open a file to read as bytes ("-" for stdin). Gzipped files are uncompressed as
+    # they're read, whatever they're called.
+    # stdin is wrapped in nullcontext() so the caller's `with` doesn't close it
+    # (closing a GzipFile doesn't close the file it reads from either).
+    if path == "-":
+        f = sys.stdin.buffer
+        return gzip.GzipFile(fileobj=f, mode="rb") if f.peek(2)[:2] == GZIP_MAGIC else nullcontext(f)
+    f = open(path, "rb")
+    if f.peek(2)[:2] == GZIP_MAGIC:
+        f.close()
+        return gzip.open(path, "rb")
+    return f
+
+
+def open_output(path: str):
+    # Open a file to write bytes to ("-" for stdout). Files ending in .gz are gzipped.
+    # stdout is wrapped in nullcontext() so the caller's `with` doesn't close it, which
+    # would break anything printed afterwards (like the summary).
+    if path == "-":
+        return nullcontext(sys.stdout.buffer)
+    if path.endswith(".gz"):
+        # The default level (9) is a lot slower for not much smaller files
+        return gzip.open(path, "wb", compresslevel=6)
+    return open(path, "wb")
@@ -1,26 +1,166 @@
+# Makes a made-up list of email addresses to test check-emails.py with.
+#
+# Each address is 3-20 random letters, then an @ and a domain, except that some of
+# them (--error-rate, half by default) have a - instead of the @ so they're invalid.
+# The same --seed always gives the same list.
+#
+# Usage:
+# ```
+# python generate-emails.py                                 # 69420 addresses -> emails.txt
+# python generate-emails.py big-list.txt --count 100000000 --error-rate 0.05
+# python generate-emails.py - --count 10 --seed 7           # to stdout
+# python generate-emails.py --domains 5000 --distribution zipf
+# ```
+#
+# --domains is how many different domains there are: the usual ones first, then made
+# up ones. With --distribution zipf, the first domain is the most common, the second
+# half as common, the third a third as common, and so on (like real lists, where most
+# people are at a few big providers).
+#
+# Addresses are made BATCH_ROWS at a time and written straight away, so it doesn't
+# matter how many there are. Random letters come from random bytes turned into
+# letters with bytes.translate(), so nothing loops over each letter in Python.
+# With numpy each batch is put together with arrays instead of a loop too, which is a
+# lot faster (but gives a different list for the same seed than without numpy).
+
+import argparse
 import random
+import sys
+from contextlib import nullcontext
+from functools import cache
+from itertools import accumulate, product
+from time import perf_counter
+
+# numpy isn't needed, but makes this much faster
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 domain_first_parts = ["google", "wc", "gmail",
                       "outlook", "hotmail", "viggers", "whs", "govt", "dinopoloclub"]
 
 top_level_domains = ["com", "net", "co.nz", "school.nz", "nz"]
 
-email_joiners = ["-", "@"]
+MIN_NAME_LENGTH = 3
+MAX_NAME_LENGTH = 20
+# Addresses made at a time. Each batch gets its own random numbers from the seed and
+# the batch number, so it's always the same list whatever else changes.
+BATCH_ROWS = 1_000_000
+
+LETTERS = b"abcdefghijklmnopqrstuvwxyz"
+# Random bytes -> letters. 256 isn't a multiple of 26, so the bytes past the last
+# whole 26 are thrown away, otherwise a-v would come up more often than w-z.
+USABLE_BYTES = 256 - 256 % len(LETTERS)
+BYTES_TO_LETTERS = bytes(LETTERS[i % len(LETTERS)] for i in range(256))
+UNUSABLE_BYTES = bytes(range(USABLE_BYTES, 256))
+
+
+def make_domains(count: int, seed: int) -> list:
+    # The usual domains, then made up ones if there need to be more
+    domains = [f"{first}.{tld}" for first, tld in product(domain_first_parts, top_level_domains)][:count]
+    rnd = random.Random(f"{seed}-domains")
+    made_up = set(domains)
+    while len(domains) < count:
+        name = "".join(rnd.choices(LETTERS.decode(), k=rnd.randint(3, 12)))
+        domain = f"{name}.{rnd.choice(top_level_domains)}"
+        if domain not in made_up:
+            made_up.add(domain)
+            domains.append(domain)
+    return domains
+
+
+def domain_weights(count: int, distribution: str) -> list:
+    if distribution == "zipf":
+        return [1 / rank for rank in range(1, count + 1)]
+    return [1] * count
+
+
+def random_letters(random_bytes, count: int) -> bytes:
+    # count random letters, from a function that gives that many random bytes
+    letters = b""
+    while len(letters) < count:
+        # About 9% of bytes get thrown away, so ask for a bit more than that
+        needed = count - len(letters)
+        letters += random_bytes(needed + needed // 10 + 16).translate(BYTES_TO_LETTERS, UNUSABLE_BYTES)
+    return letters[:count]
+
+
+@cache
+def make_domain_table(domains: tuple):
+    # Each domain with a newline on the end, padded out to the same length, and which
+    # bytes of each row are actually used
+    width = max(map(len, domains)) + 1
+    domain_table = numpy.zeros((len(domains), width), dtype=numpy.uint8)
+    domain_used = numpy.zeros((len(domains), width), dtype=bool)
+    for i, domain in enumerate(domains):
+        line_end = (domain + "\n").encode()
+        domain_table[i, :len(line_end)] = numpy.frombuffer(line_end, dtype=numpy.uint8)
+        domain_used[i, :len(line_end)] = True
+    return domain_table, domain_used
+
+
+def make_batch_numpy(rows: int, seed: int, batch: int, domains: list, weights: list, error_rate: float) -> bytes:
+    rng = numpy.random.default_rng([seed, batch])
+    # Each address goes in a row of a table wide enough for the longest one, then the
+    # bits of each row that aren't used get left out
+    names = numpy.frombuffer(random_letters(rng.bytes, rows * MAX_NAME_LENGTH), dtype=numpy.uint8)
+    names = names.reshape(rows, MAX_NAME_LENGTH)
+    lengths = rng.integers(MIN_NAME_LENGTH, MAX_NAME_LENGTH + 1, rows)
+    joiners = numpy.where(rng.random(rows) < error_rate, ord("-"), ord("@")).astype(numpy.uint8)
+    picks = rng.choice(len(domains), rows, p=numpy.array(weights) / sum(weights))
+
+    domain_table, domain_used = make_domain_table(tuple(domains))
 
-emails = []
+    table = numpy.hstack([names, joiners[:, None], domain_table[picks]])
+    used = numpy.hstack([
+        numpy.arange(MAX_NAME_LENGTH) < lengths[:, None],
+        numpy.ones((rows, 1), dtype=bool),
+        domain_used[picks],
+    ])
+    return table[used].tobytes()
 
 
-for i in range(69420):
-    domain = f"{random.choice(domain_first_parts)}.{random.choice(top_level_domains)}"
+def make_batch(rows: int, seed: int, batch: int, domains: list, weights: list, error_rate: float) -> bytes:
+    if numpy is not None:
+        return make_batch_numpy(rows, seed, batch, domains, weights, error_rate)
+    rnd = random.Random(f"{seed}-{batch}")
+    names = random_letters(rnd.randbytes, rows * MAX_NAME_LENGTH)
+    lengths = rnd.choices(range(MIN_NAME_LENGTH, MAX_NAME_LENGTH + 1), k=rows)
+    joiners = [b"-" if rnd.random() < error_rate else b"@" for _ in range(rows)]
+    line_ends = [domain.encode() + b"\n" for domain in domains]
+    picks = rnd.choices(line_ends, cum_weights=list(accumulate(weights)), k=rows)
+    starts = range(0, rows * MAX_NAME_LENGTH, MAX_NAME_LENGTH)
+    return b"".join([
+        names[start:start + length] + joiner + domain
+        for start, length, joiner, domain in zip(starts, lengths, joiners, picks)
+    ])
 
-    name = "".join([chr(random.randint(97, 122))
-                   for _ in range(random.randint(3, 20))])
 
-    joiner = random.choice(email_joiners)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Make a list of random email addresses")
+    parser.add_argument("output", nargs="?", default="emails.txt", help="Where to write them, or - for stdout")
+    parser.add_argument("--count", type=int, default=69420, help="How many addresses")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed, the same one gives the same list")
+    parser.add_argument("--error-rate", type=float, default=0.5, help="Fraction of addresses without an @")
+    parser.add_argument("--domains", type=int, default=len(domain_first_parts) * len(top_level_domains),
+                        help="How many different domains")
+    parser.add_argument("--distribution", choices=["uniform", "zipf"], default="uniform",
+                        help="How addresses are spread over the domains")
+    args = parser.parse_args()
+    if not 0 <= args.error_rate <= 1:
+        parser.error("--error-rate has to be between 0 and 1")
+    if args.domains < 1:
+        parser.error("--domains has to be at least 1")
 
-    email = f"{name}{joiner}{domain}"
+    started = perf_counter()
+    domains = make_domains(args.domains, args.seed)
+    weights = domain_weights(len(domains), args.distribution)
 
-    emails.append(email)
+    with nullcontext(sys.stdout.buffer) if args.output == "-" else open(args.output, "wb") as f:
+        for batch, start in enumerate(range(0, args.count, BATCH_ROWS)):
+            rows = min(BATCH_ROWS, args.count - start)
+            f.write(make_batch(rows, args.seed, batch, domains, weights, args.error_rate))
 
-with open("emails.txt", "w") as f:
-    f.write("\n".join(emails))
+    # stdout might be the output, so this goes to stderr
+    print(f"Wrote {args.count} emails in {perf_counter() - started:.2f}s", file=sys.stderr)
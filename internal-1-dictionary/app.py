@@ -1,16 +1,139 @@
+from contextlib import contextmanager
 from functools import wraps
-from flask import Flask, abort, render_template, redirect, request, session, g, url_for
-from flask_bcrypt import Bcrypt
+from flask import (
+    Flask, abort, render_template, redirect, request, session, g, stream_template, stream_with_context, url_for
+)
+from markupsafe import Markup
 import sqlite3
 from time import time
 import math
+import os
+import sys
 from datetime import datetime
-
-# Set up flask and bcrypt
+# The modules shared with the cafe app (see shared/__init__.py)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from database import get_pool
+from shared import images, instrumentation, static_assets
+from shared.caching import LRUCache, TTLCache, VersionedCache
+from shared.db_config import settings_from_env
+from search import search_words
+from pagination import InvalidCursor, WordsPageStream, get_words_page, words_page_query
+from shared.rows import Row
+import json_api
+from migrate import MIGRATIONS_FOLDER
+from shared.migrate import run_migrations
+from shared.passwords import PasswordHasher, PasswordHasherBusy
+from shared.rate_limit import RateLimiter
+
+# Set up flask
 server = Flask(__name__)
-bcrypt = Bcrypt(server)
 
-server.secret_key = "top-secrete"
+# Used to sign the session cookie, so nobody can change what's in it.
+# Set DICTIONARY_SECRET_KEY in production, since the default is public.
+server.secret_key = os.environ.get("DICTIONARY_SECRET_KEY", "top-secrete")
+
+# Database settings. These can be overridden with environment variables,
+# e.g. `DICTIONARY_DB_POOL_SIZE=10 python app.py`
+server.config["DB_PATH"] = os.environ.get("DICTIONARY_DB_PATH", "dictionary.db")
+# Maximum number of connections each worker process keeps open
+server.config["DB_POOL_SIZE"] = int(os.environ.get("DICTIONARY_DB_POOL_SIZE", 5))
+# How long (seconds) a request waits for a free connection before giving up
+server.config["DB_POOL_TIMEOUT"] = float(os.environ.get("DICTIONARY_DB_POOL_TIMEOUT", 10))
+# Connections are closed and replaced after this many seconds or uses
+server.config["DB_POOL_MAX_AGE"] = float(os.environ.get("DICTIONARY_DB_POOL_MAX_AGE", 3600))
+server.config["DB_POOL_MAX_USES"] = int(os.environ.get("DICTIONARY_DB_POOL_MAX_USES", 10000))
+# SQLite settings (WAL, busy timeout, cache sizes, etc.) - see shared/db_config.py.
+# Override them with DICTIONARY_DB_JOURNAL_MODE, DICTIONARY_DB_BUSY_TIMEOUT, etc.
+server.config["DB_SETTINGS"] = settings_from_env("DICTIONARY_DB_")
+# File used to tell all the worker processes that cached data (like the category list) has changed.
+# Set it to an empty string to only cache within each process.
+server.config["CACHE_VERSION_FILE"] = os.environ.get(
+    "DICTIONARY_CACHE_VERSION_FILE", server.config["DB_PATH"] + ".categories-version"
+)
+# Number of rendered word pages to keep in memory. Set to 0 to turn the cache off.
+server.config["WORD_CACHE_SIZE"] = int(os.environ.get("DICTIONARY_WORD_CACHE_SIZE", 1000))
+# How long (seconds) a logged in user's details can be trusted before checking
+# whether their role has changed. Set to 0 to check on every request.
+server.config["USER_CHECK_TTL"] = float(os.environ.get("DICTIONARY_USER_CHECK_TTL", 30))
+# bcrypt cost factor for password hashes. Each one extra doubles how long logging in takes.
+# Users' hashes are upgraded to the new cost the next time they log in.
+server.config["BCRYPT_ROUNDS"] = int(os.environ.get("DICTIONARY_BCRYPT_ROUNDS", 12))
+# Number of helper processes that hash passwords (0 hashes on the request thread instead),
+# and the most logins/sign ups that can be waiting for one before they're turned away.
+# Keep the limit below the number of threads each worker has, so there are always some left for pages.
+server.config["PASSWORD_WORKERS"] = int(os.environ.get("DICTIONARY_PASSWORD_WORKERS", 2))
+server.config["PASSWORD_QUEUE_LIMIT"] = int(os.environ.get("DICTIONARY_PASSWORD_QUEUE_LIMIT", 8))
+# Limits on how often people can try to log in or sign up. Set DICTIONARY_RATE_LIMITS=0
+# to turn them off, or set one of them to 0 to turn off just that one.
+# A whole class can share one IP address, so the per IP limits are high.
+server.config["RATE_LIMITS"] = os.environ.get("DICTIONARY_RATE_LIMITS", "1") != "0"
+# Log in attempts per minute for each IP address, and for each username
+server.config["LOGIN_IP_LIMIT"] = int(os.environ.get("DICTIONARY_LOGIN_IP_LIMIT", 60))
+server.config["LOGIN_USERNAME_LIMIT"] = int(os.environ.get("DICTIONARY_LOGIN_USERNAME_LIMIT", 5))
+# Sign ups per hour for each IP address
+server.config["SIGN_UP_IP_LIMIT"] = int(os.environ.get("DICTIONARY_SIGN_UP_IP_LIMIT", 40))
+# Maximum number of results a search returns
+server.config["SEARCH_RESULTS_LIMIT"] = int(os.environ.get("DICTIONARY_SEARCH_RESULTS_LIMIT", 50))
+
+# Number of words shown on each page of the word lists, and the most that can be asked
+# for with `?size=`
+server.config["WORDS_PAGE_SIZE"] = int(os.environ.get("DICTIONARY_WORDS_PAGE_SIZE", 100))
+server.config["WORDS_MAX_PAGE_SIZE"] = int(os.environ.get("DICTIONARY_WORDS_MAX_PAGE_SIZE", 500))
+# Send the home and category pages while they're being rendered, reading the words from
+# the database as they go (see render_words_page()). Memory use then doesn't depend on
+# the page size, so WORDS_MAX_PAGE_SIZE can be a lot bigger.
+# Set DICTIONARY_STREAM_WORD_LISTS=0 to render them all at once instead.
+server.config["STREAM_WORD_LISTS"] = os.environ.get("DICTIONARY_STREAM_WORD_LISTS", "1") != "0"
+# Roughly how many bytes of a streamed page to send at once
+server.config["STREAM_CHUNK_SIZE"] = int(os.environ.get("DICTIONARY_STREAM_CHUNK_SIZE", 8192))
+# The same for the JSON API (/api/v1/words). Pages bigger than API_STREAM_THRESHOLD words
+# are streamed instead of built in memory all at once.
+server.config["API_PAGE_SIZE"] = int(os.environ.get("DICTIONARY_API_PAGE_SIZE", 100))
+server.config["API_MAX_PAGE_SIZE"] = int(os.environ.get("DICTIONARY_API_MAX_PAGE_SIZE", 10000))
+server.config["API_STREAM_THRESHOLD"] = int(os.environ.get("DICTIONARY_API_STREAM_THRESHOLD", 1000))
+# Request timings (see shared/instrumentation.py). Every response gets a Server-Timing header
+# (DICTIONARY_SERVER_TIMING=0 turns it off). Prometheus can read the totals if
+# DICTIONARY_METRICS_TOKEN is set (it sends `Authorization: Bearer <token>`), from
+# /metrics or DICTIONARY_METRICS_PATH. Setting only the path makes it public, so do that
+# only if the proxy blocks it. With neither, there's no metrics page.
+server.config["SERVER_TIMING"] = os.environ.get("DICTIONARY_SERVER_TIMING", "1") != "0"
+server.config["METRICS_PATH"] = os.environ.get("DICTIONARY_METRICS_PATH", "")
+server.config["METRICS_TOKEN"] = os.environ.get("DICTIONARY_METRICS_TOKEN", "")
+# SQL statements slower than this many milliseconds are logged with their query plans.
+# 0 turns it off.
+server.config["SLOW_QUERY_MS"] = float(os.environ.get("DICTIONARY_SLOW_QUERY_MS", 0))
+
+# Make sure the database schema is up to date before handling any requests
+run_migrations(server.config["DB_PATH"], MIGRATIONS_FOLDER)
+
+
+# Password hashing happens in separate processes, so a burst of logins doesn't slow
+# down everyone else's pages. See shared/passwords.py.
+password_hasher = PasswordHasher(
+    rounds=server.config["BCRYPT_ROUNDS"],
+    workers=server.config["PASSWORD_WORKERS"],
+    max_queue=server.config["PASSWORD_QUEUE_LIMIT"],
+)
+
+# Token buckets for slowing down password guessing (see shared/rate_limit.py).
+# Each lets the whole limit through at once, then refills over the minute (or hour).
+login_ip_limiter = RateLimiter(server.config["LOGIN_IP_LIMIT"], server.config["LOGIN_IP_LIMIT"] / 60)
+login_username_limiter = RateLimiter(
+    server.config["LOGIN_USERNAME_LIMIT"], server.config["LOGIN_USERNAME_LIMIT"] / 60
+)
+sign_up_ip_limiter = RateLimiter(server.config["SIGN_UP_IP_LIMIT"], server.config["SIGN_UP_IP_LIMIT"] / 3600)
+
+# Time every request. This has to be set up before the before_request function below,
+# so getting the user and categories is counted too.
+request_metrics = instrumentation.init_app(
+    server,
+    namespace="dictionary",
+    metrics_path=server.config["METRICS_PATH"],
+    metrics_token=server.config["METRICS_TOKEN"],
+    server_timing=server.config["SERVER_TIMING"],
+    slow_query_ms=server.config["SLOW_QUERY_MS"],
+)
+request_metrics.add_collector("password_hasher", password_hasher.stats)
 
 
 # Note on variable capitalisation:
@@ -34,37 +157,156 @@ def get_last_inserted_row_id() -> int:
     return id
 
 
-def db_dict_factory(cursor, row):
-    # Used to return database query results as dictionaries.
-    # From the docs: https://docs.python.org/3/library/sqlite3.html#sqlite3.Connection.row_factory
+def rate_limit_wait(*limits) -> float:
+    # Check some (limiter, key) pairs, and return how many seconds to wait
+    # if any of them are over their limit, or 0 if it's all fine
+    if not server.config["RATE_LIMITS"]:
+        return 0
+    return max(limiter.hit(key) for limiter, key in limits)
+
+
+def get_db_pool():
+    # Get the connection pool for this worker process.
+    # The pool is created the first time this is called in each process.
+    return get_pool(
+        database=server.config["DB_PATH"],
+        size=server.config["DB_POOL_SIZE"],
+        timeout=server.config["DB_POOL_TIMEOUT"],
+        max_age=server.config["DB_POOL_MAX_AGE"],
+        max_uses=server.config["DB_POOL_MAX_USES"],
+        row_factory=Row,
+        settings=server.config["DB_SETTINGS"],
+        factory=instrumentation.InstrumentedConnection,
+    )
+
 
-    d = {}
-    for idx, col in enumerate(cursor.description):
-        d[col[0]] = row[idx]
-    return d
+# Show the pool's stats on the metrics page too
+request_metrics.add_collector("db_pool", lambda: get_db_pool().stats())
 
 
 def get_db() -> sqlite3.Connection:
-    # Custom context manager for getting a database connection,
-    # based on the example from the docs https://docs.python.org/3/library/contextlib.html#contextlib.contextmanager
-    # This means that the database connection is closed cleanly when it's no longer needed.
+    # Borrow a database connection from the pool.
+    # It must be given back with `release_db()` when it's no longer needed,
+    # which `teardown_request` does at the end of every request.
+    return get_db_pool().acquire()
+
+
+def release_db(connection: sqlite3.Connection, discard: bool = False):
+    # Give a connection back to the pool so another request can use it
+    get_db_pool().release(connection, discard=discard)
+
+
+def keep_db_until_sent(response):
+    # For responses that read from the database while they're being sent.
+    # Flask runs teardown_request as soon as the view returns, even if the response is
+    # still being streamed, which would give the connection back while it's in use.
+    # Instead it's given back once the response has been sent (or the client goes away).
+    db = g.pop("db")
+    response.call_on_close(lambda: release_db(db))
+    return response
+
+
+@contextmanager
+def without_db():
+    # Give the request's database connection back to the pool while doing something slow
+    # that doesn't need it (like hashing a password), so other requests can use it.
     # Example usage:
     # ```
-    # with get_db() as (connection, cursor):
-    #   cursor.execute("SELECT * FROM Words")
+    # with without_db():
+    #   matches = password_hasher.check(password, password_hash)
     # ```
+    release_db(g.pop("db"))
+    try:
+        yield
+    finally:
+        g.db = get_db()
+        g.cursor = g.db.cursor()
+
 
-    # Code to acquire resource.
-    db_connection = sqlite3.connect("dictionary.db")
-    db_connection.row_factory = db_dict_factory
+def load_categories(cursor: sqlite3.Cursor):
+    # Load all the categories, both as a sorted list (for the nav bar)
+    # and as a dictionary keyed by ID (for looking up one category quickly)
+    cursor.execute("SELECT ID, EnglishName from Categories ORDER BY EnglishName")
+    categories = cursor.fetchall()
+    categories_by_id = {category["ID"]: category for category in categories}
+    return categories, categories_by_id
 
-    return db_connection
 
+# The categories only change when a teacher creates or deletes one,
+# so there's no need to query them on every request.
+# Anything that changes the Categories table must call `categories_cache.invalidate()`.
+categories_cache = VersionedCache(
+    load_categories, version_file=server.config["CACHE_VERSION_FILE"]
+)
 
-def get_first_dict_item(thing: dict):
+
+# Rendered HTML for the details section of word pages.
+# See word_page() for what the keys are.
+word_details_cache = LRUCache(max_size=server.config["WORD_CACHE_SIZE"])
+
+# Each user's RoleVersion, so get_user() doesn't need the database on most requests.
+# A user that's been deleted is cached as None.
+user_versions_cache = TTLCache(ttl=server.config["USER_CHECK_TTL"])
+
+# Smaller copies of the word images, and image_sources() for the ResponsiveImage macro
+# (see shared/images.py)
+word_images = images.init_app(server)
+
+# Link to (and serve) the hashed, precompressed static files from shared/static_assets.py,
+# if they've been built
+static_assets.init_app(server)
+
+
+def get_first_dict_item(thing: Row):
     # A helper function for getting out some
     # values returned in a weird way by SQLite
-    return list(thing.values())[0]
+    return thing[0]
+
+
+def stream_page(template: str, **context):
+    # Like render_template(), but the page is sent in pieces while it's being rendered,
+    # so the top of the page gets to the browser straight away and the whole page is
+    # never in memory at once. Jinja makes lots of tiny pieces, so they're joined into
+    # chunks of about STREAM_CHUNK_SIZE bytes.
+    # The request (and its database connection) lasts until the page has been sent.
+    pieces = stream_template(template, **context)
+
+    def chunks():
+        buffer = []
+        size = 0
+        for piece in pieces:
+            buffer.append(piece)
+            size += len(piece)
+            if size >= server.config["STREAM_CHUNK_SIZE"]:
+                yield "".join(buffer)
+                buffer = []
+                size = 0
+        if buffer:
+            yield "".join(buffer)
+
+    return keep_db_until_sent(server.response_class(chunks(), mimetype="text/html"))
+
+
+def render_words_page(template: str, category_id: int = None, **context):
+    # Render a page with a list of words on it (the home page or a category page),
+    # with the page of words asked for by the `after`, `before` and `size` URL parameters.
+    # The template gets `words` and `page` (for the Pagination component).
+    # 404s if the page cursor is invalid.
+    page_size = request.args.get("size", server.config["WORDS_PAGE_SIZE"], type=int)
+    page_size = max(1, min(page_size, server.config["WORDS_MAX_PAGE_SIZE"]))
+    after = request.args.get("after")
+    before = request.args.get("before")
+
+    try:
+        if server.config["STREAM_WORD_LISTS"] and before is None:
+            # Words are read from the database as they're rendered (see WordsPageStream)
+            page = WordsPageStream(g.db.cursor(), page_size, after=after, category_id=category_id)
+            return stream_page(template, words=page, page=page, **context)
+
+        page = get_words_page(g.cursor, page_size, after=after, before=before, category_id=category_id)
+    except InvalidCursor:
+        abort(404)
+    return render_template(template, words=page["words"], page=page, **context)
 
 
 def teacher_only(func):
@@ -82,23 +324,62 @@ def teacher_only(func):
     return wrapper
 
 
+def user_snapshot(user: dict) -> dict:
+    # The copy of a user's details that gets saved in their session.
+    # The session cookie is signed with the secret key, so it can't be edited.
+    return {
+        "id": user["ID"],
+        "username": user["Username"],
+        "teacher": user["Teacher"],
+        "version": user["RoleVersion"],
+    }
+
+
+def get_user_version(id: int):
+    # Get a user's current RoleVersion (or None if they've been deleted),
+    # only asking the database every USER_CHECK_TTL seconds
+    version = user_versions_cache.get(id, "missing")
+    if version == "missing":
+        g.cursor.execute("SELECT RoleVersion FROM Users WHERE ID = ?", [id])
+        result = g.cursor.fetchone()
+        version = None if result is None else result["RoleVersion"]
+        user_versions_cache.set(id, version)
+    return version
+
+
 def get_user():
     # Return the current user session,
     # or return False if there is none.
+    # The user's details come from their session, so this doesn't need the database
+    # unless their role has changed (or it's time to check, see get_user_version()).
+    snapshot = session.get("user")
+    if snapshot is None:
+        if "id" not in session:
+            return False
+        # A session from before the details were saved in it
+        snapshot = {"id": session["id"], "version": None}
 
-    # Avoid having to deal with an index error
-    if "id" in session:
-        id = session["id"]
+    version = get_user_version(snapshot["id"])
+    if version is None:
+        # The user doesn't exist any more
+        session.clear()
+        return False
 
-        g.cursor.execute("SELECT Username, Teacher FROM Users WHERE ID = ?", [id])
+    if version != snapshot["version"]:
+        # Something changed, so get their details again and save them in the session
+        g.cursor.execute(
+            "SELECT ID, Username, Teacher, RoleVersion FROM Users WHERE ID = ?", [snapshot["id"]]
+        )
         result = g.cursor.fetchone()
-
         if result is None:
+            session.clear()
             return False
+        snapshot = user_snapshot(result)
+        session.pop("id", None)
+        session["user"] = snapshot
+        user_versions_cache.set(snapshot["id"], snapshot["version"])
 
-        return {"id": id, "username": result["Username"], "teacher": result["Teacher"]}
-
-    return False
+    return {"id": snapshot["id"], "username": snapshot["username"], "teacher": snapshot["teacher"]}
 
 
 @server.before_request
@@ -116,11 +397,9 @@ def before_request():
 
     g.user = get_user()
 
-    # Also add the list of categories to the global object
-    categories_query = "SELECT ID, EnglishName from Categories ORDER BY EnglishName"
-    g.cursor.execute(categories_query)
-    categories = g.cursor.fetchall()
-    g.categories = categories
+    # Also add the list of categories to the global object.
+    # This comes from the cache, so the database is only queried when they've changed.
+    g.categories, g.categories_by_id = categories_cache.get(g.cursor)
 
 
 @server.teardown_request
@@ -128,8 +407,11 @@ def teardown_request(error):
     # This function is always run after a request happens.
     # Docs: https://flask.palletsprojects.com/en/2.2.x/api/#flask.Flask.teardown_request
 
-    # Close the database connection
-    g.db.close()
+    # Give the database connection back to the pool.
+    # If before_request failed before getting one, there's nothing to give back.
+    db = g.pop("db", None)
+    if db is not None:
+        release_db(db)
 
 
 @server.context_processor
@@ -151,79 +433,216 @@ def internal_error(error):
     return render_template("error.jinja", error_code="500", error=error), 500
 
 
+@server.route("/stats/db-pool", methods=["GET"])
+@teacher_only
+def db_pool_stats():
+    # Connection pool usage and wait-time metrics for this worker process
+    return get_db_pool().stats()
+
+
 @server.route("/", methods=["GET"])
 def home_page():
-    # The main homepage, which shows all the words
+    # The main homepage, which shows all the words, one page at a time
 
-    # Get all the words
-    g.cursor.execute("SELECT * FROM Words ORDER BY MaoriSpelling")
-    words = g.cursor.fetchall()
+    # Get this page of words and render the page
+    return render_words_page("pages/home.jinja")
 
-    # Render the page
-    return render_template("pages/home.jinja", words=words)
+
+@server.route("/search", methods=["GET"])
+def search_page():
+    # Page for searching words in English or Māori
+    query = request.args.get("q", "").strip()
+    words = search_words(g.cursor, query, limit=server.config["SEARCH_RESULTS_LIMIT"])
+
+    return render_template("pages/search.jinja", query=query, words=words)
+
+
+# The JSON API. See json_api.py for how field selection, ETags and streaming work.
+# Every route checks the ETag before reading anything other than TableVersions,
+# so clients that already have the latest version get a quick 304.
+
+
+def api_cursor() -> sqlite3.Cursor:
+    # A cursor that returns plain tuples, which the API turns into JSON directly
+    cursor = g.db.cursor()
+    cursor.row_factory = None
+    return cursor
+
+
+@server.route("/api/v1/words", methods=["GET"])
+def words_api():
+    # All the words, ordered by Māori spelling, a page at a time.
+    # URL parameters (all optional):
+    # fields: e.g. `ID,MaoriSpelling`
+    # size: number of words per page
+    # after: the `next` cursor from the last page
+    # category: only get words in this category
+    try:
+        fields = json_api.parse_fields(request.args.get("fields"), json_api.WORD_FIELDS)
+    except json_api.InvalidFields as e:
+        return json_api.error_response(str(e))
+
+    etag = json_api.make_etag(json_api.table_versions(g.cursor, "Words"))
+    not_modified = json_api.not_modified(etag)
+    if not_modified:
+        return not_modified
+
+    page_size = request.args.get("size", server.config["API_PAGE_SIZE"], type=int)
+    page_size = max(1, min(page_size, server.config["API_MAX_PAGE_SIZE"]))
+    try:
+        query = words_page_query(
+            page_size,
+            after=request.args.get("after"),
+            category_id=request.args.get("category", type=int),
+            # MaoriSpelling and ID are always needed for the next page's cursor
+            columns=", ".join(fields + ("MaoriSpelling", "ID")),
+        )
+    except InvalidCursor:
+        return json_api.error_response("Invalid page cursor")
+
+    cursor = api_cursor()
+    cursor.execute(*query)
+    body = json_api.words_page_json(cursor, fields, page_size)
+    if page_size > server.config["API_STREAM_THRESHOLD"]:
+        return keep_db_until_sent(json_api.json_response(stream_with_context(body), etag))
+    return json_api.json_response(b"".join(body), etag)
+
+
+@server.route("/api/v1/words/<int:id>", methods=["GET"])
+def word_api(id):
+    # One word. Can use `?fields=` too.
+    try:
+        fields = json_api.parse_fields(request.args.get("fields"), json_api.WORD_FIELDS)
+    except json_api.InvalidFields as e:
+        return json_api.error_response(str(e))
+
+    etag = json_api.make_etag(json_api.table_versions(g.cursor, "Words"))
+    not_modified = json_api.not_modified(etag)
+    if not_modified:
+        return not_modified
+
+    cursor = api_cursor()
+    cursor.execute(f"SELECT {', '.join(fields)} FROM Words WHERE ID=?", [id])
+    rows = cursor.fetchall()
+    if len(rows) == 0:
+        return json_api.error_response("Word not found", 404)
+    return json_api.json_response(json_api.dumps(json_api.rows_to_dicts(rows, fields)[0]), etag)
+
+
+@server.route("/api/v1/categories", methods=["GET"])
+def categories_api():
+    # All the categories, ordered by name. Can use `?fields=` too.
+    try:
+        fields = json_api.parse_fields(request.args.get("fields"), json_api.CATEGORY_FIELDS)
+    except json_api.InvalidFields as e:
+        return json_api.error_response(str(e))
+
+    etag = json_api.make_etag(json_api.table_versions(g.cursor, "Categories"))
+    not_modified = json_api.not_modified(etag)
+    if not_modified:
+        return not_modified
+
+    # Read from the database rather than categories_cache, so it always matches the ETag
+    cursor = api_cursor()
+    cursor.execute(f"SELECT {', '.join(fields)} FROM Categories ORDER BY EnglishName, ID")
+    items = json_api.rows_to_dicts(cursor.fetchall(), fields)
+    return json_api.json_response(json_api.dumps({"items": items}), etag)
+
+
+@server.route("/api/v1/search", methods=["GET"])
+def search_api():
+    # The same as the search page, but returns JSON.
+    # q: what to search for
+    # fields: e.g. `ID,MaoriSpelling`
+    # limit: most results to get
+    query = request.args.get("q", "").strip()
+    try:
+        fields = json_api.parse_fields(request.args.get("fields"), json_api.SEARCH_FIELDS)
+    except json_api.InvalidFields as e:
+        return json_api.error_response(str(e))
+
+    etag = json_api.make_etag(json_api.table_versions(g.cursor, "Words"))
+    not_modified = json_api.not_modified(etag)
+    if not_modified:
+        return not_modified
+
+    limit = request.args.get("limit", server.config["SEARCH_RESULTS_LIMIT"], type=int)
+    limit = max(1, min(limit, server.config["SEARCH_RESULTS_LIMIT"]))
+    words = search_words(g.cursor, query, limit=limit)
+    results = [{field: word[field] for field in fields} for word in words]
+    return json_api.json_response(json_api.dumps({"query": query, "results": results}), etag)
 
 
 @server.route("/categories/<id>", methods=["GET"])
 def category_page(id):
     # Page for just showing words in one category
 
-    # No need to re-query the database, when we already have a list of all the categories
-    category = None
-    for _category in g.categories:
-        if str(_category["ID"]) == id:
-            category = _category
+    # No need to re-query the database, when we already have all the categories
+    try:
+        category = g.categories_by_id.get(int(id))
+    except ValueError:
+        category = None
 
     # If a category couldn't be found, 404 error
     if category == None:
         abort(404)
 
-    # Get the words in that category
-    g.cursor.execute(
-        "SELECT * FROM Words WHERE CategoryID = ? ORDER BY MaoriSpelling",
-        [category["ID"]],
-    )
-    category_words = g.cursor.fetchall()
-
-    # Render the page
-    return render_template(
-        "pages/specific_category.jinja", category=category, words=category_words
-    )
+    # Get this page of words in that category and render the page
+    return render_words_page("pages/specific_category.jinja", category_id=category["ID"], category=category)
 
 
 @server.route("/words/<id>", methods=["GET"])
 def word_page(id):
-    # Page for just showing words in one category
+    # Page for showing one word
 
-    # Select the word from the database using the ID
-    word_query = "SELECT * FROM Words WHERE ID = ?"
-    g.cursor.execute(word_query, [id])
+    # Get the word, along with its category and the username of whoever created it,
+    # all in one go.
+    # LEFT JOINs are used so the word still shows up if the user or category is gone.
+    g.cursor.execute(
+        """SELECT Words.*,
+                Categories.EnglishName AS CategoryEnglishName,
+                Users.Username AS CreatedByUsername
+            FROM Words
+            LEFT JOIN Categories ON Categories.ID = Words.CategoryID
+            LEFT JOIN Users ON Users.ID = Words.CreatedBy
+            WHERE Words.ID = ?""",
+        [id],
+    )
     word = g.cursor.fetchone()
 
     # If no word with that ID is found, 404 error
     if word == None:
         abort(404)
 
-    # Get the category for that word
-    g.cursor.execute("SELECT * FROM Categories WHERE ID = ?", [word["CategoryID"]])
-    category = g.cursor.fetchone()
-
-    # Get the creation date
-    CreatedAt = datetime.fromtimestamp(word["CreatedAt"] / 1000)
+    is_teacher = bool(g.user and g.user["teacher"])
 
-    # Get the user that created the word
-    g.cursor.execute(
-        "SELECT Username FROM Users WHERE ID = ?", (str(word["CreatedBy"]))
-    )
-    CreatedBy = g.cursor.fetchone()["Username"]
-
-    # Render the pages
-    return render_template(
-        "pages/specific_word.jinja",
-        category=category,
-        word=word,
-        created_at=CreatedAt,
-        created_by=CreatedBy,
+    # The details section only changes when the word is edited, so it's cached.
+    # LastModifiedAt is part of the key, so an edited word never gets an old copy.
+    # The category name and the creator's username come from other tables, so they're
+    # in the key too (renaming either one gives a new copy).
+    # Teachers see extra things, so they get their own copy.
+    cache_key = (
+        word["ID"], word["LastModifiedAt"], word["CategoryEnglishName"], word["CreatedByUsername"], is_teacher
     )
+    details = word_details_cache.get(cache_key)
+
+    if details is None:
+        # Get the creation date
+        CreatedAt = datetime.fromtimestamp(word["CreatedAt"] / 1000)
+
+        details = Markup(
+            render_template(
+                "fragments/word_details.jinja",
+                category={"ID": word["CategoryID"], "EnglishName": word["CategoryEnglishName"]},
+                word=word,
+                created_at=CreatedAt,
+                created_by=word["CreatedByUsername"],
+            )
+        )
+        word_details_cache.set(cache_key, details)
+
+    # Render the page
+    return render_template("pages/specific_word.jinja", word=word, details=details)
 
 
 @server.route("/login", methods=["POST"])
@@ -236,10 +655,19 @@ def handle_log_in():
     username = request.form["log-in-username"]
     password = request.form["log-in-password"]
 
+    # Slow down anyone guessing passwords, either from one place or for one user
+    wait = rate_limit_wait(
+        (login_ip_limiter, request.remote_addr), (login_username_limiter, username.lower())
+    )
+    if wait:
+        return redirect(
+            url_for("home_page", m=f"Too many log in attempts. Try again in {math.ceil(wait)} seconds")
+        )
+
     try:
         # Get the user data that matches this username
         g.cursor.execute(
-            "SELECT Username, Teacher, PasswordHash, ID FROM Users WHERE Username=?",
+            "SELECT Username, Teacher, PasswordHash, ID, RoleVersion FROM Users WHERE Username=?",
             [username],
         )
         res = g.cursor.fetchall()
@@ -251,13 +679,29 @@ def handle_log_in():
         user = res[0]
 
         # Check password
-        matches = bcrypt.check_password_hash(user["PasswordHash"], password)
+        with without_db(), instrumentation.timed("bcrypt"):
+            matches = password_hasher.check(password, user["PasswordHash"])
         if not matches:
             return redirect(url_for("home_page", m="Username or password is wrong"))
 
+        # Upgrade the hash if the cost factor has changed since it was made.
+        # This is the only time the password is known, so it can't be done any other way.
+        if password_hasher.needs_rehash(user["PasswordHash"]):
+            try:
+                with without_db(), instrumentation.timed("bcrypt"):
+                    new_hash = password_hasher.hash(password)
+                g.cursor.execute("UPDATE Users SET PasswordHash=? WHERE ID=?", [new_hash, user["ID"]])
+                g.db.commit()
+            except PasswordHasherBusy:
+                # Try again next time
+                pass
+
         # Log the user in
-        session["id"] = user["ID"]
+        session["user"] = user_snapshot(user)
+        user_versions_cache.set(user["ID"], user["RoleVersion"])
         return redirect(url_for("home_page"))
+    except PasswordHasherBusy as e:
+        return redirect(url_for("home_page", m=str(e)))
     except Exception as e:
         return redirect(url_for("home_page", m=f"Error logging in {str(e)}"))
 
@@ -288,8 +732,11 @@ def handle_sign_up():
     if not username or not password:
         return False
 
-    # Encrypt password
-    encrypted_password = bcrypt.generate_password_hash(password)
+    wait = rate_limit_wait((sign_up_ip_limiter, request.remote_addr))
+    if wait:
+        return redirect(
+            url_for("home_page", m=f"Too many new accounts. Try again in {math.ceil(wait)} seconds")
+        )
 
     try:
         # Check that the username hasn't been used already
@@ -299,18 +746,27 @@ def handle_sign_up():
         if len(res) > 0:
             return redirect(url_for("home_page", m="Username already taken"))
 
+        # Encrypt password
+        with without_db(), instrumentation.timed("bcrypt"):
+            encrypted_password = password_hasher.hash(password)
+
         # Create the user
         g.cursor.execute(
             "INSERT INTO Users (Teacher, Username, PasswordHash) VALUES (?,?,?)",
-            [1 if is_teacher else 0, username, encrypted_password.decode("utf8")],
+            [1 if is_teacher else 0, username, encrypted_password],
         )
         g.db.commit()
 
-        # Get the user ID
+        # Log the user in
         id = get_last_inserted_row_id()
-        session["id"] = id
+        session["user"] = user_snapshot(
+            {"ID": id, "Username": username, "Teacher": 1 if is_teacher else 0, "RoleVersion": 0}
+        )
+        user_versions_cache.set(id, 0)
 
         return redirect(url_for("home_page", m="Successfully registered"))
+    except PasswordHasherBusy as e:
+        return redirect(url_for("home_page", m=str(e)))
     except Exception as e:
         return redirect(url_for("home_page", m=f"Error creating account {str(e)}"))
 
@@ -320,8 +776,9 @@ def handle_log_out():
     if g.user == False:
         return redirect(url_for("home_page", m="Not logged in"))
 
-    # Log user out by popping id from session
-    session.pop("id")
+    # Log user out by removing their details from the session
+    session.pop("user", None)
+    session.pop("id", None)
 
     return redirect(url_for("home_page", m="Logged out"))
 
@@ -419,6 +876,10 @@ def create_word_action():
         )
         g.db.commit()
 
+        # Make smaller copies of the image if it's a new one. Cached word pages
+        # have the old image in them, so they get cleared once it's done.
+        word_images.build_in_background(ImageFilename, on_done=word_details_cache.clear)
+
         # Redirect to the page for the created word
         id = get_last_inserted_row_id()
         return redirect(url_for("word_page", id=id))
@@ -446,6 +907,8 @@ def delete_category_action(id):
         # Delete the category
         g.cursor.execute("DELETE FROM Categories WHERE ID=?", [id])
         g.db.commit()
+        # Make every worker reload the list of categories
+        categories_cache.invalidate()
 
         # Redirect to the home page
         return redirect(url_for("home_page", m="Deleted category"))
@@ -475,6 +938,9 @@ def create_category_action():
         )
         g.db.commit()
 
+        # Make every worker reload the list of categories
+        categories_cache.invalidate()
+
         # Redirect to the newly created category page
         id = get_last_inserted_row_id()
         return redirect(url_for("category_page", id=id))
@@ -0,0 +1,101 @@
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+from time import perf_counter
+
+# Let this script import things from the main app folder, and the shared one
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from migrate import MIGRATIONS_FOLDER
+from shared.migrate import run_migrations
+from query_plans import fill_database
+from shared.rows import Row
+
+# Compares the old way of getting rows as dictionaries (db_dict_factory) with
+# rows.Row, on a database with lots of words. It times just the query
+# (`SELECT * FROM Words`) and the whole home page with every word on one page,
+# rendered through Flask's test client.
+#
+# Usage (from the internal-1-dictionary folder):
+# ```
+# python benchmarks/home_page.py --words 20000
+# ```
+
+
+def db_dict_factory(cursor, row):
+    # The row factory the app used before rows.py
+    d = {}
+    for idx, col in enumerate(cursor.description):
+        d[col[0]] = row[idx]
+    return d
+
+
+FACTORIES = {"dicts (old)": db_dict_factory, "rows.Row": Row}
+
+
+def time_it(function, repeats: int) -> float:
+    # Median time in milliseconds
+    times = []
+    for _ in range(repeats):
+        started = perf_counter()
+        function()
+        times.append(perf_counter() - started)
+    return statistics.median(times) * 1000
+
+
+def use_row_factory(pool, factory):
+    # Switch the app's connection pool (and its open connections) to a different row factory
+    pool.row_factory = factory
+    for pooled in pool._idle:
+        pooled.connection.row_factory = factory
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time the home page with different row factories")
+    parser.add_argument("--words", type=int, default=20000, help="Number of words to add")
+    parser.add_argument("--repeats", type=int, default=10, help="Times to run each test")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+
+    with tempfile.TemporaryDirectory() as folder:
+        database = os.path.join(folder, "dictionary.db")
+        print(f"Making a database with {args.words} words...")
+        run_migrations(database, MIGRATIONS_FOLDER)
+        fill_database(database, args.words, users=100, categories=20)
+
+        # Show every word on the home page
+        os.environ["DICTIONARY_DB_PATH"] = database
+        os.environ["DICTIONARY_CACHE_VERSION_FILE"] = database + ".categories-version"
+        os.environ["DICTIONARY_WORDS_PAGE_SIZE"] = str(args.words)
+        os.environ["DICTIONARY_WORDS_MAX_PAGE_SIZE"] = str(args.words)
+        import app
+
+        client = app.server.test_client()
+
+        def query():
+            connection = app.get_db()
+            try:
+                connection.execute("SELECT * FROM Words ORDER BY MaoriSpelling, ID").fetchall()
+            finally:
+                app.release_db(connection)
+
+        def home_page():
+            response = client.get("/")
+            assert response.status_code == 200
+
+        # Warm up (opens connections, compiles templates, fills the page cache)
+        home_page()
+
+        print(f"{'row factory':<12} {'query':>10} {'home page':>11}")
+        for name, factory in FACTORIES.items():
+            use_row_factory(app.get_db_pool(), factory)
+            query_ms = time_it(query, args.repeats)
+            page_ms = time_it(home_page, args.repeats)
+            print(f"{name:<12} {query_ms:>8.1f}ms {page_ms:>9.1f}ms")
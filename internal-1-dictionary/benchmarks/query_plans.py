@@ -0,0 +1,139 @@
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import string
+import sys
+import tempfile
+from time import perf_counter
+
+# Let this script import things from the main app folder
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from migrate import MIGRATIONS_FOLDER
+from shared.migrate import run_migrations
+
+
+# Shows how the migrations change the query plans (and speed) of the queries the app runs.
+# It makes two databases with the same random data: one with the schema from before
+# the migrations (version 1), and one with all the migrations run.
+#
+# Usage (from the internal-1-dictionary folder):
+# ```
+# python benchmarks/query_plans.py --words 100000
+# ```
+
+QUERIES = {
+    "Category list": (
+        "SELECT ID, EnglishName from Categories ORDER BY EnglishName",
+        [],
+    ),
+    "Log in (user by username)": (
+        "SELECT Username, Teacher, PasswordHash, ID FROM Users WHERE Username=?",
+        ["user500"],
+    ),
+    "Home page (first page)": (
+        "SELECT * FROM Words ORDER BY MaoriSpelling, ID LIMIT 101",
+        [],
+    ),
+    "Home page (deep page)": (
+        "SELECT * FROM Words WHERE (MaoriSpelling, ID) > (?, ?) ORDER BY MaoriSpelling, ID LIMIT 101",
+        ["t", 0],
+    ),
+    "Category page": (
+        "SELECT * FROM Words WHERE CategoryID = ? ORDER BY MaoriSpelling, ID LIMIT 101",
+        [7],
+    ),
+    "Delete category check": (
+        "SELECT ID from Words WHERE CategoryID=?",
+        [7],
+    ),
+}
+
+
+def random_word(length: int) -> str:
+    return "".join(random.choices(string.ascii_lowercase, k=length))
+
+
+def fill_database(database: str, words: int, users: int, categories: int):
+    # Add random users, categories and words
+    connection = sqlite3.connect(database)
+    connection.executemany(
+        "INSERT INTO Users (Username, Teacher, PasswordHash) VALUES (?, ?, ?)",
+        ((f"user{i}", i % 10 == 0, "not a real hash") for i in range(users)),
+    )
+    connection.executemany(
+        "INSERT INTO Categories (EnglishName) VALUES (?)",
+        ((random_word(8),) for _ in range(categories)),
+    )
+    connection.executemany(
+        """INSERT INTO Words (MaoriSpelling, EnglishSpelling, EnglishDefinition,
+            YearLevelFirstEncountered, CreatedBy, CreatedAt, CategoryID)
+            VALUES (?, ?, ?, ?, ?, ?, ?)""",
+        (
+            (
+                random_word(random.randint(3, 12)),
+                random_word(random.randint(3, 12)),
+                random_word(40),
+                random.randint(0, 13),
+                random.randint(1, users),
+                0,
+                random.randint(1, categories),
+            )
+            for _ in range(words)
+        ),
+    )
+    connection.commit()
+    connection.close()
+
+
+def time_query(connection: sqlite3.Connection, sql: str, params: list, repeats: int) -> float:
+    # Average time to run a query and fetch all the results, in milliseconds
+    started = perf_counter()
+    for _ in range(repeats):
+        connection.execute(sql, params).fetchall()
+    return (perf_counter() - started) / repeats * 1000
+
+
+def describe(database: str, repeats: int):
+    connection = sqlite3.connect(database)
+    results = {}
+    for name, (sql, params) in QUERIES.items():
+        plan = connection.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()
+        results[name] = ([row[3] for row in plan], time_query(connection, sql, params, repeats))
+    connection.close()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare query plans before & after the migrations")
+    parser.add_argument("--words", type=int, default=100000, help="Number of words to add")
+    parser.add_argument("--users", type=int, default=1000, help="Number of users to add")
+    parser.add_argument("--categories", type=int, default=20, help="Number of categories")
+    parser.add_argument("--repeats", type=int, default=20, help="Times to run each query")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+
+    with tempfile.TemporaryDirectory() as folder:
+        before = os.path.join(folder, "before.db")
+        after = os.path.join(folder, "after.db")
+
+        print(f"Making databases with {args.words} words...")
+        run_migrations(before, MIGRATIONS_FOLDER, target=1)
+        fill_database(before, args.words, args.users, args.categories)
+        shutil.copy(before, after)
+        run_migrations(after, MIGRATIONS_FOLDER)
+
+        before_results = describe(before, args.repeats)
+        after_results = describe(after, args.repeats)
+
+    for name in QUERIES:
+        before_plan, before_ms = before_results[name]
+        after_plan, after_ms = after_results[name]
+        print()
+        print(f"{name}:")
+        print(f"  Before ({before_ms:.3f}ms): {'; '.join(before_plan)}")
+        print(f"  After  ({after_ms:.3f}ms): {'; '.join(after_plan)}")
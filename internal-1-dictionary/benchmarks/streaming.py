@@ -0,0 +1,77 @@
+import argparse
+import os
+import random
+import sys
+import tempfile
+import tracemalloc
+from time import perf_counter
+
+# Let this script import things from the main app folder
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from migrate import MIGRATIONS_FOLDER
+from shared.migrate import run_migrations
+from query_plans import fill_database
+
+# Compares rendering the home page all at once with streaming it (STREAM_WORD_LISTS),
+# for different page sizes. For each one it shows the time until the first bytes are
+# ready, the total time, and the most memory Python used while making the page.
+# The pages are read a chunk at a time (like a server sending them), through Flask's
+# test client.
+#
+# Usage (from the internal-1-dictionary folder):
+# ```
+# python benchmarks/streaming.py --words 20000 --sizes 100 1000 10000
+# ```
+
+
+def measure(client, url: str) -> dict:
+    tracemalloc.start()
+    started = perf_counter()
+    response = client.get(url, buffered=False)
+    first_byte = None
+    size = 0
+    for chunk in response.response:
+        if first_byte is None:
+            first_byte = perf_counter() - started
+        size += len(chunk)
+    response.close()
+    total = perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"first_byte": first_byte * 1000, "total": total * 1000, "peak": peak / 1024 / 1024, "size": size}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare streamed and normal rendering of the home page")
+    parser.add_argument("--words", type=int, default=20000, help="Number of words to add")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000], help="Page sizes")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+
+    with tempfile.TemporaryDirectory() as folder:
+        database = os.path.join(folder, "dictionary.db")
+        print(f"Making a database with {args.words} words...")
+        run_migrations(database, MIGRATIONS_FOLDER)
+        fill_database(database, args.words, users=100, categories=20)
+
+        os.environ["DICTIONARY_DB_PATH"] = database
+        os.environ["DICTIONARY_CACHE_VERSION_FILE"] = database + ".categories-version"
+        os.environ["DICTIONARY_WORDS_MAX_PAGE_SIZE"] = str(max(args.sizes))
+        import app
+
+        client = app.server.test_client()
+        # Warm up (opens connections, compiles templates)
+        client.get("/")
+
+        print(f"{'mode':<9} {'words':>6} {'first byte':>11} {'total':>9} {'peak memory':>12} {'page size':>10}")
+        for size in args.sizes:
+            for streaming in [False, True]:
+                app.server.config["STREAM_WORD_LISTS"] = streaming
+                result = measure(client, f"/?size={size}")
+                print(
+                    f"{'stream' if streaming else 'normal':<9} {size:>6} {result['first_byte']:>9.1f}ms"
+                    f" {result['total']:>7.1f}ms {result['peak']:>10.1f}MB {result['size'] / 1024:>8.0f}KB"
+                )
@@ -0,0 +1,246 @@
+import os
+import sqlite3
+import threading
+from collections import deque
+from time import monotonic
+
+from shared.db_config import configure_connection
+
+
+# A small, thread-safe pool of SQLite connections.
+# Opening a connection for every request means SQLite has to re-read the schema
+# and starts with a cold page cache each time, which is most of the cost of
+# cheap pages like /words/<id>. Instead we keep a few connections open
+# and hand them out to requests.
+#
+# Each worker process gets its own pool (SQLite connections can't be shared across
+# a fork), which is handled by `get_pool()` below.
+#
+# Example usage:
+# ```
+# pool = ConnectionPool("dictionary.db", size=5)
+# connection = pool.acquire()
+# try:
+#   connection.execute("SELECT * FROM Words")
+# finally:
+#   pool.release(connection)
+# ```
+
+
+class PoolTimeout(Exception):
+    # Raised when no connection becomes free before the timeout runs out
+    pass
+
+
+class _PooledConnection:
+    # Book-keeping for one connection in the pool
+
+    def __init__(self, connection: sqlite3.Connection):
+        self.connection = connection
+        self.created_at = monotonic()
+        self.last_used_at = self.created_at
+        self.uses = 0
+
+
+class ConnectionPool:
+    def __init__(
+        self,
+        database: str,
+        size: int = 5,
+        timeout: float = 10.0,
+        max_age: float = 3600.0,
+        max_uses: int = 10000,
+        health_check_after: float = 30.0,
+        row_factory=None,
+        settings: dict = None,
+        factory=sqlite3.Connection,
+    ):
+        # database: path to the SQLite file
+        # size: maximum number of connections open at once
+        # timeout: how long (seconds) acquire() waits for a free connection
+        # max_age: connections older than this (seconds) get replaced
+        # max_uses: connections used more times than this get replaced
+        # health_check_after: connections idle for longer than this (seconds)
+        #   get a quick `SELECT 1` before they're handed out
+        # settings: SQLite settings for new connections (see shared/db_config.py)
+        # factory: the connection class, e.g. instrumentation.InstrumentedConnection
+        if size < 1:
+            raise ValueError("Pool size must be at least 1")
+
+        self.database = database
+        self.size = size
+        self.timeout = timeout
+        self.max_age = max_age
+        self.max_uses = max_uses
+        self.health_check_after = health_check_after
+        self.row_factory = row_factory
+        self.settings = settings
+        self.factory = factory
+
+        # Idle connections, most recently used at the end so the
+        # hottest connection (with the warmest page cache) gets reused first
+        self._idle = deque()
+        # Connections that have been handed out, keyed by the sqlite3 connection object
+        self._in_use = {}
+        self._lock = threading.Condition(threading.Lock())
+        self._closed = False
+
+        # Metrics
+        self._stats = {
+            "acquired": 0,
+            "released": 0,
+            "created": 0,
+            "recycled": 0,
+            "failed_health_checks": 0,
+            "timeouts": 0,
+            "total_wait_seconds": 0.0,
+            "max_wait_seconds": 0.0,
+        }
+
+    def _connect(self) -> _PooledConnection:
+        # check_same_thread=False is fine here because the pool makes sure
+        # only one thread uses a connection at a time
+        connection = sqlite3.connect(self.database, check_same_thread=False, factory=self.factory)
+        configure_connection(connection, self.settings)
+        if self.row_factory is not None:
+            connection.row_factory = self.row_factory
+        self._stats["created"] += 1
+        return _PooledConnection(connection)
+
+    def _is_stale(self, pooled: _PooledConnection) -> bool:
+        # Whether a connection should be closed and replaced instead of reused
+        now = monotonic()
+        return (now - pooled.created_at) > self.max_age or pooled.uses >= self.max_uses
+
+    def _is_healthy(self, pooled: _PooledConnection) -> bool:
+        # Only bother checking connections that have been sitting around for a while
+        if (monotonic() - pooled.last_used_at) < self.health_check_after:
+            return True
+        try:
+            pooled.connection.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def acquire(self) -> sqlite3.Connection:
+        # Get a connection from the pool, waiting for one to be released if they're all busy
+        started_waiting = monotonic()
+        deadline = started_waiting + self.timeout
+
+        with self._lock:
+            while True:
+                if self._closed:
+                    raise PoolTimeout("The connection pool has been closed")
+
+                pooled = None
+                if self._idle:
+                    pooled = self._idle.pop()
+                    if self._is_stale(pooled):
+                        self._stats["recycled"] += 1
+                        _close_quietly(pooled.connection)
+                        pooled = None
+                    elif not self._is_healthy(pooled):
+                        self._stats["failed_health_checks"] += 1
+                        _close_quietly(pooled.connection)
+                        pooled = None
+
+                if pooled is None and len(self._idle) + len(self._in_use) < self.size:
+                    pooled = self._connect()
+
+                if pooled is not None:
+                    break
+
+                # Everything is busy, so wait for a release
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    self._stats["timeouts"] += 1
+                    raise PoolTimeout(
+                        f"Couldn't get a database connection within {self.timeout} seconds"
+                    )
+                self._lock.wait(remaining)
+
+            pooled.uses += 1
+            self._in_use[pooled.connection] = pooled
+
+            waited = monotonic() - started_waiting
+            self._stats["acquired"] += 1
+            self._stats["total_wait_seconds"] += waited
+            self._stats["max_wait_seconds"] = max(self._stats["max_wait_seconds"], waited)
+
+            return pooled.connection
+
+    def release(self, connection: sqlite3.Connection, discard: bool = False):
+        # Give a connection back to the pool.
+        # Set discard=True if something went wrong with it and it shouldn't be reused.
+        with self._lock:
+            pooled = self._in_use.pop(connection, None)
+            if pooled is None:
+                # Not one of ours (or already released)
+                return
+            self._stats["released"] += 1
+
+            if not discard:
+                try:
+                    # Don't let a half-finished transaction leak into the next request
+                    if connection.in_transaction:
+                        connection.rollback()
+                except sqlite3.Error:
+                    discard = True
+
+            if discard or self._closed or self._is_stale(pooled):
+                if not discard and not self._closed:
+                    self._stats["recycled"] += 1
+                _close_quietly(connection)
+            else:
+                pooled.last_used_at = monotonic()
+                self._idle.append(pooled)
+
+            # Wake up one request that's waiting for a connection
+            self._lock.notify()
+
+    def close(self):
+        # Close all idle connections, and make sure busy ones get closed on release
+        with self._lock:
+            self._closed = True
+            while self._idle:
+                _close_quietly(self._idle.pop().connection)
+            self._lock.notify_all()
+
+    def stats(self) -> dict:
+        # Usage and wait-time metrics for the pool
+        with self._lock:
+            stats = dict(self._stats)
+            stats["size"] = self.size
+            stats["in_use"] = len(self._in_use)
+            stats["idle"] = len(self._idle)
+            stats["average_wait_seconds"] = (
+                stats["total_wait_seconds"] / stats["acquired"] if stats["acquired"] else 0.0
+            )
+            return stats
+
+
+def _close_quietly(connection: sqlite3.Connection):
+    try:
+        connection.close()
+    except sqlite3.Error:
+        pass
+
+
+# One pool per worker process
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def get_pool(**pool_options) -> ConnectionPool:
+    # Get the pool for this process, creating it the first time.
+    # If we're in a process that was forked from the one that made the pool
+    # (e.g. a gunicorn worker), make a fresh one since the parent's
+    # connections can't be used after a fork.
+    global _pool, _pool_pid
+
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ConnectionPool(**pool_options)
+            _pool_pid = os.getpid()
+        return _pool
@@ -0,0 +1,142 @@
+import hashlib
+import json
+
+from flask import Response, request
+
+from pagination import encode_position
+
+# Helpers for the JSON API (/api/v1/...). The routes themselves are in app.py.
+#
+# - Field selection: `?fields=ID,MaoriSpelling` only sends those fields. Only the
+#   fields asked for are selected from the database, too.
+# - ETags: every table the API reads from has a counter in the TableVersions table that
+#   goes up whenever the table changes (see migrations/0006_table_versions.sql).
+#   The ETag is made from those counters and the URL, so if a client sends back an ETag
+#   and nothing's changed, it gets a 304 without the Words table being read at all.
+# - Pagination: word lists use the same cursors as the HTML pages (see pagination.py).
+#   Each page has a `next` cursor to pass as `?after=` for the next page.
+# - Speed: JSON is made with orjson if it's installed (it's a lot faster than the json
+#   module), and big pages are streamed a chunk at a time instead of built all at once.
+
+API_VERSION = "v1"
+
+# Fields that can be asked for, in the order they're sent
+WORD_FIELDS = (
+    "ID",
+    "MaoriSpelling",
+    "EnglishSpelling",
+    "EnglishDefinition",
+    "YearLevelFirstEncountered",
+    "ImageFilename",
+    "CategoryID",
+    "CreatedAt",
+    "LastModifiedAt",
+)
+CATEGORY_FIELDS = ("ID", "EnglishName")
+# search.py only gets these
+SEARCH_FIELDS = ("ID", "MaoriSpelling", "EnglishSpelling", "EnglishDefinition", "CategoryID", "ImageFilename")
+
+# Rows fetched from the database (and sent) at a time when streaming a page
+CHUNK_ROWS = 500
+
+try:
+    import orjson
+except ImportError:
+    # The json module works too, just slower
+    orjson = None
+
+
+class InvalidFields(Exception):
+    # Raised when `?fields=` asks for something that isn't there
+    pass
+
+
+def dumps(value) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf8")
+
+
+def parse_fields(text: str, allowed: tuple) -> tuple:
+    # Get the fields asked for with `?fields=`, or all of them if it's not there
+    if not text:
+        return allowed
+    fields = tuple(dict.fromkeys(field.strip() for field in text.split(",") if field.strip()))
+    unknown = [field for field in fields if field not in allowed]
+    if unknown or not fields:
+        raise InvalidFields(f"Unknown fields: {', '.join(unknown)}. Choose from: {', '.join(allowed)}")
+    return fields
+
+
+def table_versions(cursor, *tables) -> tuple:
+    # Get the change counters for some tables.
+    # Read them before reading the tables themselves: if something changes in between,
+    # the response is newer than its ETag says, which just means one extra download later
+    # (the other way round, a client could keep an old copy forever).
+    placeholders = ", ".join("?" * len(tables))
+    cursor.execute(f"SELECT TableName, Version FROM TableVersions WHERE TableName IN ({placeholders})", tables)
+    versions = {row[0]: row[1] for row in cursor.fetchall()}
+    return tuple(versions.get(table, 0) for table in tables)
+
+
+def make_etag(versions: tuple) -> str:
+    # The same URL with the same table versions always gives exactly the same response,
+    # so this can be a strong ETag
+    key = [API_VERSION, list(versions), request.path, sorted(request.args.items(multi=True))]
+    return hashlib.sha1(json.dumps(key).encode("utf8")).hexdigest()[:20]
+
+
+def add_cache_headers(response: Response, etag: str) -> Response:
+    response.set_etag(etag)
+    # Anyone can cache it, but they have to check it's still up to date each time
+    response.cache_control.public = True
+    response.cache_control.no_cache = True
+    return response
+
+
+def not_modified(etag: str):
+    # A 304 response if the client already has this version, otherwise None
+    if request.if_none_match.contains_weak(etag):
+        return add_cache_headers(Response(status=304), etag)
+    return None
+
+
+def json_response(body, etag: str = None, status: int = 200) -> Response:
+    # body: bytes, or an iterable of bytes to stream
+    response = Response(body, status=status, mimetype="application/json")
+    if etag is not None:
+        add_cache_headers(response, etag)
+    return response
+
+
+def error_response(message: str, status: int = 400) -> Response:
+    return json_response(dumps({"error": message}), status=status)
+
+
+def rows_to_dicts(rows: list, fields: tuple) -> list:
+    # rows: plain tuples, with the fields first (extra columns after them are left out)
+    return [dict(zip(fields, row)) for row in rows]
+
+
+def words_page_json(cursor, fields: tuple, page_size: int):
+    # Yield the JSON for a page of words, a chunk at a time, as
+    # {"items": [...], "next": cursor or null}.
+    # cursor: has run pagination.words_page_query() for the fields plus MaoriSpelling and ID,
+    #   with row_factory = None (plain tuples are quickest)
+    yield b'{"items":['
+    sent = 0
+    last_row = None
+    while sent < page_size:
+        rows = cursor.fetchmany(min(CHUNK_ROWS, page_size - sent))
+        if not rows:
+            break
+        # dumps() a whole chunk at once and take off the [ ]
+        items = dumps(rows_to_dicts(rows, fields))[1:-1]
+        yield items if sent == 0 else b"," + items
+        sent += len(rows)
+        last_row = rows[-1]
+
+    # The query gets one extra word, to tell whether there's another page
+    more = sent == page_size and cursor.fetchone() is not None
+    next_cursor = encode_position(last_row[-2], last_row[-1]) if more else None
+    yield b'],"next":' + dumps(next_cursor) + b"}"
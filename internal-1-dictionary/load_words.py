@@ -1,55 +1,414 @@
-import sqlite3
+import argparse
 import csv
-import time
+import math
+import os
+import sqlite3
+import sys
+from time import perf_counter, time
+
+# The modules shared with the cafe app (see shared/__init__.py)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from shared.caching import bump_version_file
+from migrate import MIGRATIONS_FOLDER
+from shared.migrate import run_migrations
+
+
+# Imports a vocabulary list into the dictionary database.
+#
+# Usage (from the internal-1-dictionary folder):
+# ```
+# python load_words.py Vocab_List.csv
+# python load_words.py Vocab_List.xlsx --on-duplicate update --created-by Zadeteacher
+# ```
+# Run `python load_words.py --help` for all the options.
+#
+# The file needs a header row with these columns (in any order):
+# MaoriSpelling, EnglishSpelling, YearLevelFirstEncountered, EnglishDefinition, Category
+# and it can also have an ImageFilename column.
+#
+# How it stays fast with really big files:
+# - Rows are read one at a time, so the whole file is never in memory.
+# - Categories are looked up in a dictionary that's built once
+#   (missing ones get created, unless --no-create-categories is used).
+# - Rows are inserted into a temporary "staging" table in batches with executemany().
+#   The staging table's primary key removes duplicates within the file.
+# - Then a couple of INSERT ... SELECT / UPDATE ... FROM statements move all the
+#   rows into Words at once, skipping (or updating) words that are already there.
+# - Everything happens in one transaction, with PRAGMAs that trade crash-safety
+#   for speed while the import runs. If anything fails, nothing gets imported.
+# - New words are added to the search index in one go at the end,
+#   instead of by a trigger for each row.
+
+REQUIRED_COLUMNS = [
+    "MaoriSpelling",
+    "EnglishSpelling",
+    "YearLevelFirstEncountered",
+    "EnglishDefinition",
+    "Category",
+]
+
+
+class WordImportError(Exception):
+    # Raised when the import can't go ahead (bad file, unknown user, etc.)
+    pass
+
+
+# The readers below yield each row as a list, starting with the header row.
+# (Lists are a lot quicker than csv.DictReader's dictionaries when there are millions of rows.)
+
+
+def read_csv(path: str):
+    # Yield each row of a CSV file.
+    # "-" reads from stdin. utf-8-sig removes the byte order mark Excel adds.
+    if path == "-":
+        sys.stdin.reconfigure(encoding="utf-8-sig")
+        yield from csv.reader(sys.stdin, delimiter=",", quotechar='"')
+        return
+
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        yield from csv.reader(f, delimiter=",", quotechar='"')
+
+
+def read_xlsx(path: str):
+    # Yield each row of the first sheet of an Excel file.
+    # openpyxl is only needed for Excel files, so it's only imported here.
+    try:
+        import openpyxl
+    except ModuleNotFoundError:
+        raise WordImportError("Reading .xlsx files needs openpyxl (pip install openpyxl)")
+
+    # read_only mode streams the rows instead of loading the whole workbook
+    workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        for row in workbook.worksheets[0].iter_rows(values_only=True):
+            # Skip completely empty rows, which Excel files often have at the end
+            if all(value is None for value in row):
+                continue
+            yield ["" if value is None else str(value) for value in row]
+    finally:
+        workbook.close()
+
+
+def read_rows(path: str):
+    if path.lower().endswith(".xlsx"):
+        return read_xlsx(path)
+    return read_csv(path)
+
+
+def get_user_id(cursor: sqlite3.Cursor, username: str) -> int:
+    cursor.execute("SELECT ID FROM Users WHERE Username = ?", [username])
+    result = cursor.fetchone()
+    if result is None:
+        raise WordImportError(f"There's no user called {username!r}")
+    return result[0]
+
+
+def category_key(name: str) -> str:
+    # Categories are matched ignoring case and extra spaces
+    return " ".join(name.split()).lower()
+
+
+def import_words(
+    connection: sqlite3.Connection,
+    rows,
+    created_by: int,
+    on_duplicate: str = "skip",
+    create_categories: bool = True,
+    batch_size: int = 5000,
+    progress=None,
+) -> dict:
+    # Import rows into the Words table. See the comment at the top of the file.
+    # rows: lists of values, starting with the header row
+    # on_duplicate: "skip" leaves words that are already in the database alone,
+    #   "update" overwrites their definition, year level & image.
+    #   Words are the same if they have the same Māori & English spelling and category.
+    # progress: optional function called with the number of rows read so far
+    # Returns a dictionary of counts of what happened.
+    stats = {
+        "rows": 0,
+        "invalid": 0,
+        "unknown_category": 0,
+        "duplicates_in_file": 0,
+        "categories_created": 0,
+        "inserted": 0,
+        "updated": 0,
+        "skipped_existing": 0,
+    }
+
+    cursor = connection.cursor()
+    now = math.floor(time() * 1000)
+
+    # Find which column is which
+    rows = iter(rows)
+    headers = [header.strip() for header in next(rows, [])]
+    missing = [column for column in REQUIRED_COLUMNS if column not in headers]
+    if missing:
+        raise WordImportError(f"The file is missing these columns: {', '.join(missing)}")
+    maori_column = headers.index("MaoriSpelling")
+    english_column = headers.index("EnglishSpelling")
+    year_level_column = headers.index("YearLevelFirstEncountered")
+    definition_column = headers.index("EnglishDefinition")
+    category_column = headers.index("Category")
+    image_column = headers.index("ImageFilename") if "ImageFilename" in headers else None
+    columns_needed = max(maori_column, english_column, year_level_column, definition_column, category_column) + 1
+
+    # Build the category lookup once
+    cursor.execute("SELECT ID, EnglishName FROM Categories")
+    categories = {category_key(name): id for id, name in cursor.fetchall()}
+    # The same category name is usually written the same way over and over,
+    # so remember the ID for each exact spelling too, to skip tidying it up every row
+    category_ids_by_name = {}
+
+    cursor.execute(
+        """CREATE TEMP TABLE ImportWords (
+            MaoriSpelling TEXT NOT NULL,
+            EnglishSpelling TEXT NOT NULL,
+            CategoryID INTEGER NOT NULL,
+            EnglishDefinition TEXT NOT NULL,
+            YearLevelFirstEncountered INTEGER NOT NULL,
+            ImageFilename TEXT,
+            PRIMARY KEY (MaoriSpelling, EnglishSpelling, CategoryID)
+        ) WITHOUT ROWID"""
+    )
+    # Later rows in the file win over earlier ones with the same key
+    stage_query = """INSERT INTO ImportWords (MaoriSpelling, EnglishSpelling, CategoryID,
+            EnglishDefinition, YearLevelFirstEncountered, ImageFilename)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT DO UPDATE SET
+            EnglishDefinition = excluded.EnglishDefinition,
+            YearLevelFirstEncountered = excluded.YearLevelFirstEncountered,
+            ImageFilename = excluded.ImageFilename"""
+
+    batch = []
+    staged = 0
+
+    for row in rows:
+        stats["rows"] += 1
+        if progress is not None and stats["rows"] % 100000 == 0:
+            progress(stats["rows"])
+
+        if len(row) < columns_needed:
+            stats["invalid"] += 1
+            continue
+
+        maori_spelling = row[maori_column].strip()
+        english_spelling = row[english_column].strip()
+        definition = row[definition_column].strip()
+        image_filename = None
+        if image_column is not None and image_column < len(row):
+            image_filename = row[image_column].strip() or None
+        try:
+            year_level = int(row[year_level_column])
+        except ValueError:
+            try:
+                # Excel gives numbers like "3.0"
+                year_level = int(float(row[year_level_column]))
+            except ValueError:
+                year_level = -1
+
+        if not (maori_spelling and english_spelling and definition and 0 <= year_level <= 13):
+            stats["invalid"] += 1
+            continue
+
+        category_name = row[category_column]
+        category_id = category_ids_by_name.get(category_name)
+        if category_id is None:
+            tidy_name = " ".join(category_name.split())
+            if not tidy_name:
+                stats["invalid"] += 1
+                continue
+            category_id = categories.get(category_key(tidy_name))
+            if category_id is None:
+                if not create_categories:
+                    stats["unknown_category"] += 1
+                    continue
+                cursor.execute("INSERT INTO Categories (EnglishName) VALUES (?)", [tidy_name])
+                category_id = cursor.lastrowid
+                categories[category_key(tidy_name)] = category_id
+                stats["categories_created"] += 1
+            category_ids_by_name[category_name] = category_id
+
+        batch.append(
+            (maori_spelling, english_spelling, category_id, definition, year_level, image_filename)
+        )
+        if len(batch) >= batch_size:
+            cursor.executemany(stage_query, batch)
+            staged += len(batch)
+            batch = []
+
+    if batch:
+        cursor.executemany(stage_query, batch)
+        staged += len(batch)
 
-lines = []
+    cursor.execute("SELECT COUNT(*) FROM ImportWords")
+    unique_rows = cursor.fetchone()[0]
+    stats["duplicates_in_file"] = staged - unique_rows
 
-with open("Vocab_List.csv", "r") as f:
-    reader = csv.reader(f, delimiter=',', quotechar='"')
+    # Turn off the trigger that adds new words to the search index, so they can be
+    # added all at once at the end instead of one at a time.
+    # This is all inside the transaction, so the trigger can't end up missing.
+    cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = 'WordsSearchInsert'")
+    search_trigger = cursor.fetchone()
+    if search_trigger is not None:
+        cursor.execute('DROP TRIGGER "WordsSearchInsert"')
+    # Same for the triggers that bump the Words version for every row (see
+    # migrations/0006_table_versions.sql). It only needs to go up once for the whole import.
+    cursor.execute(
+        """SELECT name, sql FROM sqlite_master
+            WHERE type = 'trigger' AND name IN ('WordsVersionInsert', 'WordsVersionUpdate')"""
+    )
+    version_triggers = cursor.fetchall()
+    for name, _ in version_triggers:
+        cursor.execute(f'DROP TRIGGER "{name}"')
+    # IDs only ever go up (because of AUTOINCREMENT), so every new word will have a bigger ID
+    cursor.execute("SELECT COALESCE(MAX(ID), 0) FROM Words")
+    last_id_before_import = cursor.fetchone()[0]
 
-    for row in reader:
-        lines.append(list(row))
+    if on_duplicate == "update":
+        # Only touch words where something's actually different
+        cursor.execute(
+            """UPDATE Words SET
+                EnglishDefinition = ImportWords.EnglishDefinition,
+                YearLevelFirstEncountered = ImportWords.YearLevelFirstEncountered,
+                ImageFilename = ImportWords.ImageFilename,
+                LastModifiedBy = ?,
+                LastModifiedAt = ?
+            FROM ImportWords
+            WHERE Words.MaoriSpelling = ImportWords.MaoriSpelling
+                AND Words.EnglishSpelling = ImportWords.EnglishSpelling
+                AND Words.CategoryID = ImportWords.CategoryID
+                AND (Words.EnglishDefinition IS NOT ImportWords.EnglishDefinition
+                    OR Words.YearLevelFirstEncountered IS NOT ImportWords.YearLevelFirstEncountered
+                    OR Words.ImageFilename IS NOT ImportWords.ImageFilename)""",
+            [created_by, now],
+        )
+        stats["updated"] = cursor.rowcount
 
-headers = lines[0]
-values = lines[1:]
+    # Counted directly (rather than worked out from the others) so that words that
+    # should have matched but didn't show up as inserted instead of being hidden
+    cursor.execute(
+        """SELECT COUNT(*) FROM ImportWords
+            WHERE EXISTS (
+                SELECT 1 FROM Words
+                WHERE Words.MaoriSpelling = ImportWords.MaoriSpelling
+                    AND Words.EnglishSpelling = ImportWords.EnglishSpelling
+                    AND Words.CategoryID = ImportWords.CategoryID
+            )"""
+    )
+    already_there = cursor.fetchone()[0]
 
+    cursor.execute(
+        """INSERT INTO Words (MaoriSpelling, EnglishSpelling, EnglishDefinition, CategoryID,
+                YearLevelFirstEncountered, ImageFilename, CreatedBy, CreatedAt)
+            SELECT MaoriSpelling, EnglishSpelling, EnglishDefinition, CategoryID,
+                YearLevelFirstEncountered, ImageFilename, ?, ?
+            FROM ImportWords
+            WHERE NOT EXISTS (
+                SELECT 1 FROM Words
+                WHERE Words.MaoriSpelling = ImportWords.MaoriSpelling
+                    AND Words.EnglishSpelling = ImportWords.EnglishSpelling
+                    AND Words.CategoryID = ImportWords.CategoryID
+            )""",
+        [created_by, now],
+    )
+    stats["inserted"] = cursor.rowcount
+    stats["skipped_existing"] = already_there - stats["updated"]
 
-def db_dict_factory(cursor, row):
-    # Used to return database query results as dictionaries.
-    # From the docs: https://docs.python.org/3/library/sqlite3.html#sqlite3.Connection.row_factory
+    if search_trigger is not None:
+        cursor.execute(
+            """INSERT INTO WordsSearch (rowid, MaoriSpelling, EnglishSpelling, EnglishDefinition)
+                SELECT ID, MaoriSpelling, EnglishSpelling, EnglishDefinition
+                FROM Words WHERE ID > ?""",
+            [last_id_before_import],
+        )
+        cursor.execute(search_trigger[0])
 
-    d = {}
-    for idx, col in enumerate(cursor.description):
-        d[col[0]] = row[idx]
-    return d
+    if version_triggers:
+        if stats["inserted"] or stats["updated"]:
+            cursor.execute("UPDATE TableVersions SET Version = Version + 1 WHERE TableName = 'Words'")
+        for _, sql in version_triggers:
+            cursor.execute(sql)
 
+    cursor.execute("DROP TABLE ImportWords")
+    return stats
 
-db = sqlite3.connect("dictionary.db")
-db.row_factory = db_dict_factory
-cursor = db.cursor()
 
-categories_query = "SELECT ID, EnglishName FROM Categories"
-cursor.execute(categories_query)
-categories = cursor.fetchall()
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import words into the dictionary")
+    parser.add_argument("file", help="CSV or XLSX file to import, or - to read CSV from stdin")
+    parser.add_argument("--database", default="dictionary.db", help="Path to the database")
+    parser.add_argument(
+        "--created-by", default="System", help="Username of the user the words are created by"
+    )
+    parser.add_argument(
+        "--on-duplicate",
+        choices=["skip", "update"],
+        default="skip",
+        help="What to do with words that are already in the dictionary",
+    )
+    parser.add_argument(
+        "--no-create-categories",
+        action="store_true",
+        help="Skip rows with unknown categories instead of creating them",
+    )
+    parser.add_argument("--batch-size", type=int, default=5000, help="Rows per executemany()")
+    parser.add_argument(
+        "--cache-version-file",
+        help="The app's category cache version file, so running servers see new categories "
+        "(default: the database's path + .categories-version, like the app)",
+    )
+    parser.add_argument("--quiet", action="store_true", help="Don't show progress")
+    args = parser.parse_args()
+    if args.cache_version_file is None:
+        args.cache_version_file = args.database + ".categories-version"
 
-created_at = round(time.time() * 1000)  # Convert to milliseconds
+    run_migrations(args.database, MIGRATIONS_FOLDER)
 
+    db = sqlite3.connect(args.database)
+    # Manage the transaction ourselves so the whole import is one transaction
+    db.isolation_level = None
+    # Speed over crash-safety while the import runs. A crash can't leave a half
+    # import, since it's one transaction, but the OS might not have flushed it to disk.
+    db.execute("PRAGMA synchronous = OFF")
+    db.execute("PRAGMA cache_size = -262144")  # 256MB
+    db.execute("PRAGMA temp_store = MEMORY")
 
-for value in values:
+    started = perf_counter()
 
-    category_id = None
-    for category in categories:
-        if category["EnglishName"].lower().strip() == value[4].lower().strip():
-            category_id = int(category["ID"])
+    def show_progress(rows: int):
+        if not args.quiet:
+            elapsed = perf_counter() - started
+            print(f"\r{rows} rows read ({rows / elapsed:,.0f} rows/s)", end="", file=sys.stderr)
 
-    if (category_id == None):
-        print(value)
-        continue
+    try:
+        created_by = get_user_id(db.cursor(), args.created_by)
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            stats = import_words(
+                db,
+                read_rows(args.file),
+                created_by,
+                on_duplicate=args.on_duplicate,
+                create_categories=not args.no_create_categories,
+                batch_size=args.batch_size,
+                progress=show_progress,
+            )
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+    except (WordImportError, OSError) as e:
+        print(f"Import failed: {e}", file=sys.stderr)
+        sys.exit(1)
+    finally:
+        db.close()
 
-    query = """INSERT INTO Words (MaoriSpelling, EnglishSpelling, YearLevelFirstEncountered, EnglishDefinition, CreatedBy, CreatedAt, CategoryID)
-                            VALUES (?, ?, ?, ?, ?, ?, ?)"""
-    cursor.execute(query, [value[0], value[1], value[2],
-                   value[3], 1, created_at, category_id])
+    if stats["categories_created"] and args.cache_version_file:
+        bump_version_file(args.cache_version_file)
 
-db.commit()
-db.close()
+    if not args.quiet:
+        print(file=sys.stderr)
+    print(f"Done in {perf_counter() - started:.2f}s")
+    for name, count in stats.items():
+        print(f"  {name.replace('_', ' ')}: {count}")
@@ -0,0 +1,36 @@
+-- The tables as they were before there were migrations.
+-- `IF NOT EXISTS` means this does nothing to databases that already have them.
+CREATE TABLE IF NOT EXISTS
+	"Users" (
+		"ID" INTEGER NOT NULL UNIQUE,
+		"Username" TEXT NOT NULL,
+		"Teacher" INTEGER NOT NULL,
+		"PasswordHash" TEXT NOT NULL,
+		PRIMARY KEY ("ID" AUTOINCREMENT)
+	) STRICT;
+
+CREATE TABLE IF NOT EXISTS
+	"Categories" (
+		"ID" INTEGER NOT NULL UNIQUE,
+		"EnglishName" TEXT NOT NULL,
+		PRIMARY KEY ("ID" AUTOINCREMENT)
+	) STRICT;
+
+CREATE TABLE IF NOT EXISTS
+	"Words" (
+		"ID" INTEGER NOT NULL UNIQUE,
+		"MaoriSpelling" TEXT NOT NULL,
+		"EnglishSpelling" TEXT NOT NULL,
+		"EnglishDefinition" TEXT NOT NULL,
+		"YearLevelFirstEncountered" INTEGER NOT NULL,
+		"ImageFilename" TEXT,
+		"CreatedBy" INTEGER NOT NULL,
+		"CreatedAt" INTEGER NOT NULL,
+		"LastModifiedBy" INTEGER,
+		"LastModifiedAt" INTEGER,
+		"CategoryID" INTEGER NOT NULL,
+		PRIMARY KEY ("ID" AUTOINCREMENT),
+		FOREIGN KEY ("CategoryID") REFERENCES "Categories" ("ID"),
+		FOREIGN KEY ("CreatedBy") REFERENCES "Users" ("ID"),
+		FOREIGN KEY ("LastModifiedAt") REFERENCES "Users" ("ID")
+	) STRICT;
@@ -0,0 +1,78 @@
+-- The Words table had a foreign key on LastModifiedAt (a timestamp) instead of
+-- LastModifiedBy (a user ID), and older copies of setup_database.sql also had
+-- one on an ImageID column that doesn't exist.
+-- SQLite can't change foreign keys on an existing table, so the table gets rebuilt.
+-- Docs: https://www.sqlite.org/lang_altertable.html#otheralter
+CREATE TABLE
+	"WordsNew" (
+		"ID" INTEGER NOT NULL UNIQUE,
+		"MaoriSpelling" TEXT NOT NULL,
+		"EnglishSpelling" TEXT NOT NULL,
+		"EnglishDefinition" TEXT NOT NULL,
+		"YearLevelFirstEncountered" INTEGER NOT NULL,
+		"ImageFilename" TEXT,
+		"CreatedBy" INTEGER NOT NULL,
+		"CreatedAt" INTEGER NOT NULL,
+		"LastModifiedBy" INTEGER,
+		"LastModifiedAt" INTEGER,
+		"CategoryID" INTEGER NOT NULL,
+		PRIMARY KEY ("ID" AUTOINCREMENT),
+		FOREIGN KEY ("CategoryID") REFERENCES "Categories" ("ID"),
+		FOREIGN KEY ("CreatedBy") REFERENCES "Users" ("ID"),
+		FOREIGN KEY ("LastModifiedBy") REFERENCES "Users" ("ID")
+	) STRICT;
+
+INSERT INTO
+	"WordsNew" (
+		"ID",
+		"MaoriSpelling",
+		"EnglishSpelling",
+		"EnglishDefinition",
+		"YearLevelFirstEncountered",
+		"ImageFilename",
+		"CreatedBy",
+		"CreatedAt",
+		"LastModifiedBy",
+		"LastModifiedAt",
+		"CategoryID"
+	)
+SELECT
+	"ID",
+	"MaoriSpelling",
+	"EnglishSpelling",
+	"EnglishDefinition",
+	"YearLevelFirstEncountered",
+	"ImageFilename",
+	"CreatedBy",
+	"CreatedAt",
+	"LastModifiedBy",
+	"LastModifiedAt",
+	"CategoryID"
+FROM
+	"Words";
+
+-- Keep the AUTOINCREMENT counter, so the IDs of deleted words never get reused
+UPDATE "sqlite_sequence"
+SET
+	"seq" = MAX(
+		"seq",
+		COALESCE(
+			(
+				SELECT
+					"seq"
+				FROM
+					"sqlite_sequence"
+				WHERE
+					"name" = 'Words'
+			),
+			0
+		)
+	)
+WHERE
+	"name" = 'WordsNew';
+
+-- This also drops any indexes and triggers on the old table.
+-- The migrations after this one (re)create them.
+DROP TABLE "Words";
+
+ALTER TABLE "WordsNew" RENAME TO "Words";
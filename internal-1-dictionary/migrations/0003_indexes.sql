@@ -0,0 +1,15 @@
+-- Indexes for the queries the app runs all the time.
+-- SQLite indexes always include the rowid (the ID column in all these tables),
+-- so queries that only need the indexed columns and ID never have to read the table.
+
+-- Word lists (home page, and pages through them by MaoriSpelling, ID)
+CREATE INDEX IF NOT EXISTS "WordsByMaoriSpelling" ON "Words" ("MaoriSpelling");
+
+-- Category pages, and checking if a category has words before deleting it
+CREATE INDEX IF NOT EXISTS "WordsByCategory" ON "Words" ("CategoryID", "MaoriSpelling");
+
+-- The category list in the sidebar is sorted by name
+CREATE INDEX IF NOT EXISTS "CategoriesByEnglishName" ON "Categories" ("EnglishName");
+
+-- Logging in & signing up look users up by username, and usernames have to be unique
+CREATE UNIQUE INDEX IF NOT EXISTS "UsersByUsername" ON "Users" ("Username");
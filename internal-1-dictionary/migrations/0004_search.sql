@@ -0,0 +1,35 @@
+-- Full text search for words. See search.py for how it's used.
+-- The unicode61 tokenizer with `remove_diacritics 2` folds letters like ā to a,
+-- so searching for "maori" finds "māori" (and the other way around).
+-- The prefix indexes make prefix searches ("kai*") fast.
+-- Docs: https://www.sqlite.org/fts5.html
+CREATE VIRTUAL TABLE IF NOT EXISTS "WordsSearch" USING fts5 (
+	"MaoriSpelling",
+	"EnglishSpelling",
+	"EnglishDefinition",
+	content = 'Words',
+	content_rowid = 'ID',
+	tokenize = 'unicode61 remove_diacritics 2',
+	prefix = '1 2 3'
+);
+
+-- Keep the search index in sync with the Words table
+CREATE TRIGGER IF NOT EXISTS "WordsSearchInsert" AFTER INSERT ON "Words" BEGIN
+	INSERT INTO "WordsSearch" (rowid, "MaoriSpelling", "EnglishSpelling", "EnglishDefinition")
+	VALUES (new."ID", new."MaoriSpelling", new."EnglishSpelling", new."EnglishDefinition");
+END;
+
+CREATE TRIGGER IF NOT EXISTS "WordsSearchDelete" AFTER DELETE ON "Words" BEGIN
+	INSERT INTO "WordsSearch" ("WordsSearch", rowid, "MaoriSpelling", "EnglishSpelling", "EnglishDefinition")
+	VALUES ('delete', old."ID", old."MaoriSpelling", old."EnglishSpelling", old."EnglishDefinition");
+END;
+
+CREATE TRIGGER IF NOT EXISTS "WordsSearchUpdate" AFTER UPDATE ON "Words" BEGIN
+	INSERT INTO "WordsSearch" ("WordsSearch", rowid, "MaoriSpelling", "EnglishSpelling", "EnglishDefinition")
+	VALUES ('delete', old."ID", old."MaoriSpelling", old."EnglishSpelling", old."EnglishDefinition");
+	INSERT INTO "WordsSearch" (rowid, "MaoriSpelling", "EnglishSpelling", "EnglishDefinition")
+	VALUES (new."ID", new."MaoriSpelling", new."EnglishSpelling", new."EnglishDefinition");
+END;
+
+-- Index all the words that already exist
+INSERT INTO "WordsSearch" ("WordsSearch") VALUES ('rebuild');
@@ -0,0 +1,12 @@
+-- A counter that goes up whenever a user's role (or username) changes.
+-- Logged in users carry a copy of their details in their session, along with the
+-- version they were saved at. If the version in the database is different,
+-- the app reloads their details instead of trusting the session (see get_user() in app.py).
+ALTER TABLE "Users" ADD COLUMN "RoleVersion" INTEGER NOT NULL DEFAULT 0;
+
+-- Bump the version automatically, so it can't be forgotten
+-- (even when the database is edited by hand)
+CREATE TRIGGER IF NOT EXISTS "UsersRoleVersion" AFTER UPDATE OF "Teacher", "Username" ON "Users"
+WHEN old."Teacher" IS NOT new."Teacher" OR old."Username" IS NOT new."Username" BEGIN
+	UPDATE "Users" SET "RoleVersion" = "RoleVersion" + 1 WHERE "ID" = new."ID";
+END;
@@ -0,0 +1,35 @@
+-- A counter for each table that goes up whenever anything in the table changes.
+-- The JSON API uses these for its ETags, so it can tell a client that its copy
+-- is still up to date without reading the table itself (see json_api.py).
+CREATE TABLE IF NOT EXISTS "TableVersions" (
+	"TableName" TEXT NOT NULL PRIMARY KEY,
+	"Version" INTEGER NOT NULL DEFAULT 0
+) STRICT, WITHOUT ROWID;
+
+INSERT OR IGNORE INTO "TableVersions" ("TableName") VALUES ('Words'), ('Categories');
+
+-- Bump the counters automatically, so they can't be forgotten
+-- (load_words.py turns the Words ones off during an import and bumps it once at the end)
+CREATE TRIGGER IF NOT EXISTS "WordsVersionInsert" AFTER INSERT ON "Words" BEGIN
+	UPDATE "TableVersions" SET "Version" = "Version" + 1 WHERE "TableName" = 'Words';
+END;
+
+CREATE TRIGGER IF NOT EXISTS "WordsVersionUpdate" AFTER UPDATE ON "Words" BEGIN
+	UPDATE "TableVersions" SET "Version" = "Version" + 1 WHERE "TableName" = 'Words';
+END;
+
+CREATE TRIGGER IF NOT EXISTS "WordsVersionDelete" AFTER DELETE ON "Words" BEGIN
+	UPDATE "TableVersions" SET "Version" = "Version" + 1 WHERE "TableName" = 'Words';
+END;
+
+CREATE TRIGGER IF NOT EXISTS "CategoriesVersionInsert" AFTER INSERT ON "Categories" BEGIN
+	UPDATE "TableVersions" SET "Version" = "Version" + 1 WHERE "TableName" = 'Categories';
+END;
+
+CREATE TRIGGER IF NOT EXISTS "CategoriesVersionUpdate" AFTER UPDATE ON "Categories" BEGIN
+	UPDATE "TableVersions" SET "Version" = "Version" + 1 WHERE "TableName" = 'Categories';
+END;
+
+CREATE TRIGGER IF NOT EXISTS "CategoriesVersionDelete" AFTER DELETE ON "Categories" BEGIN
+	UPDATE "TableVersions" SET "Version" = "Version" + 1 WHERE "TableName" = 'Categories';
+END;
@@ -0,0 +1,13 @@
+-- Some words were loaded with spaces around them (like "moemoea "), from before the
+-- app and load_words.py stripped them. They looked the same as the trimmed words but
+-- didn't match them, so importing the word list again added them a second time.
+-- Strip them the same way Python's str.strip() does for the usual whitespace.
+UPDATE "Words"
+SET
+	"MaoriSpelling" = TRIM("MaoriSpelling", ' ' || char(9, 10, 13)),
+	"EnglishSpelling" = TRIM("EnglishSpelling", ' ' || char(9, 10, 13)),
+	"EnglishDefinition" = TRIM("EnglishDefinition", ' ' || char(9, 10, 13))
+WHERE
+	"MaoriSpelling" IS NOT TRIM("MaoriSpelling", ' ' || char(9, 10, 13))
+	OR "EnglishSpelling" IS NOT TRIM("EnglishSpelling", ' ' || char(9, 10, 13))
+	OR "EnglishDefinition" IS NOT TRIM("EnglishDefinition", ' ' || char(9, 10, 13));
@@ -0,0 +1,150 @@
+import base64
+import json
+import sqlite3
+
+
+# Cursor (a.k.a. keyset) pagination for lists of words.
+# Instead of `LIMIT ? OFFSET ?`, which makes SQLite walk past every row before the
+# page, each page link holds the position of the last (or first) word on the
+# current page, and the next page starts right after it:
+# `WHERE (MaoriSpelling, ID) > (?, ?) ORDER BY MaoriSpelling, ID LIMIT ?`
+# With the indexes from migrations/0003_indexes.sql that's one index seek,
+# so page 1000 costs the same as page 1.
+# ID is included because lots of words can have the same spelling.
+# More info: https://use-the-index-luke.com/no-offset
+
+
+class InvalidCursor(Exception):
+    # Raised when a page cursor from the URL can't be decoded
+    pass
+
+
+def encode_cursor(word) -> str:
+    # Turn a word's position into a short string that can go in a URL
+    return encode_position(word["MaoriSpelling"], word["ID"])
+
+
+def encode_position(maori_spelling: str, id: int) -> str:
+    position = json.dumps([maori_spelling, id], ensure_ascii=False)
+    return base64.urlsafe_b64encode(position.encode("utf8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple:
+    # The opposite of encode_cursor()
+    try:
+        padding = "=" * (-len(cursor) % 4)
+        maori_spelling, id = json.loads(base64.urlsafe_b64decode(cursor + padding))
+        if not isinstance(maori_spelling, str) or not isinstance(id, int):
+            raise ValueError("Wrong types in cursor")
+        return maori_spelling, id
+    except (ValueError, TypeError) as e:
+        raise InvalidCursor(str(e))
+
+
+def words_page_query(
+    page_size: int,
+    after: str = None,
+    before: str = None,
+    category_id: int = None,
+    columns: str = "*",
+) -> tuple:
+    # Build the query for a page of words (see get_words_page()), as (sql, params).
+    # It gets one extra word to find out whether there's another page after this one.
+    # columns: what to select. Must be safe to put straight into the SQL.
+    conditions = []
+    params = []
+
+    if category_id is not None:
+        conditions.append("CategoryID = ?")
+        params.append(category_id)
+
+    if before is not None:
+        # Going backwards: get the words before the cursor in reverse order, then flip them
+        conditions.append("(MaoriSpelling, ID) < (?, ?)")
+        params.extend(decode_cursor(before))
+        order = "MaoriSpelling DESC, ID DESC"
+    else:
+        if after is not None:
+            conditions.append("(MaoriSpelling, ID) > (?, ?)")
+            params.extend(decode_cursor(after))
+        order = "MaoriSpelling, ID"
+
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    return (f"SELECT {columns} FROM Words {where} ORDER BY {order} LIMIT ?", [*params, page_size + 1])
+
+
+def get_words_page(
+    db_cursor: sqlite3.Cursor,
+    page_size: int,
+    after: str = None,
+    before: str = None,
+    category_id: int = None,
+) -> dict:
+    # Get one page of words ordered by Māori spelling.
+    # after: cursor of the word just before the page (for "next" links)
+    # before: cursor of the word just after the page (for "previous" links)
+    # category_id: only get words in this category
+    # Returns {"words": [...], "next": cursor or None, "previous": cursor or None}
+    db_cursor.execute(*words_page_query(page_size, after=after, before=before, category_id=category_id))
+    words = db_cursor.fetchall()
+
+    more = len(words) > page_size
+    words = words[:page_size]
+
+    if before is not None:
+        words.reverse()
+        has_previous, has_next = more, True
+    else:
+        has_previous, has_next = after is not None, more
+
+    return {
+        "words": words,
+        "next": encode_cursor(words[-1]) if has_next and words else None,
+        "previous": encode_cursor(words[0]) if has_previous and words else None,
+    }
+
+
+class WordsPageStream:
+    # The same as what get_words_page() returns, but the words are read from the database
+    # as they're used instead of all at once, so a page can be sent while it's being
+    # rendered without the whole list being in memory (see render_words_page() in app.py).
+    # It only goes forwards, since going backwards gets the words in reverse order.
+    # `next` and `previous` can only be used once all the words have been read.
+    # db_cursor: a cursor just for this, since running another query on it would stop the words
+    def __init__(self, db_cursor: sqlite3.Cursor, page_size: int, after: str = None, category_id: int = None):
+        db_cursor.execute(*words_page_query(page_size, after=after, category_id=category_id))
+        self.db_cursor = db_cursor
+        self.page_size = page_size
+        self.after = after
+        self.first_word = None
+        self.last_word = None
+        # Whether there's another page. None until the words have been read.
+        self.more = None
+
+    def __iter__(self):
+        count = 0
+        for word in self.db_cursor:
+            if count == self.page_size:
+                # The extra word, which means there's another page
+                self.more = True
+                return
+            if count == 0:
+                self.first_word = word
+            self.last_word = word
+            count += 1
+            yield word
+        self.more = False
+
+    def _check_read(self):
+        if self.more is None:
+            raise RuntimeError("Read the words before using the page cursors")
+
+    @property
+    def next(self) -> str:
+        self._check_read()
+        return encode_cursor(self.last_word) if self.more else None
+
+    @property
+    def previous(self) -> str:
+        self._check_read()
+        return encode_cursor(self.first_word) if self.after is not None and self.first_word else None
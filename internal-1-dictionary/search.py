@@ -0,0 +1,45 @@
+import re
+import sqlite3
+
+
+# Full text search for words, using SQLite's FTS5 extension.
+# Docs: https://www.sqlite.org/fts5.html
+#
+# The search index (the WordsSearch table) and the triggers that keep it up to date
+# are created by migrations/0004_search.sql. It's an "external content" table,
+# which means it doesn't store its own copy of the words, just the index.
+
+
+# How much each column counts towards the ranking, in the same order as the
+# columns in the WordsSearch table (MaoriSpelling, EnglishSpelling, EnglishDefinition).
+# A match in a spelling is worth a lot more than a match somewhere in a definition.
+RANK_WEIGHTS = (10.0, 10.0, 1.0)
+
+
+def build_search_query(text: str) -> str:
+    # Turn whatever the user typed into an FTS5 query.
+    # Every word has to match, and each one can be the start of a longer word,
+    # so "kai ma" finds "kai mahi". Each word is quoted so that characters
+    # like " or * in the input can't be used as FTS5 syntax.
+    # Returns an empty string if there's nothing to search for.
+    terms = re.findall(r"\w+", text)
+    return " ".join('"' + term.replace('"', '""') + '"*' for term in terms)
+
+
+def search_words(cursor: sqlite3.Cursor, text: str, limit: int = 50) -> list:
+    # Search for words, best matches first
+    query = build_search_query(text)
+    if not query:
+        return []
+
+    cursor.execute(
+        f"""SELECT Words.ID, Words.MaoriSpelling, Words.EnglishSpelling, Words.EnglishDefinition,
+                   Words.CategoryID, Words.ImageFilename
+            FROM WordsSearch
+            JOIN Words ON Words.ID = WordsSearch.rowid
+            WHERE WordsSearch MATCH ?
+            ORDER BY bm25(WordsSearch, {", ".join(str(weight) for weight in RANK_WEIGHTS)})
+            LIMIT ?""",
+        [query, limit],
+    )
+    return cursor.fetchall()
@@ -1,9 +1,14 @@
+-- The database is created and upgraded by `python migrate.py`, using the files
+-- in the migrations folder. This file shows what the schema looks like after
+-- all of them have run, and can also be used to make a new empty database:
+-- `sqlite3 dictionary.db < setup_database.sql`
 CREATE TABLE
 	"Users" (
 		"ID" INTEGER NOT NULL UNIQUE,
 		"Username" TEXT NOT NULL,
+		"Teacher" INTEGER NOT NULL,
 		"PasswordHash" TEXT NOT NULL,
-		"Teacher" INTEGER,
+		"RoleVersion" INTEGER NOT NULL DEFAULT 0,
 		PRIMARY KEY ("ID" AUTOINCREMENT)
 	) STRICT;
 
@@ -30,6 +35,84 @@ CREATE TABLE
 		PRIMARY KEY ("ID" AUTOINCREMENT),
 		FOREIGN KEY ("CategoryID") REFERENCES "Categories" ("ID"),
 		FOREIGN KEY ("CreatedBy") REFERENCES "Users" ("ID"),
-		FOREIGN KEY ("ImageID") REFERENCES "Images" ("ID"),
-		FOREIGN KEY ("LastModifiedAt") REFERENCES "Users" ("ID")
-	) STRICT;
\ No newline at end of file
+		FOREIGN KEY ("LastModifiedBy") REFERENCES "Users" ("ID")
+	) STRICT;
+
+CREATE INDEX "WordsByMaoriSpelling" ON "Words" ("MaoriSpelling");
+
+CREATE INDEX "WordsByCategory" ON "Words" ("CategoryID", "MaoriSpelling");
+
+CREATE INDEX "CategoriesByEnglishName" ON "Categories" ("EnglishName");
+
+CREATE UNIQUE INDEX "UsersByUsername" ON "Users" ("Username");
+
+CREATE TRIGGER "UsersRoleVersion" AFTER UPDATE OF "Teacher", "Username" ON "Users"
+WHEN old."Teacher" IS NOT new."Teacher" OR old."Username" IS NOT new."Username" BEGIN
+	UPDATE "Users" SET "RoleVersion" = "RoleVersion" + 1 WHERE "ID" = new."ID";
+END;
+
+CREATE TABLE
+	"TableVersions" (
+		"TableName" TEXT NOT NULL PRIMARY KEY,
+		"Version" INTEGER NOT NULL DEFAULT 0
+	) STRICT, WITHOUT ROWID;
+
+INSERT INTO "TableVersions" ("TableName") VALUES ('Words'), ('Categories');
+
+-- Full text search for words, from migrations/0004_search.sql
+CREATE VIRTUAL TABLE "WordsSearch" USING fts5 (
+	"MaoriSpelling",
+	"EnglishSpelling",
+	"EnglishDefinition",
+	content = 'Words',
+	content_rowid = 'ID',
+	tokenize = 'unicode61 remove_diacritics 2',
+	prefix = '1 2 3'
+);
+
+-- Keep the search index in sync with the Words table
+CREATE TRIGGER "WordsSearchInsert" AFTER INSERT ON "Words" BEGIN
+	INSERT INTO "WordsSearch" (rowid, "MaoriSpelling", "EnglishSpelling", "EnglishDefinition")
+	VALUES (new."ID", new."MaoriSpelling", new."EnglishSpelling", new."EnglishDefinition");
+END;
+
+CREATE TRIGGER "WordsSearchDelete" AFTER DELETE ON "Words" BEGIN
+	INSERT INTO "WordsSearch" ("WordsSearch", rowid, "MaoriSpelling", "EnglishSpelling", "EnglishDefinition")
+	VALUES ('delete', old."ID", old."MaoriSpelling", old."EnglishSpelling", old."EnglishDefinition");
+END;
+
+CREATE TRIGGER "WordsSearchUpdate" AFTER UPDATE ON "Words" BEGIN
+	INSERT INTO "WordsSearch" ("WordsSearch", rowid, "MaoriSpelling", "EnglishSpelling", "EnglishDefinition")
+	VALUES ('delete', old."ID", old."MaoriSpelling", old."EnglishSpelling", old."EnglishDefinition");
+	INSERT INTO "WordsSearch" (rowid, "MaoriSpelling", "EnglishSpelling", "EnglishDefinition")
+	VALUES (new."ID", new."MaoriSpelling", new."EnglishSpelling", new."EnglishDefinition");
+END;
+
+-- Bump the TableVersions counters, from migrations/0006_table_versions.sql
+CREATE TRIGGER "WordsVersionInsert" AFTER INSERT ON "Words" BEGIN
+	UPDATE "TableVersions" SET "Version" = "Version" + 1 WHERE "TableName" = 'Words';
+END;
+
+CREATE TRIGGER "WordsVersionUpdate" AFTER UPDATE ON "Words" BEGIN
+	UPDATE "TableVersions" SET "Version" = "Version" + 1 WHERE "TableName" = 'Words';
+END;
+
+CREATE TRIGGER "WordsVersionDelete" AFTER DELETE ON "Words" BEGIN
+	UPDATE "TableVersions" SET "Version" = "Version" + 1 WHERE "TableName" = 'Words';
+END;
+
+CREATE TRIGGER "CategoriesVersionInsert" AFTER INSERT ON "Categories" BEGIN
+	UPDATE "TableVersions" SET "Version" = "Version" + 1 WHERE "TableName" = 'Categories';
+END;
+
+CREATE TRIGGER "CategoriesVersionUpdate" AFTER UPDATE ON "Categories" BEGIN
+	UPDATE "TableVersions" SET "Version" = "Version" + 1 WHERE "TableName" = 'Categories';
+END;
+
+CREATE TRIGGER "CategoriesVersionDelete" AFTER DELETE ON "Categories" BEGIN
+	UPDATE "TableVersions" SET "Version" = "Version" + 1 WHERE "TableName" = 'Categories';
+END;
+
+-- The migration this schema matches, so migrate.py doesn't run them all again on a
+-- database made with this file. Keep it the same as the newest migration's number.
+PRAGMA user_version = 7;
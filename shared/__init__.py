@@ -0,0 +1,11 @@
+# Modules used by both the dictionary (internal-1-dictionary) and the cafe (cafe-thingy).
+#
+# Each app puts the folder above this one on sys.path before importing anything from
+# here (see the top of app.py and server.py), then uses them like
+# `from shared.caching import VersionedCache`.
+#
+# The command line tools run from the top folder, and take the app's folder:
+# ```
+# python -m shared.images --app cafe-thingy
+# python -m shared.static_assets --app internal-1-dictionary --nginx-config
+# ```
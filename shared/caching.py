@@ -0,0 +1,208 @@
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from time import monotonic
+
+
+# A cache for data that's read on almost every request, but only changes when
+# a teacher or admin edits something (like the list of categories).
+#
+# The data is kept in memory in each worker process. To make sure that all the
+# workers notice when one of them changes the data, the cache can be given a
+# "version file". Invalidating the cache replaces that file, and every other
+# process checks whether it's been replaced (one cheap `stat` call) before using
+# its copy. Without a version file, invalidation only affects the current process.
+#
+# Example usage:
+# ```
+# cache = VersionedCache(load_categories, version_file="categories.version")
+# categories = cache.get(cursor)
+# ...
+# cache.invalidate()
+# ```
+
+
+class VersionedCache:
+    def __init__(self, loader, version_file: str = None):
+        # loader: function that gets called with the same arguments as `get()`
+        #   to load a fresh copy of the data
+        # version_file: optional path of a file used to share invalidations between processes
+        self.loader = loader
+        self.version_file = version_file
+
+        self._lock = threading.Lock()
+        # (version, value) are kept together in one tuple so that
+        # threads never see a version paired with the wrong value
+        self._entry = (None, None)
+        # Bumped on every invalidation in this process, so that a load which
+        # started before an invalidation doesn't get treated as up to date
+        self._generation = 0
+
+        self.hits = 0
+        self.misses = 0
+
+    def _current_version(self):
+        # The version is the identity of the version file.
+        # It gets replaced (not edited) on invalidation, so the inode changes even
+        # on filesystems where the modification time isn't very precise.
+        file_version = None
+        if self.version_file:
+            try:
+                stat = os.stat(self.version_file)
+                file_version = (stat.st_ino, stat.st_mtime_ns)
+            except FileNotFoundError:
+                pass
+        return (self._generation, file_version)
+
+    def get(self, *args, **kwargs):
+        # Get the cached data, loading it if it's missing or out of date
+        version = self._current_version()
+        loaded_version, value = self._entry
+        if version == loaded_version:
+            self.hits += 1
+            return value
+
+        with self._lock:
+            # Another thread might have reloaded it while we waited for the lock
+            version = self._current_version()
+            loaded_version, value = self._entry
+            if version == loaded_version:
+                self.hits += 1
+                return value
+
+            self.misses += 1
+            # The version is checked *before* loading, so if it changes while
+            # we're loading, the next call will load it again.
+            value = self.loader(*args, **kwargs)
+            self._entry = (version, value)
+            return value
+
+    def invalidate(self):
+        # Throw away the cached data in this process and tell other processes to do the same
+        with self._lock:
+            self._generation += 1
+            self._entry = (None, None)
+
+        if self.version_file:
+            bump_version_file(self.version_file)
+
+
+def bump_version_file(version_file: str):
+    # Replace a cache's version file, which tells every process using it to reload.
+    # This can be used by scripts that change the database outside of the app.
+    # Write to a temporary file then swap it in, so the replacement is atomic.
+    # The temporary file gets a unique name, so two threads doing this at once don't
+    # write (and then try to swap in) the same file.
+    with tempfile.NamedTemporaryFile(
+        "w", dir=os.path.dirname(os.path.abspath(version_file)), suffix=".tmp", delete=False
+    ) as f:
+        f.write(str(os.getpid()))
+    os.replace(f.name, version_file)
+
+
+# A simple "least recently used" cache with a maximum size.
+# When it's full, adding something new throws away whatever was used longest ago.
+# Unlike functools.lru_cache, the caller decides what the key is, which means the key
+# can include things like a "last modified" time so that changed data never gets
+# served from the cache.
+#
+# Example usage:
+# ```
+# cache = LRUCache(max_size=1000)
+# html = cache.get(key)
+# if html is None:
+#   html = render()
+#   cache.set(key, html)
+# ```
+
+
+class LRUCache:
+    def __init__(self, max_size: int = 1000):
+        # max_size: most items to keep. 0 turns the cache off.
+        self.max_size = max_size
+
+        self._lock = threading.Lock()
+        self._items = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._items:
+                # Mark it as the most recently used
+                self._items.move_to_end(key)
+                self.hits += 1
+                return self._items[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            # Throw away the least recently used items until it's small enough
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+# A cache where everything expires after `ttl` seconds.
+# Good for things that can be a little out of date, but not for long
+# (like whether a user is still a teacher).
+#
+# Example usage:
+# ```
+# cache = TTLCache(ttl=30)
+# version = cache.get(user_id, MISSING)
+# if version is MISSING:
+#   version = load_version(user_id)
+#   cache.set(user_id, version)
+# ```
+
+
+class TTLCache:
+    def __init__(self, ttl: float = 30.0, max_size: int = 10000):
+        # ttl: how long (seconds) things are kept for. 0 turns the cache off.
+        # max_size: most items to keep. The oldest are thrown away first.
+        self.ttl = ttl
+        self.max_size = max_size
+
+        self._lock = threading.Lock()
+        # key -> (expiry time, value), oldest first
+        self._items = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None and item[0] > monotonic():
+                self.hits += 1
+                return item[1]
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        if self.ttl <= 0 or self.max_size <= 0:
+            return
+        with self._lock:
+            self._items[key] = (monotonic() + self.ttl, value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._items.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
@@ -0,0 +1,77 @@
+import os
+import sqlite3
+
+
+# SQLite settings shared by every database connection the app opens.
+#
+# By default SQLite uses a "rollback journal", which means that while someone is
+# writing, nobody else can read. With WAL (write-ahead logging) readers carry on
+# reading the last committed data while a write happens, and only writers have to
+# wait for each other. Docs: https://www.sqlite.org/wal.html
+#
+# Every setting can be changed with an environment variable, e.g.
+# `DICTIONARY_DB_BUSY_TIMEOUT=10000` or `SMILE_DB_JOURNAL_MODE=DELETE`
+# (the prefix depends on the app).
+
+DEFAULT_SETTINGS = {
+    # WAL lets reads happen at the same time as a write
+    "journal_mode": "WAL",
+    # How long (milliseconds) to wait for another connection's write to finish,
+    # instead of failing straight away with "database is locked"
+    "busy_timeout": 5000,
+    # NORMAL is safe with WAL (a power cut can lose the last few commits, but can't
+    # corrupt the database) and a lot faster than FULL because it syncs less often
+    "synchronous": "NORMAL",
+    # Page cache per connection. Negative numbers are in KiB, so this is 16MB.
+    "cache_size": -16000,
+    # Read the database through memory-mapped I/O, up to this many bytes (128MB).
+    # This shares the OS's cache of the file between connections and processes.
+    "mmap_size": 134217728,
+}
+
+# Allowed values for the settings that aren't numbers.
+# These get put straight into PRAGMA statements, so they have to be checked.
+ALLOWED_VALUES = {
+    "journal_mode": {"DELETE", "TRUNCATE", "PERSIST", "MEMORY", "WAL", "OFF"},
+    "synchronous": {"OFF", "NORMAL", "FULL", "EXTRA"},
+}
+
+
+def settings_from_env(prefix: str) -> dict:
+    # Get the settings, with any overrides from environment variables.
+    # prefix: e.g. "DICTIONARY_DB_" to read DICTIONARY_DB_JOURNAL_MODE etc.
+    settings = {}
+    for name, default in DEFAULT_SETTINGS.items():
+        value = os.environ.get(prefix + name.upper())
+        if value is None:
+            settings[name] = default
+        elif name in ALLOWED_VALUES:
+            settings[name] = value.upper()
+        else:
+            settings[name] = int(value)
+    return settings
+
+
+def pragma_statements(settings: dict = None) -> list:
+    # Turn the settings into a list of PRAGMA statements
+    if settings is None:
+        settings = DEFAULT_SETTINGS
+
+    statements = []
+    for name, value in settings.items():
+        if name in ALLOWED_VALUES:
+            value = str(value).upper()
+            if value not in ALLOWED_VALUES[name]:
+                raise ValueError(f"{value!r} isn't a valid value for {name}")
+        else:
+            value = int(value)
+        statements.append(f"PRAGMA {name} = {value}")
+    return statements
+
+
+def configure_connection(connection: sqlite3.Connection, settings: dict = None):
+    # Apply the settings to a new connection.
+    # journal_mode=WAL is saved in the database file, so after the first time
+    # this is just a quick check, but the other settings only last as long as the connection.
+    for statement in pragma_statements(settings):
+        connection.execute(statement).fetchall()
@@ -0,0 +1,256 @@
+import argparse
+import hashlib
+import io
+import json
+import logging
+import os
+import tempfile
+import threading
+
+from werkzeug.security import safe_join
+
+from shared.caching import VersionedCache
+
+# Makes smaller copies ("derivatives") of the images in static/images, so pages can
+# load an image the size it's actually shown at instead of a multi-megabyte photo.
+#
+# Each image gets resized to a few fixed widths and saved as AVIF and WebP (much
+# smaller, supported by modern browsers) plus JPEG (or PNG for images with
+# transparency) for everything else. Camera metadata (EXIF, GPS etc.) gets stripped.
+# Filenames include a hash of their contents, so they can be cached forever.
+# Everything goes in static/images/derived, with a manifest.json that says what's there.
+# The templates use the manifest to make <picture> elements with `srcset`s, and just
+# use the original image for anything that isn't in it.
+#
+# Build all of them for an app (only images that are new or changed get processed):
+# `python -m shared.images --app cafe-thingy`, add `--force` to redo everything.
+# The apps also build them in the background when an image gets added to a product/word.
+#
+# Example usage:
+# ```
+# images = init_app(app)  # the images in app's static/images
+# images.build_in_background("kowhai.jpg", on_done=page_cache.clear)
+# ```
+
+# Widths (pixels) to make copies at. Images are never made bigger than the original.
+WIDTHS = (80, 160, 320, 640, 1000)
+
+# Image formats, best first, and the settings to save them with
+FORMATS = {
+    "avif": {"quality": 50, "speed": 8},
+    "webp": {"quality": 75, "method": 4},
+    "jpeg": {"quality": 80, "optimize": True, "progressive": True},
+    "png": {"optimize": True},
+}
+MIME_TYPES = {"avif": "image/avif", "webp": "image/webp", "jpeg": "image/jpeg", "png": "image/png"}
+
+DERIVED_FOLDER = "derived"
+MANIFEST_FILENAME = "manifest.json"
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".gif"}
+
+# Stops two threads writing the manifest at the same time
+_manifest_lock = threading.Lock()
+
+log = logging.getLogger(__name__)
+
+
+def manifest_path(images_folder: str) -> str:
+    return os.path.join(images_folder, DERIVED_FOLDER, MANIFEST_FILENAME)
+
+
+def read_manifest(images_folder: str) -> dict:
+    try:
+        with open(manifest_path(images_folder)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_manifest_entries(entries: dict, images_folder: str):
+    # Add entries to the manifest. It's re-read first so that entries saved by
+    # someone else in the meantime don't get lost, then swapped in all at once
+    # (which also tells the apps' caches to reload it, see VersionedCache).
+    with _manifest_lock:
+        manifest = read_manifest(images_folder)
+        manifest.update(entries)
+        path = manifest_path(images_folder)
+        # The lock only covers this process, so the temporary file needs a name no
+        # other process (e.g. `python -m shared.images` while the app runs) will use
+        with tempfile.NamedTemporaryFile("w", dir=os.path.dirname(path), suffix=".tmp", delete=False) as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+        os.replace(f.name, path)
+
+
+def file_hash(data: bytes) -> str:
+    return hashlib.sha1(data).hexdigest()[:10]
+
+
+def make_derivatives(filename: str, images_folder: str, widths=WIDTHS) -> dict:
+    # Make the smaller copies of one image (filename is relative to images_folder)
+    # and return its manifest entry.
+    # Pillow is only needed for this, not for serving pages, so it's imported here.
+    from PIL import Image, ImageOps
+
+    # Filenames can come from forms, so don't let them point outside the folder (../x.png)
+    source_path = safe_join(images_folder, filename)
+    if source_path is None:
+        raise ValueError(f"{filename} isn't in {images_folder}")
+    with open(source_path, "rb") as f:
+        source = f.read()
+
+    image = Image.open(io.BytesIO(source))
+    # Phone photos are often stored sideways with a "rotate me" flag in the metadata.
+    # Since the metadata gets stripped, do the rotation now.
+    image = ImageOps.exif_transpose(image)
+    has_alpha = image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info)
+    image = image.convert("RGBA" if has_alpha else "RGB")
+    fallback = "png" if has_alpha else "jpeg"
+
+    output_folder = os.path.join(images_folder, DERIVED_FOLDER)
+    os.makedirs(output_folder, exist_ok=True)
+    stem = os.path.splitext(filename)[0].replace("/", "-")
+
+    # Always include the original width if it's smaller than all of them
+    sizes = sorted({min(width, image.width) for width in widths})
+    formats = {name: [] for name in ["avif", "webp", fallback]}
+    for width in sizes:
+        height = round(image.height * width / image.width)
+        resized = image if width == image.width else image.resize((width, height), Image.LANCZOS)
+        for name in formats:
+            buffer = io.BytesIO()
+            # Nothing from the original's info (EXIF, ICC, comments) is passed to save()
+            resized.save(buffer, format=name.upper(), **FORMATS[name])
+            data = buffer.getvalue()
+
+            extension = "jpg" if name == "jpeg" else name
+            output_name = f"{stem}.{width}w.{file_hash(data)}.{extension}"
+            output_path = os.path.join(output_folder, output_name)
+            if not os.path.exists(output_path):
+                with open(output_path, "wb") as f:
+                    f.write(data)
+            # Paths are relative to the static folder, ready for url_for("static", ...)
+            formats[name].append([width, f"images/{DERIVED_FOLDER}/{output_name}", len(data)])
+
+    return {
+        "source_hash": file_hash(source),
+        "source_size": len(source),
+        "width": image.width,
+        "height": image.height,
+        "fallback": fallback,
+        "formats": formats,
+    }
+
+
+def find_images(images_folder: str) -> list:
+    # All the original images (skipping the derived folder)
+    return sorted(
+        filename
+        for filename in os.listdir(images_folder)
+        if os.path.splitext(filename)[1].lower() in IMAGE_EXTENSIONS
+    )
+
+
+def build(images_folder: str, filenames: list = None, force: bool = False, verbose: bool = False) -> dict:
+    # Make derivatives for the given images (or all of them), skipping ones that
+    # are already in the manifest and haven't changed. Returns the new entries.
+    manifest = read_manifest(images_folder)
+    entries = {}
+    for filename in filenames if filenames is not None else find_images(images_folder):
+        # Skip anything outside the folder (see make_derivatives) or that doesn't exist
+        source_path = safe_join(images_folder, filename)
+        if source_path is None or not os.path.isfile(source_path):
+            continue
+        if not force and filename in manifest:
+            with open(source_path, "rb") as f:
+                if file_hash(f.read()) == manifest[filename]["source_hash"]:
+                    continue
+
+        entry = make_derivatives(filename, images_folder)
+        entries[filename] = entry
+        # Save as we go, so stopping halfway doesn't lose everything
+        save_manifest_entries({filename: entry}, images_folder)
+        if filename in manifest:
+            remove_old_files(manifest[filename], entry, images_folder)
+        if verbose:
+            largest = max(size for _, _, size in entry["formats"]["avif"])
+            print(f"{filename}: {entry['source_size'] / 1024:,.0f} KiB -> {largest / 1024:,.0f} KiB (largest AVIF)")
+    return entries
+
+
+def remove_old_files(old_entry: dict, new_entry: dict, images_folder: str):
+    # Delete the copies from an image's old entry that the new one doesn't use
+    def paths(entry):
+        return {path for files in entry["formats"].values() for _, path, _ in files}
+
+    static_folder = os.path.dirname(images_folder)
+    for path in paths(old_entry) - paths(new_entry):
+        try:
+            os.remove(os.path.join(static_folder, path))
+        except FileNotFoundError:
+            pass
+
+
+class Images:
+    # The images in one app's static/images folder
+    def __init__(self, images_folder: str):
+        self.folder = images_folder
+        # The manifest, reloaded whenever it's replaced
+        self.manifest_cache = VersionedCache(
+            lambda: read_manifest(images_folder), version_file=manifest_path(images_folder)
+        )
+
+    def build_in_background(self, filename: str, on_done=None):
+        # Make an image's derivatives without making the request wait for them.
+        # on_done gets called afterwards if anything was made (e.g. to clear page caches).
+        if not filename:
+            return
+
+        def run():
+            try:
+                if build(self.folder, [filename]) and on_done is not None:
+                    on_done()
+            except Exception:
+                log.exception("Failed to make smaller copies of %s", filename)
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def sources(self, filename: str, width: int) -> dict:
+        # Used by the templates to get everything needed for a <picture> element.
+        # width is roughly how wide the image gets shown, used to pick the plain `src`.
+        # Returns None if there aren't any derivatives for the image (yet).
+        entry = self.manifest_cache.get().get(filename) if filename else None
+        if entry is None:
+            return None
+
+        formats = entry["formats"]
+        fallback = formats[entry["fallback"]]
+        # The smallest copy that's at least as wide as it's shown, otherwise the biggest
+        src = next((path for w, path, _ in fallback if w >= width), fallback[-1][1])
+        return {
+            "sources": [
+                {"type": MIME_TYPES[name], "files": [(w, path) for w, path, _ in formats[name]]}
+                for name in ["avif", "webp"]
+            ],
+            "fallback": [(w, path) for w, path, _ in fallback],
+            "src": src,
+            "width": entry["width"],
+            "height": entry["height"],
+        }
+
+
+def init_app(app) -> Images:
+    # The app's images, with `image_sources()` for the templates' picture macros
+    images = Images(os.path.join(app.static_folder, "images"))
+    app.jinja_env.globals["image_sources"] = images.sources
+    return images
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Make resized copies of the images in static/images")
+    parser.add_argument("filenames", nargs="*", help="Only do these images (default: all of them)")
+    parser.add_argument("--app", default=".", help="The app's folder (with static/images in it)")
+    parser.add_argument("--force", action="store_true", help="Redo images even if they haven't changed")
+    args = parser.parse_args()
+
+    entries = build(os.path.join(args.app, "static", "images"), args.filenames or None, force=args.force, verbose=True)
+    print(f"Made copies of {len(entries)} image(s)")
@@ -0,0 +1,406 @@
+import contextvars
+import hmac
+import logging
+import sqlite3
+import threading
+from contextlib import contextmanager
+from time import perf_counter
+
+from flask import request
+from flask.signals import before_render_template, template_rendered
+
+# Timings for every request, to see where the time goes (SQLite, Jinja or bcrypt).
+#
+# For each request this measures:
+# - the total time
+# - how many SQL statements ran, and how long they took (including fetching the rows)
+# - how long templates took to render
+# - anything else wrapped in `timed()`, like hashing passwords
+#
+# These are sent back in a `Server-Timing` header (browsers show it in the dev tools'
+# network tab), and added up per route for a Prometheus `/metrics` page.
+# Statements slower than a threshold can also be logged, with their query plan.
+#
+# Only connections made with `factory=InstrumentedConnection` are timed, and only while
+# handling a request (migrations, background jobs, etc. are left alone).
+# Rows read with `for row in cursor` aren't timed (so iterating stays as quick as it
+# was), their time is counted in whatever's doing the reading, e.g. a streamed template.
+#
+# The numbers are for one worker process, like the pool stats. With several gunicorn
+# workers each scrape of /metrics only sees whichever worker answered it.
+#
+# Example usage:
+# ```
+# metrics = instrumentation.init_app(app, namespace="smile", metrics_token=token, slow_query_ms=100)
+# connection = sqlite3.connect("smile.sqlite", factory=instrumentation.InstrumentedConnection)
+# with instrumentation.timed("bcrypt"):
+#   matches = password_hasher.check(password, password_hash)
+# ```
+
+# Upper limits (seconds) of the buckets in the request duration histogram
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+slow_query_log = logging.getLogger("slow_queries")
+
+# The timings for the request being handled (each thread has its own)
+_current = contextvars.ContextVar("request_timings", default=None)
+
+
+class RequestTimings:
+    def __init__(self, route: str, slow_query_seconds: float = 0):
+        self.route = route
+        self.started = perf_counter()
+        self.slow_query_seconds = slow_query_seconds
+        self.sql_count = 0
+        self.sql_seconds = 0.0
+        # Other things being timed, e.g. {"template": 0.012, "bcrypt": 0.25}
+        self.phases = {}
+        # How many templates are being rendered right now (templates can render other templates)
+        self.rendering = 0
+        self.render_started = 0.0
+        # Whether the response is sent while it's being made (so the request isn't over yet)
+        self.streamed = False
+
+    def add(self, phase: str, seconds: float):
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    def template_started(self):
+        if self.rendering == 0:
+            self.render_started = perf_counter()
+        self.rendering += 1
+
+    def template_finished(self):
+        self.rendering -= 1
+        if self.rendering == 0:
+            self.add("template", perf_counter() - self.render_started)
+
+    def server_timing(self, total: float) -> str:
+        # The Server-Timing header, e.g. `total;dur=12.5, sql;dur=3.1;desc="4 queries", template;dur=6.2`
+        parts = [f"total;dur={total * 1000:.1f}"]
+        if self.sql_count:
+            parts.append(f'sql;dur={self.sql_seconds * 1000:.1f};desc="{self.sql_count} queries"')
+        for phase, seconds in self.phases.items():
+            parts.append(f"{phase};dur={seconds * 1000:.1f}")
+        return ", ".join(parts)
+
+
+@contextmanager
+def timed(phase: str):
+    # Count the time spent in a `with` block towards a phase of the current request.
+    # Does nothing outside of a request.
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    started = perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(phase, perf_counter() - started)
+
+
+def explain(connection: sqlite3.Connection, sql: str, parameters) -> str:
+    # SQLite's query plan for a statement, indented like the sqlite3 shell shows it.
+    # Uses a plain cursor so this doesn't get counted itself.
+    try:
+        cursor = sqlite3.Cursor(connection)
+        cursor.execute("EXPLAIN QUERY PLAN " + sql, parameters)
+        plan = cursor.fetchall()
+    except sqlite3.Error as e:
+        return f"  (no query plan: {e})"
+    depths = {0: 0}
+    lines = []
+    for id, parent, _, detail in plan:
+        depths[id] = depths.get(parent, 0) + 1
+        lines.append("  " * depths[id] + detail)
+    return "\n".join(lines) or "  (no query plan)"
+
+
+def log_slow_query(connection: sqlite3.Connection, timings: RequestTimings, statement: list):
+    sql, parameters, seconds = statement
+    # The parameters aren't logged, since they can be things like password hashes
+    plan = explain(connection, sql, parameters) if parameters is not None else "  (executemany)"
+    slow_query_log.warning(
+        "Slow query on %s (%.1fms so far): %s\n%s", timings.route, seconds * 1000, " ".join(sql.split()), plan
+    )
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    # A normal cursor that adds how long its statements take to the current request
+
+    def _add_time(self, timings: RequestTimings, seconds: float):
+        timings.sql_seconds += seconds
+        # [sql, parameters, seconds so far], or None once it's been logged as slow
+        statement = getattr(self, "_statement", None)
+        if statement is None:
+            return
+        statement[2] += seconds
+        if timings.slow_query_seconds and statement[2] >= timings.slow_query_seconds:
+            # Log it as soon as it's slow, while the connection is still around to explain it
+            log_slow_query(self.connection, timings, statement)
+            self._statement = None
+
+    def execute(self, sql: str, parameters=()):
+        timings = _current.get()
+        if timings is None:
+            return super().execute(sql, parameters)
+        timings.sql_count += 1
+        self._statement = [sql, parameters, 0.0]
+        started = perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._add_time(timings, perf_counter() - started)
+
+    def executemany(self, sql: str, parameters):
+        timings = _current.get()
+        if timings is None:
+            return super().executemany(sql, parameters)
+        timings.sql_count += 1
+        self._statement = [sql, None, 0.0]
+        started = perf_counter()
+        try:
+            return super().executemany(sql, parameters)
+        finally:
+            self._add_time(timings, perf_counter() - started)
+
+    def fetchone(self):
+        timings = _current.get()
+        if timings is None:
+            return super().fetchone()
+        started = perf_counter()
+        try:
+            return super().fetchone()
+        finally:
+            self._add_time(timings, perf_counter() - started)
+
+    def fetchmany(self, size: int = None):
+        size = self.arraysize if size is None else size
+        timings = _current.get()
+        if timings is None:
+            return super().fetchmany(size)
+        started = perf_counter()
+        try:
+            return super().fetchmany(size)
+        finally:
+            self._add_time(timings, perf_counter() - started)
+
+    def fetchall(self):
+        timings = _current.get()
+        if timings is None:
+            return super().fetchall()
+        started = perf_counter()
+        try:
+            return super().fetchall()
+        finally:
+            self._add_time(timings, perf_counter() - started)
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    # Use with `sqlite3.connect(..., factory=InstrumentedConnection)`.
+    # connection.execute() doesn't go through cursor(), so it needs replacing too.
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql: str, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql: str, parameters):
+        return self.cursor().executemany(sql, parameters)
+
+
+def _label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Metrics:
+    # Totals for each route, in Prometheus' text format
+
+    def __init__(self, namespace: str, buckets: tuple = BUCKETS):
+        self.namespace = namespace
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        # (route, method) -> {"buckets": [...], "count", "seconds", "sql_count", "sql_seconds", "phases"}
+        self._routes = {}
+        # (route, method, status) -> number of responses
+        self._responses = {}
+        # Functions returning extra numbers to show, e.g. the connection pool's stats()
+        self._collectors = []
+
+    def add_collector(self, prefix: str, function):
+        # function() returns a dictionary of numbers, each shown as `<namespace>_<prefix>_<key>`.
+        # Anything that isn't a number is left out.
+        self._collectors.append((prefix, function))
+
+    def record(self, method: str, status: int, seconds: float, timings: RequestTimings):
+        with self._lock:
+            route = self._routes.get((timings.route, method))
+            if route is None:
+                route = self._routes[(timings.route, method)] = {
+                    "buckets": [0] * len(self.buckets),
+                    "count": 0,
+                    "seconds": 0.0,
+                    "sql_count": 0,
+                    "sql_seconds": 0.0,
+                    "phases": {},
+                }
+            for i, limit in enumerate(self.buckets):
+                if seconds <= limit:
+                    route["buckets"][i] += 1
+            route["count"] += 1
+            route["seconds"] += seconds
+            route["sql_count"] += timings.sql_count
+            route["sql_seconds"] += timings.sql_seconds
+            for phase, phase_seconds in timings.phases.items():
+                route["phases"][phase] = route["phases"].get(phase, 0.0) + phase_seconds
+            key = (timings.route, method, status)
+            self._responses[key] = self._responses.get(key, 0) + 1
+
+    def prometheus(self) -> str:
+        # Docs: https://prometheus.io/docs/instrumenting/exposition_formats/
+        name = self.namespace + "_"
+        with self._lock:
+            routes = sorted(self._routes.items())
+            responses = sorted(self._responses.items())
+            lines = []
+
+            lines.append(f"# HELP {name}requests_total Responses sent, by route and status code.")
+            lines.append(f"# TYPE {name}requests_total counter")
+            for (route, method, status), count in responses:
+                lines.append(f'{name}requests_total{{route="{_label(route)}",method="{method}",status="{status}"}} {count}')
+
+            lines.append(f"# HELP {name}request_duration_seconds Time taken to handle requests.")
+            lines.append(f"# TYPE {name}request_duration_seconds histogram")
+            for (route, method), values in routes:
+                labels = f'route="{_label(route)}",method="{method}"'
+                for limit, count in zip(self.buckets, values["buckets"]):
+                    lines.append(f'{name}request_duration_seconds_bucket{{{labels},le="{limit}"}} {count}')
+                lines.append(f'{name}request_duration_seconds_bucket{{{labels},le="+Inf"}} {values["count"]}')
+                lines.append(f'{name}request_duration_seconds_sum{{{labels}}} {values["seconds"]:.6f}')
+                lines.append(f'{name}request_duration_seconds_count{{{labels}}} {values["count"]}')
+
+            lines.append(f"# HELP {name}sql_statements_total SQL statements run while handling requests.")
+            lines.append(f"# TYPE {name}sql_statements_total counter")
+            for (route, method), values in routes:
+                lines.append(f'{name}sql_statements_total{{route="{_label(route)}",method="{method}"}} {values["sql_count"]}')
+
+            lines.append(f"# HELP {name}sql_seconds_total Time spent running SQL statements and fetching their rows.")
+            lines.append(f"# TYPE {name}sql_seconds_total counter")
+            for (route, method), values in routes:
+                lines.append(
+                    f'{name}sql_seconds_total{{route="{_label(route)}",method="{method}"}} {values["sql_seconds"]:.6f}'
+                )
+
+            lines.append(f"# HELP {name}phase_seconds_total Time spent rendering templates, hashing passwords, etc.")
+            lines.append(f"# TYPE {name}phase_seconds_total counter")
+            for (route, method), values in routes:
+                for phase, seconds in sorted(values["phases"].items()):
+                    lines.append(
+                        f'{name}phase_seconds_total{{route="{_label(route)}",method="{method}",phase="{_label(phase)}"}}'
+                        f" {seconds:.6f}"
+                    )
+
+        for prefix, function in self._collectors:
+            for key, value in function().items():
+                if isinstance(value, (int, float)):
+                    lines.append(f"# TYPE {name}{prefix}_{key} gauge")
+                    lines.append(f"{name}{prefix}_{key} {float(value)}")
+
+        return "\n".join(lines) + "\n"
+
+
+def init_app(
+    app,
+    namespace: str,
+    metrics_path: str = "",
+    metrics_token: str = "",
+    server_timing: bool = True,
+    slow_query_ms: float = 0,
+) -> Metrics:
+    # Time every request.
+    # Call this before adding any other before_request functions, so their time is counted too.
+    # namespace: goes at the start of the metric names, e.g. "smile" -> smile_requests_total
+    # metrics_path: where the Prometheus page goes, or "" to not have one
+    #   (it shows how busy everything is, so it's off unless it's asked for)
+    # metrics_token: if set, the Prometheus page needs `Authorization: Bearer <token>`,
+    #   and goes at /metrics if there's no metrics_path
+    # server_timing: whether to add the Server-Timing header to responses
+    # slow_query_ms: log statements slower than this (milliseconds), or 0 to not log them.
+    metrics = Metrics(namespace)
+    slow_query_seconds = slow_query_ms / 1000
+
+    def start(request):
+        timings = RequestTimings(request.endpoint or "unmatched", slow_query_seconds)
+        _current.set(timings)
+        return timings
+
+    def finish(request, response):
+        timings = _current.get()
+        if timings is None:
+            return response
+        if server_timing:
+            # Streamed responses haven't been sent yet, so this only covers the time until
+            # they start. /metrics gets the whole time (see record_when_sent()).
+            response.headers["Server-Timing"] = timings.server_timing(perf_counter() - timings.started)
+        return response
+
+    def record(method: str, status: int, timings: RequestTimings):
+        metrics.record(method, status, perf_counter() - timings.started, timings)
+
+    def show_metrics():
+        if metrics_token and not hmac.compare_digest(
+            request.headers.get("Authorization", "").encode(), f"Bearer {metrics_token}".encode()
+        ):
+            return app.response_class("Unauthorized\n", status=401, mimetype="text/plain",
+                                      headers={"WWW-Authenticate": "Bearer"})
+        return app.response_class(metrics.prometheus(), mimetype="text/plain; version=0.0.4")
+
+    @app.before_request
+    def start_timing():
+        start(request)
+
+    @app.after_request
+    def add_timings(response):
+        finish(request, response)
+        timings = _current.get()
+        if timings is not None:
+            timings.streamed = response.is_streamed
+            method, status = request.method, response.status_code
+
+            def sent():
+                # Record it once it's been sent, so streamed pages are counted properly
+                record(method, status, timings)
+                if _current.get() is timings:
+                    _current.set(None)
+
+            response.call_on_close(sent)
+        return response
+
+    @app.teardown_request
+    def stop_timing(error):
+        # Flask runs this as soon as the view returns, even if the response is still being
+        # streamed (and again once it's sent), so streamed responses stop in sent() instead
+        timings = _current.get()
+        if timings is not None and not timings.streamed:
+            _current.set(None)
+
+    def template_started(sender, **extra):
+        timings = _current.get()
+        if timings is not None:
+            timings.template_started()
+
+    def template_finished(sender, **extra):
+        timings = _current.get()
+        if timings is not None:
+            timings.template_finished()
+
+    before_render_template.connect(template_started, app, weak=False)
+    template_rendered.connect(template_finished, app, weak=False)
+
+    if metrics_token and not metrics_path:
+        metrics_path = "/metrics"
+    if metrics_path:
+        app.add_url_rule(metrics_path, "metrics", show_metrics, methods=["GET"])
+
+    return metrics
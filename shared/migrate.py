@@ -0,0 +1,138 @@
+import argparse
+import os
+import re
+import sqlite3
+
+
+# Runs the database migrations in an app's `migrations` folder. Both apps use this,
+# each with their own folder (see migrate.py in each app).
+#
+# Each migration is a .sql file named like `0003_indexes.sql`, and the number at the
+# start is the schema version the database is at after it's run. The current version
+# is stored in the database itself, using SQLite's `user_version` pragma:
+# https://www.sqlite.org/pragma.html#pragma_user_version
+#
+# Every migration runs in its own transaction along with the version update,
+# so if one fails the database is left at the last version that worked.
+# The transaction takes the write lock before checking the version, so if several
+# worker processes start at once, only one of them runs each migration.
+#
+# The apps run this on startup, but it can also be run by hand from the app's folder:
+# ```
+# python migrate.py              # Upgrade the app's database to the latest version
+# python migrate.py --status     # Show the current version & pending migrations
+# ```
+#
+# To change the schema, add a new file with the next number. Never edit a migration
+# that's already been run somewhere, since it won't be run again.
+
+
+def get_migrations(folder: str) -> list:
+    # Get a sorted list of (version, name, path) for all the migration files
+    migrations = []
+    for filename in os.listdir(folder):
+        match = re.fullmatch(r"(\d+)_(.+)\.sql", filename)
+        if match is None:
+            continue
+        version = int(match.group(1))
+        migrations.append((version, match.group(2), os.path.join(folder, filename)))
+
+    migrations.sort()
+
+    # Catch two files with the same number, which would make the order ambiguous
+    versions = [version for version, _, _ in migrations]
+    if len(versions) != len(set(versions)):
+        raise ValueError(f"Two migrations in {folder} have the same version number")
+
+    return migrations
+
+
+def split_statements(sql: str) -> list:
+    # Split a script into separate statements, so they can be run inside our own transaction.
+    # sqlite3.complete_statement() knows about strings, comments and triggers
+    # (which have ; inside them), so this only splits in the right places.
+    statements = []
+    current = ""
+    for chunk in sql.split(";"):
+        current += chunk + ";"
+        if sqlite3.complete_statement(current):
+            # Skip the empty "statement" after the last ;
+            if current.strip() != ";":
+                statements.append(current.strip())
+            current = ""
+    return statements
+
+
+def get_schema_version(connection: sqlite3.Connection) -> int:
+    return connection.execute("PRAGMA user_version").fetchone()[0]
+
+
+def run_migrations(database: str, migrations_folder: str, target: int = None, verbose: bool = False) -> int:
+    # Upgrade the database to the `target` version (or the latest if it's None), using the
+    # migrations in `migrations_folder`.
+    # Returns the version the database is at afterwards.
+    # Wait a while if another process is running migrations at the same time
+    connection = sqlite3.connect(database, timeout=30)
+    # Manage transactions ourselves, instead of the sqlite3 module doing it
+    connection.isolation_level = None
+    try:
+        version = get_schema_version(connection)
+
+        for migration_version, name, path in get_migrations(migrations_folder):
+            if migration_version <= version:
+                continue
+            if target is not None and migration_version > target:
+                break
+
+            with open(path, "r", encoding="utf8") as f:
+                statements = split_statements(f.read())
+
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                # Another process might have run it while we were waiting for the lock
+                version = get_schema_version(connection)
+                if migration_version <= version:
+                    connection.execute("COMMIT")
+                    continue
+
+                if verbose:
+                    print(f"Running migration {migration_version} ({name})")
+
+                for statement in statements:
+                    connection.execute(statement)
+                connection.execute(f"PRAGMA user_version = {migration_version}")
+                connection.execute("COMMIT")
+            except sqlite3.Error as e:
+                connection.execute("ROLLBACK")
+                raise sqlite3.DatabaseError(
+                    f"Migration {migration_version} ({name}) failed: {e}"
+                ) from e
+
+            version = migration_version
+
+        return version
+    finally:
+        connection.close()
+
+
+def main(migrations_folder: str, default_database: str, description: str):
+    # The command line for an app's migrate.py
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("--database", default=default_database, help="Path to the database")
+    parser.add_argument("--target", type=int, help="Version to upgrade to (default: latest)")
+    parser.add_argument(
+        "--status", action="store_true", help="Show the current version without changing anything"
+    )
+    args = parser.parse_args()
+
+    if args.status:
+        connection = sqlite3.connect(args.database)
+        current_version = get_schema_version(connection)
+        connection.close()
+        print(f"{args.database} is at schema version {current_version}")
+        for migration_version, name, _ in get_migrations(migrations_folder):
+            if migration_version > current_version:
+                print(f"Pending: {migration_version} ({name})")
+    else:
+        new_version = run_migrations(args.database, migrations_folder, target=args.target, verbose=True)
+        print(f"{args.database} is at schema version {new_version}")
@@ -0,0 +1,174 @@
+import os
+import re
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import bcrypt
+
+# Password hashing, done in a small pool of separate processes.
+#
+# bcrypt is slow on purpose (about a quarter of a second at the default cost), so
+# hashing on the request thread means a burst of logins can hog the whole worker.
+# Instead, hashing is sent to a few helper processes, which also run at a lower
+# priority than the web server so pages stay quick while they're busy.
+# If too many hashes are already waiting, new ones are refused straight away
+# (PasswordHasherBusy) instead of piling up.
+#
+# Example usage:
+# ```
+# hasher = PasswordHasher(rounds=12)
+# password_hash = hasher.hash("hunter22")
+# if hasher.check("hunter22", password_hash):
+#   if hasher.needs_rehash(password_hash):
+#     ...save hasher.hash("hunter22")
+# ```
+
+# bcrypt only looks at the first 72 bytes of a password. Older versions of the bcrypt
+# library cut them off silently, so do the same to keep old hashes working.
+MAX_PASSWORD_BYTES = 72
+
+BCRYPT_HASH = re.compile(r"^\$2[abxy]?\$(\d\d)\$")
+
+
+class PasswordHasherBusy(Exception):
+    # Raised when too many passwords are already waiting to be hashed
+    pass
+
+
+def _password_bytes(password: str) -> bytes:
+    return password.encode("utf8")[:MAX_PASSWORD_BYTES]
+
+
+def _hash_bytes(password_hash) -> bytes:
+    # Hashes are stored as text, but the cafe used to store them as bytes
+    if isinstance(password_hash, str):
+        return password_hash.encode("utf8")
+    return password_hash
+
+
+# These run in the helper processes, so they have to be normal top level functions
+
+
+def hash_password(password: str, rounds: int) -> str:
+    return bcrypt.hashpw(_password_bytes(password), bcrypt.gensalt(rounds)).decode("utf8")
+
+
+def check_password(password: str, password_hash) -> bool:
+    try:
+        return bcrypt.checkpw(_password_bytes(password), _hash_bytes(password_hash))
+    except ValueError:
+        # Not a valid bcrypt hash
+        return False
+
+
+def _lower_priority(nice: int):
+    try:
+        os.nice(nice)
+    except (AttributeError, OSError):
+        # Not supported on Windows
+        pass
+
+
+class PasswordHasher:
+    def __init__(self, rounds: int = 12, workers: int = 2, max_queue: int = 8, nice: int = 10):
+        # rounds: bcrypt cost factor. Each one extra doubles how long hashing takes.
+        #   Changing it makes users' hashes get upgraded the next time they log in.
+        # workers: number of helper processes. 0 hashes on the calling thread instead.
+        # max_queue: most hashes that can be running or waiting at once
+        # nice: how much lower the helper processes' priority is (see `man nice`)
+        self.rounds = rounds
+        self.workers = workers
+        self.max_queue = max_queue
+        self.nice = nice
+
+        self._lock = threading.Lock()
+        self._executor = None
+        self._executor_pid = None
+        self._queued = 0
+
+        self.refused = 0
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        # Each worker process gets its own pool (like the database pool),
+        # since a pool can't be used after a fork
+        if self._executor is None or self._executor_pid != os.getpid():
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers, initializer=_lower_priority, initargs=(self.nice,)
+            )
+            self._executor_pid = os.getpid()
+        return self._executor
+
+    def submit(self, function, *args) -> Future:
+        # Run one of the functions above in the pool and return a Future for the result.
+        with self._lock:
+            if self._queued >= self.max_queue:
+                self.refused += 1
+                raise PasswordHasherBusy("Too many people are logging in right now. Try again soon.")
+            self._queued += 1
+
+        if self.workers <= 0:
+            future = Future()
+            try:
+                future.set_result(function(*args))
+            except Exception as e:
+                future.set_exception(e)
+            finally:
+                with self._lock:
+                    self._queued -= 1
+            return future
+
+        with self._lock:
+            executor = self._get_executor()
+        try:
+            future = executor.submit(function, *args)
+        except BaseException as e:
+            with self._lock:
+                self._queued -= 1
+                if isinstance(e, BrokenProcessPool):
+                    self._drop_executor(executor)
+            raise
+        future.add_done_callback(lambda future: self._finished(future, executor))
+        return future
+
+    def _drop_executor(self, executor: ProcessPoolExecutor):
+        # A helper process died (e.g. killed for using too much memory), which breaks
+        # the whole pool. Forget it so the next submit() starts a new one.
+        # (A broken pool has already shut itself down.)
+        if self._executor is executor:
+            self._executor = None
+
+    def _finished(self, future: Future, executor: ProcessPoolExecutor):
+        with self._lock:
+            self._queued -= 1
+            if not future.cancelled() and isinstance(future.exception(), BrokenProcessPool):
+                self._drop_executor(executor)
+
+    def submit_hash(self, password: str) -> Future:
+        return self.submit(hash_password, password, self.rounds)
+
+    def submit_check(self, password: str, password_hash) -> Future:
+        return self.submit(check_password, password, password_hash)
+
+    def hash(self, password: str) -> str:
+        return self.submit_hash(password).result()
+
+    def check(self, password: str, password_hash) -> bool:
+        return self.submit_check(password, password_hash).result()
+
+    def needs_rehash(self, password_hash) -> bool:
+        # Whether a hash was made with a different cost factor than the current one
+        if isinstance(password_hash, bytes):
+            password_hash = password_hash.decode("utf8", "replace")
+        match = BCRYPT_HASH.match(password_hash)
+        return match is None or int(match.group(1)) != self.rounds
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "rounds": self.rounds,
+                "workers": self.workers,
+                "queued": self._queued,
+                "max_queue": self.max_queue,
+                "refused": self.refused,
+            }
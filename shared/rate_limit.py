@@ -0,0 +1,61 @@
+import threading
+from collections import OrderedDict
+from time import monotonic
+
+# "Token bucket" rate limiting, used to slow down password guessing.
+#
+# Everyone (e.g. each IP address, or each username) gets a bucket that holds up to
+# `capacity` tokens and refills at `rate` tokens per second. Each attempt takes a token,
+# and attempts are refused when the bucket is empty. So a few quick attempts are fine,
+# but keeping it up gets slowed right down.
+#
+# The buckets are kept in memory in each worker process, so with several workers the
+# real limit is a bit higher. That's fine for stopping floods of attempts.
+# Behind a proxy (like nginx), request.remote_addr is the proxy's address, so use
+# werkzeug's ProxyFix to get the real one, otherwise everyone shares a bucket.
+#
+# Example usage:
+# ```
+# limiter = RateLimiter(capacity=5, rate=1 / 60)  # 5 at once, then 1 a minute
+# wait = limiter.hit(request.remote_addr)
+# if wait > 0:
+#   return f"Try again in {wait:.0f} seconds"
+# ```
+
+
+class RateLimiter:
+    def __init__(self, capacity: float, rate: float, max_keys: int = 100000):
+        # capacity: most attempts allowed at once. 0 means no limit (so a limit can be
+        #   turned off in the config without a special case)
+        # rate: tokens added back per second
+        # max_keys: most buckets to keep track of. The least recently used are forgotten
+        #   (which just gives them a full bucket again).
+        self.capacity = capacity
+        self.rate = rate
+        self.max_keys = max_keys
+
+        self._lock = threading.Lock()
+        # key -> (tokens, time they were counted)
+        self._buckets = OrderedDict()
+
+    def hit(self, key) -> float:
+        # Take a token for `key`. Returns 0 if that's allowed, otherwise how many
+        # seconds until there'll be a token (and no token is taken).
+        if self.capacity <= 0 or self.rate <= 0:
+            return 0.0
+        now = monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (self.capacity, now))
+            tokens = min(self.capacity, tokens + (now - updated_at) * self.rate)
+
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0.0
+            else:
+                wait = (1 - tokens) / self.rate
+
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return wait
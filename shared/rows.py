@@ -0,0 +1,53 @@
+import sqlite3
+
+# Faster rows for database query results.
+#
+# The apps used to turn every row into a dictionary with a Python function
+# (db_dict_factory), which went through cursor.description and built a new dict
+# for each row. On big queries like `SELECT * FROM Words` that was most of the time
+# spent in Python. sqlite3.Row is made in C and shares the column names between all
+# the rows of a query, so it's almost as quick as getting plain tuples.
+#
+# Row is sqlite3.Row with a few extras so it can be used like the old dictionaries:
+# - row["Name"] and row.Name both work (so templates can use either)
+# - row.get("Name", default)
+# - dict(row) or as_dicts(rows) when real dictionaries are needed, e.g. for JSON
+#
+# Things that are different from dictionaries:
+# - Rows can't be changed. Make a dict(row) first if you need to.
+# - `for value in row` and `value in row` use the values, not the column names.
+# - A missing column raises IndexError instead of KeyError.
+# - Column names are looked up ignoring case, so row["id"] and row["ID"] are the same.
+#
+# Example usage:
+# ```
+# connection.row_factory = Row
+# word = connection.execute("SELECT * FROM Words WHERE ID = 1").fetchone()
+# word.MaoriSpelling == word["MaoriSpelling"]
+# ```
+
+
+class Row(sqlite3.Row):
+    # No per-row __dict__, so rows stay as small as sqlite3.Row's
+    __slots__ = ()
+
+    def __getattr__(self, name: str):
+        # Only called when there's no normal attribute with this name,
+        # so methods like keys() still work
+        if name.startswith("__"):
+            raise AttributeError(name)
+        try:
+            return self[name]
+        except IndexError:
+            raise AttributeError(name) from None
+
+    def get(self, name: str, default=None):
+        try:
+            return self[name]
+        except IndexError:
+            return default
+
+
+def as_dicts(rows: list) -> list:
+    # Turn rows into normal dictionaries (e.g. for jsonify())
+    return [dict(row) for row in rows]
@@ -0,0 +1,262 @@
+import argparse
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import shutil
+
+# Build step for the static folder, so browsers can cache files forever.
+#
+# Normally a browser has to ask "has smile.css changed?" on every page load.
+# `python -m shared.static_assets --app cafe-thingy` copies the app's static/ to
+# build/static/ and adds a copy of each file with a hash of its contents in the name
+# (smile.css -> smile.3f2a9c1b7d.css), plus .gz and .br compressed copies of text
+# files. The app then links to the hashed names (see init_app()). A file with a hash in its name can never change,
+# so it's sent with `Cache-Control: immutable` and a one year expiry, and
+# changing the file changes its URL.
+#
+# In production, adding `--nginx-config` writes an nginx config
+# that serves build/static/ directly, so Python never has to send static files.
+#
+# Run the build again after changing anything in static/. In debug mode (`flask --debug`
+# or `python app.py`) the build is ignored, so changes show up straight away.
+
+BUILD_FOLDER = os.path.join("build", "static")
+MANIFEST_FILENAME = "assets.json"
+
+# Files with a hash of their contents in their name, e.g. from this script or images.py
+HASHED_FILENAME = re.compile(r"\.[0-9a-f]{10}\.[A-Za-z0-9]+$")
+# How long browsers can keep hashed files for (one year, the most that's allowed)
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+# Compressed copies are only kept if they're at least this much smaller
+MIN_COMPRESSION_SAVING = 0.05
+# Encodings to precompress with, best first (brotli is optional, see compress())
+ENCODINGS = {"br": ".br", "gzip": ".gz"}
+
+
+def file_hash(data: bytes) -> str:
+    return hashlib.sha1(data).hexdigest()[:10]
+
+
+def is_compressible(filename: str) -> bool:
+    # Text files compress well. Images (other than SVGs) are already compressed.
+    mimetype = mimetypes.guess_type(filename)[0] or ""
+    return (
+        mimetype.startswith("text/")
+        or mimetype in ("application/javascript", "application/json", "image/svg+xml")
+    )
+
+
+def compress(data: bytes) -> dict:
+    # Compressed copies of some data, as {encoding: bytes}
+    compressed = {"gzip": gzip.compress(data, compresslevel=9, mtime=0)}
+    try:
+        import brotli
+
+        compressed["br"] = brotli.compress(data, quality=11)
+    except ImportError:
+        # brotli is only needed for the build, and gzip is fine without it
+        pass
+    return {
+        encoding: result
+        for encoding, result in compressed.items()
+        if len(result) <= len(data) * (1 - MIN_COMPRESSION_SAVING)
+    }
+
+
+def write_file(path: str, data: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def build(static_folder: str, output_folder: str, verbose: bool = False) -> dict:
+    # Build the static files into output_folder and return the manifest,
+    # which maps each original filename to its hashed one.
+    # It's built next to the old build and swapped in at the end, so a running app
+    # never sees a half-finished build.
+    temp_folder = output_folder.rstrip("/") + ".tmp"
+    shutil.rmtree(temp_folder, ignore_errors=True)
+
+    manifest = {}
+    original_size = 0
+    compressed_size = 0
+    for folder, _, filenames in os.walk(static_folder):
+        for filename in sorted(filenames):
+            source_path = os.path.join(folder, filename)
+            # Paths in the manifest use / like URLs do
+            name = os.path.relpath(source_path, static_folder).replace(os.sep, "/")
+            with open(source_path, "rb") as f:
+                data = f.read()
+
+            if HASHED_FILENAME.search(name):
+                # Already has a hash in its name
+                hashed_name = name
+            else:
+                stem, extension = os.path.splitext(name)
+                hashed_name = f"{stem}.{file_hash(data)}{extension}"
+            manifest[name] = hashed_name
+
+            # Keep the original name too, for anything that doesn't use url_for()
+            names = {name, hashed_name}
+            variants = {"": data}
+            if is_compressible(name):
+                for encoding, compressed in compress(data).items():
+                    variants[ENCODINGS[encoding]] = compressed
+                    if encoding == "gzip":
+                        original_size += len(data)
+                        compressed_size += len(compressed)
+            for output_name in names:
+                for suffix, variant in variants.items():
+                    write_file(os.path.join(temp_folder, output_name + suffix), variant)
+
+    write_file(os.path.join(temp_folder, MANIFEST_FILENAME), json.dumps(manifest, indent=1).encode())
+
+    # Swap the new build in
+    old_folder = output_folder.rstrip("/") + ".old"
+    shutil.rmtree(old_folder, ignore_errors=True)
+    if os.path.exists(output_folder):
+        os.rename(output_folder, old_folder)
+    os.rename(temp_folder, output_folder)
+    shutil.rmtree(old_folder, ignore_errors=True)
+
+    if verbose:
+        print(f"Built {len(manifest)} files into {output_folder}")
+        if original_size:
+            print(f"Text files: {original_size / 1024:,.1f} KiB, {compressed_size / 1024:,.1f} KiB gzipped")
+    return manifest
+
+
+def read_manifest(output_folder: str) -> dict:
+    try:
+        with open(os.path.join(output_folder, MANIFEST_FILENAME)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def init_app(app, output_folder: str = None):
+    # Make `url_for("static", ...)` give hashed filenames, and serve static files
+    # with long cache times and precompressed copies.
+    # Does nothing if there's no build, or in debug mode. app.debug is checked on each
+    # request, since `app.run(debug=True)` only turns it on after this has run.
+    if output_folder is None:
+        output_folder = os.path.join(app.root_path, BUILD_FOLDER)
+    manifest = read_manifest(output_folder)
+    if manifest is None:
+        return
+
+    @app.url_defaults
+    def hashed_static_url(endpoint, values):
+        if app.debug:
+            return
+        if endpoint == "static" and values.get("filename") in manifest:
+            values["filename"] = manifest[values["filename"]]
+
+    def find_file(filename: str, accept_encodings) -> tuple:
+        # Find the file to send, as (path, content encoding).
+        # Files added since the build (like images made by images.py) are only in the
+        # normal static folder, so look there too.
+        from werkzeug.security import safe_join
+
+        for folder in [output_folder, app.static_folder]:
+            path = safe_join(folder, filename)
+            if path is None or not os.path.isfile(path):
+                continue
+            encoding = accept_encodings.best_match([e for e in ENCODINGS if os.path.isfile(path + ENCODINGS[e])])
+            if encoding is not None:
+                return (path + ENCODINGS[encoding], encoding)
+            return (path, None)
+        return (None, None)
+
+    def add_headers(response, filename: str, encoding: str):
+        if encoding is not None:
+            response.headers["Content-Encoding"] = encoding
+        if is_compressible(filename):
+            # Caches need to know the response depends on Accept-Encoding
+            response.vary.add("Accept-Encoding")
+        if HASHED_FILENAME.search(filename):
+            response.cache_control.public = True
+            response.cache_control.max_age = IMMUTABLE_MAX_AGE
+            response.cache_control.immutable = True
+        return response
+
+    from flask import request, send_file
+    from werkzeug.exceptions import NotFound
+
+    send_static_file = app.view_functions["static"]
+
+    def serve_static(filename):
+        if app.debug:
+            return send_static_file(filename=filename)
+        path, encoding = find_file(filename, request.accept_encodings)
+        if path is None:
+            raise NotFound()
+        response = send_file(
+            path, mimetype=mimetypes.guess_type(filename)[0], conditional=True,
+            max_age=IMMUTABLE_MAX_AGE if HASHED_FILENAME.search(filename) else None,
+        )
+        return add_headers(response, filename, encoding)
+
+    # Replace the normal static file handler
+    app.view_functions["static"] = serve_static
+
+
+def nginx_config(app_folder: str, output_folder: str) -> str:
+    # An nginx config for serving the build directly. Goes inside a `server { }` block,
+    # along with whatever passes everything else on to the app.
+    build_root = os.path.dirname(os.path.abspath(output_folder))
+    app_folder = os.path.abspath(app_folder)
+    return f"""# Made by static_assets.py. Put this in the `server {{ }}` block for the app.
+# Brotli needs the ngx_brotli module. Without it, take out the brotli_static lines.
+# gzip_vary only adds `Vary: Accept-Encoding` to files that have a compressed copy.
+
+# Files with a hash in their name never change, so browsers can keep them forever
+location ~ "^/static/.+\\.[0-9a-f]{{10}}\\.[A-Za-z0-9]+$" {{
+    root {build_root};
+    gzip_static on;
+    brotli_static on;
+    gzip_vary on;
+    add_header Cache-Control "public, max-age={IMMUTABLE_MAX_AGE}, immutable";
+    try_files $uri @static_source;
+}}
+
+location /static/ {{
+    root {build_root};
+    gzip_static on;
+    brotli_static on;
+    gzip_vary on;
+    try_files $uri @static_source;
+}}
+
+# Files added since the last build (like new images from images.py)
+location @static_source {{
+    root {app_folder};
+}}
+"""
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build static files with hashed names and compressed copies")
+    parser.add_argument("--app", default=".", help="The app's folder (with static in it)")
+    parser.add_argument("--static", help="The static folder (default: static in the app's folder)")
+    parser.add_argument("--output", help=f"Where to put the build (default: {BUILD_FOLDER} in the app's folder)")
+    parser.add_argument(
+        "--nginx-config",
+        action="store_true",
+        help="Also write an nginx config for serving the build (to build/nginx.conf)",
+    )
+    args = parser.parse_args()
+    app_folder = os.path.abspath(args.app)
+    args.static = args.static or os.path.join(app_folder, "static")
+    args.output = args.output or os.path.join(app_folder, BUILD_FOLDER)
+
+    build(args.static, args.output, verbose=True)
+    if args.nginx_config:
+        path = os.path.join(os.path.dirname(os.path.abspath(args.output)), "nginx.conf")
+        with open(path, "w") as f:
+            f.write(nginx_config(app_folder, args.output))
+        print(f"Wrote {path}")